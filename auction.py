@@ -0,0 +1,94 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+@author: Desmond Tan
+
+Call auctions, e.g. to open or close the market in a stock.
+
+While a stock is in auction its orders collect in the book without matching.
+The book is then uncrossed at the single price that executes the most
+shares. At each price the demand is the quantity of every buy that would
+pay it, and the supply the quantity of every sell that would accept it.
+Both are cumulative sums over the price levels, so once the prices are
+sorted the uncrossing price is found in one pass over them.
+"""
+from array import array
+from itertools import accumulate
+
+from orderbook import BUY, SELL
+
+
+def auction_depth(book, direction):
+    """Get the open quantity of one side of a book by price in ticks, and the
+    quantity of its market orders without a price limit. A market order with
+    a collar is counted as a limit order at its collar."""
+    quantities = {}
+    for level in book.limit_orders[direction].iter_levels():
+        quantity = level.quantity
+        if quantity:
+            quantities[level.ticks] = quantity
+    unlimited = 0
+    for order in book.market_orders[direction]:
+        quantity = order.quantity - order.filled
+        if order.collar is None:
+            unlimited += quantity
+        else:
+            quantities[order.collar] = quantities.get(order.collar, 0) + quantity
+    return quantities, unlimited
+
+
+def uncrossing_price(bids, asks, market_buys=0, market_sells=0, reference=None):
+    """Find the price in ticks that executes the most shares.
+
+    bids and asks are the open quantities by price in ticks, market_buys and
+    market_sells the quantities that trade at any price. Ties go to the price
+    with the smallest surplus, then to the highest price if the surplus is
+    on the buy side at every tied price or the lowest if it is on the sell
+    side, then to the price closest to the reference price. Market orders
+    alone cross at the reference price. Returns (ticks, volume), or None if
+    nothing can execute."""
+    prices = sorted(bids.keys() | asks.keys())
+    if not prices:
+        volume = min(market_buys, market_sells)
+        if not volume or reference is None:
+            return None
+        return reference, volume
+
+    # supply[i] is the quantity offered at prices[i] or lower, demand[i] the quantity bid at prices[i] or higher
+    supply = array('q', accumulate((asks.get(ticks, 0) for ticks in prices), initial=market_sells))[1:]
+    demand = array('q', accumulate((bids.get(ticks, 0) for ticks in reversed(prices)), initial=market_buys))[:0:-1]
+    best_volume = 0
+    best_surplus = 0
+    tied = []
+    for index in range(len(prices)):
+        bid = demand[index]
+        ask = supply[index]
+        volume = bid if bid < ask else ask
+        if not volume or volume < best_volume:
+            continue
+        surplus = abs(bid - ask)
+        if volume > best_volume or surplus < best_surplus:
+            best_volume = volume
+            best_surplus = surplus
+            tied = [index]
+        elif surplus == best_surplus:
+            tied.append(index)
+    if not best_volume:
+        return None
+
+    if all(demand[index] > supply[index] for index in tied):
+        ticks = prices[tied[-1]]
+    elif all(demand[index] < supply[index] for index in tied) or reference is None:
+        ticks = prices[tied[0]]
+    else:
+        ticks = min((prices[index] for index in tied), key=lambda ticks: (abs(ticks - reference), ticks))
+    return ticks, best_volume
+
+
+def auction_price(book):
+    """Get the uncrossing price in ticks and the volume of a book, see
+    uncrossing_price, with the last price as the reference price. None if
+    nothing can execute."""
+    bids, market_buys = auction_depth(book, BUY)
+    asks, market_sells = auction_depth(book, SELL)
+    return uncrossing_price(bids, asks, market_buys, market_sells, book.trades.last_ticks())
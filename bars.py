@@ -0,0 +1,164 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+@author: Desmond Tan
+
+OHLCV bars and VWAP of a stock, updated in O(1) as each trade is recorded.
+"""
+from array import array
+from bisect import bisect_left
+
+
+NANOSECONDS = {'s': 10 ** 9, 'm': 60 * 10 ** 9, 'h': 3600 * 10 ** 9}
+
+# Bar intervals kept for every stock by default
+BAR_INTERVALS = ('1s', '1m', '5m')
+
+
+def parse_interval(interval):
+    """Convert an interval such as '1s', '5m' or '1h' to nanoseconds."""
+    unit = NANOSECONDS.get(interval[-1:])
+    if unit is None or not interval[:-1].isdigit() or not int(interval[:-1]):
+        raise Exception(f'Invalid bar interval {interval}')
+    return int(interval[:-1]) * unit
+
+
+class BarSeries:
+    """Bars of a single interval, stored column by column.
+
+    Each bar holds the start time in nanoseconds, the open, high, low and
+    close prices in ticks, the volume, the notional in ticks times shares
+    for the VWAP of the bar, and the number of trades. Trades are expected in
+    time order; a trade older than the last bar is added to the last bar.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.start = array('q')
+        self.open = array('q')
+        self.high = array('q')
+        self.low = array('q')
+        self.close = array('q')
+        self.volume = array('q')
+        self.notional = array('q')
+        self.trades = array('q')
+
+    def update(self, timestamp, ticks, quantity, trades=1):
+        start = timestamp - timestamp % self.interval
+        if self.start and start <= self.start[-1]:
+            if ticks > self.high[-1]:
+                self.high[-1] = ticks
+            elif ticks < self.low[-1]:
+                self.low[-1] = ticks
+            self.close[-1] = ticks
+            self.volume[-1] += quantity
+            self.notional[-1] += ticks * quantity
+            self.trades[-1] += trades
+        else:
+            self.start.append(start)
+            self.open.append(ticks)
+            self.high.append(ticks)
+            self.low.append(ticks)
+            self.close.append(ticks)
+            self.volume.append(quantity)
+            self.notional.append(ticks * quantity)
+            self.trades.append(trades)
+
+    def range(self, start=None, end=None):
+        """Get the indexes of the bars starting in [start, end), found by bisection."""
+        first = bisect_left(self.start, start) if start is not None else 0
+        last = bisect_left(self.start, end) if end is not None else len(self.start)
+        return first, last
+
+    def __len__(self):
+        return len(self.start)
+
+
+class Bars:
+    """The bars of every interval of a stock, and its running VWAP.
+
+    Trades that fall in the current bar of every interval, which is nearly
+    all of them, are only added to a pending bar. The pending bar is folded
+    into the current bar of each interval when a trade crosses into a new
+    bar of any interval, or when the bars are queried.
+    """
+
+    def __init__(self, stock, intervals=BAR_INTERVALS):
+        self.stock = stock
+        self.series = {interval: BarSeries(parse_interval(interval)) for interval in intervals}
+        self.volume = 0
+        self.notional = 0
+        # Start of the earliest next bar of any interval
+        self.boundary = None
+        self.pending_high = 0
+        self.pending_low = 0
+        self.pending_close = 0
+        self.pending_volume = 0
+        self.pending_notional = 0
+        self.pending_trades = 0
+
+    def update(self, timestamp, ticks, quantity, trades=1):
+        """Add a trade to every bar series and to the VWAP, or a number of
+        trades made at one time and price, of a total quantity."""
+        notional = ticks * quantity
+        self.volume += quantity
+        self.notional += notional
+        if self.boundary is not None and timestamp < self.boundary:
+            if not self.pending_trades:
+                self.pending_high = self.pending_low = ticks
+            elif ticks > self.pending_high:
+                self.pending_high = ticks
+            elif ticks < self.pending_low:
+                self.pending_low = ticks
+            self.pending_close = ticks
+            self.pending_volume += quantity
+            self.pending_notional += notional
+            self.pending_trades += trades
+            return
+
+        self.fold()
+        for series in self.series.values():
+            series.update(timestamp, ticks, quantity, trades)
+        if self.series:
+            self.boundary = min(series.start[-1] + series.interval for series in self.series.values())
+
+    def fold(self):
+        """Add the pending bar to the current bar of every interval."""
+        if not self.pending_trades:
+            return
+        for series in self.series.values():
+            if self.pending_high > series.high[-1]:
+                series.high[-1] = self.pending_high
+            if self.pending_low < series.low[-1]:
+                series.low[-1] = self.pending_low
+            series.close[-1] = self.pending_close
+            series.volume[-1] += self.pending_volume
+            series.notional[-1] += self.pending_notional
+            series.trades[-1] += self.pending_trades
+        self.pending_volume = self.pending_notional = self.pending_trades = 0
+
+    def vwap(self):
+        """Get the volume-weighted average price of every trade so far, or 0 if there are none."""
+        if not self.volume:
+            return 0
+        return self.stock.to_price(1) * self.notional / self.volume
+
+    def query(self, interval, start=None, end=None):
+        """Get the bars of an interval starting in [start, end), in nanoseconds,
+        as a dict of arrays for charting: time, open, high, low, close,
+        volume, vwap and trades. Prices are in dollars."""
+        series = self.series.get(interval)
+        if series is None:
+            raise Exception(f'No {interval} bars for {self.stock.ticker}')
+        self.fold()
+        first, last = series.range(start, end)
+        to_price = self.stock.to_price
+        tick_size = to_price(1)
+        bars = {'time': series.start[first:last]}
+        for name in ('open', 'high', 'low', 'close'):
+            bars[name] = array('d', map(to_price, getattr(series, name)[first:last]))
+        bars['volume'] = series.volume[first:last]
+        bars['vwap'] = array('d', (notional * tick_size / volume for notional, volume in
+                                   zip(series.notional[first:last], series.volume[first:last])))
+        bars['trades'] = series.trades[first:last]
+        return bars
@@ -0,0 +1,158 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+@author: Desmond Tan
+
+Parses the actions typed by users into commands for the exchange.
+
+The parser dispatches on the first word of the action, so every action is
+matched against at most one precompiled pattern.
+"""
+import re
+from collections import namedtuple
+from datetime import datetime, timezone
+
+
+# tif is the time in force, IOC, FOK, DAY or GTD, or None for good till cancelled,
+# and expires the expiry time of a GTD order in nanoseconds since the epoch
+LimitCommand = namedtuple('LimitCommand', 'direction ticker price quantity tif expires', defaults=(None, None))
+MarketCommand = namedtuple('MarketCommand', 'direction ticker quantity tif expires', defaults=(None, None))
+# price is the limit price of a stop-limit order, None for a stop order
+StopCommand = namedtuple('StopCommand', 'direction ticker stop_price price quantity')
+CancelCommand = namedtuple('CancelCommand', 'order_id')
+AmendCommand = namedtuple('AmendCommand', 'order_id price quantity')
+QuoteCommand = namedtuple('QuoteCommand', 'ticker')
+ViewOrdersCommand = namedtuple('ViewOrdersCommand', '')
+ViewPortfolioCommand = namedtuple('ViewPortfolioCommand', '')
+HelpCommand = namedtuple('HelpCommand', '')
+
+VIEW_ORDERS = ViewOrdersCommand()
+VIEW_PORTFOLIO = ViewPortfolioCommand()
+HELP = HelpCommand()
+
+# Patterns for everything after the first word of the action, quantities of orders are positive
+ORDER_RE = re.compile(r"(\w+) (?:LMT \$([0-9]*[.]?[0-9]+)|MKT|STP \$([0-9]*[.]?[0-9]+)|"
+                      r"STPLMT \$([0-9]*[.]?[0-9]+) \$([0-9]*[.]?[0-9]+)) (0*[1-9][0-9]*)"
+                      r"(?: (IOC|FOK|DAY|GTD (\S+)))?")
+CANCEL_RE = re.compile(r"(\d+)")
+AMEND_RE = re.compile(r"(\d+) (?:\$([0-9]*[.]?[0-9]+) )?(\d+)")
+QUOTE_RE = re.compile(r"(\w+)")
+
+
+def parse_expiry(text):
+    """Parse the ISO 8601 expiry time of a GTD order, in UTC unless it has a
+    time zone, into nanoseconds since the epoch. None if it is not valid."""
+    try:
+        expiry = datetime.fromisoformat(text)
+    except ValueError:
+        return None
+    if expiry.tzinfo is None:
+        expiry = expiry.replace(tzinfo=timezone.utc)
+    return int(expiry.timestamp()) * 10 ** 9 + expiry.microsecond * 1000
+
+
+def format_expiry(expires):
+    """Format an expiry time in nanoseconds since the epoch as an ISO 8601 UTC
+    time, the inverse of parse_expiry to the microsecond."""
+    expiry = datetime.fromtimestamp(expires // 10 ** 9, timezone.utc)
+    return expiry.replace(microsecond=expires % 10 ** 9 // 1000, tzinfo=None).isoformat()
+
+
+def parse_order(direction, args):
+    match = ORDER_RE.fullmatch(args)
+    if not match:
+        return None
+    ticker, price, stop_price, stop_limit_stop, stop_limit_price, quantity, tif, expiry = match.groups()
+    expires = None
+    if tif is not None:
+        # Stop orders are good till cancelled
+        if stop_price is not None or stop_limit_stop is not None:
+            return None
+        if expiry is not None:
+            tif = 'GTD'
+            expires = parse_expiry(expiry)
+            if expires is None:
+                return None
+    if price is not None:
+        return LimitCommand(direction, ticker, float(price), int(quantity), tif, expires)
+    if stop_price is not None:
+        return StopCommand(direction, ticker, float(stop_price), None, int(quantity))
+    if stop_limit_stop is not None:
+        return StopCommand(direction, ticker, float(stop_limit_stop), float(stop_limit_price), int(quantity))
+    return MarketCommand(direction, ticker, int(quantity), tif, expires)
+
+
+def parse_buy(args):
+    return parse_order('BUY', args)
+
+
+def parse_sell(args):
+    return parse_order('SELL', args)
+
+
+def parse_cancel(args):
+    match = CANCEL_RE.fullmatch(args)
+    return CancelCommand(int(args)) if match else None
+
+
+def parse_amend(args):
+    match = AMEND_RE.fullmatch(args)
+    if not match:
+        return None
+    order_id, price, quantity = match.groups()
+    return AmendCommand(int(order_id), float(price) if price is not None else None, int(quantity))
+
+
+def parse_quote(args):
+    match = QUOTE_RE.fullmatch(args)
+    return QuoteCommand(args) if match else None
+
+
+def parse_view(args):
+    if args == 'ORDERS':
+        return VIEW_ORDERS
+    if args == 'PORTFOLIO':
+        return VIEW_PORTFOLIO
+    return None
+
+
+def parse_help(args):
+    return HELP if not args else None
+
+
+PARSERS = {
+    'BUY': parse_buy,
+    'SELL': parse_sell,
+    'CANCEL': parse_cancel,
+    'AMEND': parse_amend,
+    'QUOTE': parse_quote,
+    'VIEW': parse_view,
+    'HELP': parse_help,
+}
+
+
+def parse(action):
+    """Parse an action into a command, or None if the action is not valid."""
+    head, _, args = action.partition(' ')
+    parser = PARSERS.get(head)
+    if parser is None:
+        return None
+    return parser(args)
+
+
+def parse_many(lines, with_user=False):
+    """Parse an iterable of actions, e.g. the lines of a file, lazily.
+
+    Blank lines are skipped. If with_user is set, each line is expected in the
+    "<user>: <action>" format of results/orders.txt and (user, command) pairs
+    are yielded instead of commands.
+    """
+    for line in lines:
+        line = line.rstrip('\n')
+        if not line:
+            continue
+        if with_user:
+            user, _, action = line.partition(': ')
+            yield user, parse(action)
+        else:
+            yield parse(line)
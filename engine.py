@@ -0,0 +1,235 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+@author: Desmond Tan
+"""
+import itertools
+from collections import deque
+
+from orders import *
+from orderbook import BUY, SELL
+
+
+class MatchingEngine:
+    """Matches incoming orders against a single ticker's order book.
+
+    Matching is a loop over the price levels of the book instead of a
+    recursive call per resting order, so an order can sweep any number of
+    resting orders. The rules are the same as before:
+    1. The order will be first matched with the market orders before the limit orders.
+    2. Market orders can only be matched with limit orders.
+    3. Limit orders can be matched with limit orders if it is better than the bid or ask price.
+    4. Market orders with a collar are not filled beyond it. A queued market order
+       that an incoming limit order cannot fill within its collar holds back the
+       market orders queued behind it.
+    """
+
+    def __init__(self, on_trade):
+        # Called as on_trade(book, buy_order, sell_order, price, ticks, quantity) for every fill
+        self.on_trade = on_trade
+
+    def match(self, book, order, rest=True):
+        """Match the order against the book, resting whatever is left of it
+        unless rest is False."""
+        if order.is_filled():
+            return order
+
+        is_buy = order.direction == "BUY"
+        direction = BUY if is_buy else SELL
+        other_direction = SELL if is_buy else BUY
+        is_limit = isinstance(order, LimitOrder)
+
+        # Queued market orders are filled at the price of the incoming limit order
+        if is_limit:
+            market_orders = book.market_orders[other_direction]
+            if market_orders:
+                self._drain(book, order, market_orders, market_orders.orders, order.price, order.ticks, is_buy,
+                            collared=True)
+                market_orders.prune()
+
+        limit = order.ticks if is_limit else order.collar
+        limit_orders = book.limit_orders[other_direction]
+        while not order.is_filled():
+            level = limit_orders.best_level()
+            if level is None:
+                break
+            if limit is not None and (level.ticks > limit if is_buy else level.ticks < limit):
+                break
+            self._drain(book, order, limit_orders, level.orders, level.price, level.ticks, is_buy, level=level)
+            limit_orders.prune()
+
+        if rest and not order.is_filled():
+            self.rest(book, order)
+        return order
+
+    def rest(self, book, order):
+        """Rest the order in the book without matching it."""
+        direction = BUY if order.direction == "BUY" else SELL
+        if isinstance(order, LimitOrder):
+            book.limit_orders[direction].push(order)
+        else:
+            book.market_orders[direction].append(order)
+
+    def uncross(self, book, ticks):
+        """Match the resting orders of a call auction against each other at a
+        single price in ticks, until the buys or the sells that accept the
+        price run out.
+
+        Market orders go first, then limit orders in price-time priority. A
+        market order with a collar only takes part if the price is within it.
+        Only the filled quantities of the orders are updated. The fills are
+        returned to be settled together, see Exchange.settle_auction, as lists
+        of the buy orders, the sell orders and the quantities; a tuple per fill
+        would be one more object for the garbage collector to scan per fill,
+        next to the whole book."""
+        buy_orders = []
+        sell_orders = []
+        quantities = []
+        buys = itertools.chain(self._auction_market_orders(book, BUY, ticks),
+                               self._auction_limit_orders(book, BUY, ticks))
+        sells = itertools.chain(self._auction_market_orders(book, SELL, ticks),
+                                self._auction_limit_orders(book, SELL, ticks))
+        buy, buy_level = next(buys, (None, None))
+        sell, sell_level = next(sells, (None, None))
+        while buy is not None and sell is not None:
+            buy_open = buy.quantity - buy.filled
+            sell_open = sell.quantity - sell.filled
+            quantity = buy_open if buy_open < sell_open else sell_open
+            buy.filled += quantity
+            sell.filled += quantity
+            if buy_level is not None:
+                buy_level.quantity -= quantity
+            if sell_level is not None:
+                sell_level.quantity -= quantity
+            buy_orders.append(buy)
+            sell_orders.append(sell)
+            quantities.append(quantity)
+            if quantity == buy_open:
+                buy, buy_level = next(buys, (None, None))
+            if quantity == sell_open:
+                sell, sell_level = next(sells, (None, None))
+
+        for queue in book.market_orders:
+            if any(order.is_filled() for order in queue.orders):
+                queue.orders = deque(order for order in queue.orders if not order.cancelled and not order.is_filled())
+                queue.size = len(queue.orders)
+                queue.tombstones = 0
+        for side in book.limit_orders:
+            self._drop_filled(side)
+        return buy_orders, sell_orders, quantities
+
+    def _auction_market_orders(self, book, direction, ticks):
+        """Yield the queued market orders of one side that accept a price, in
+        arrival order, each with None for the price level it is not in."""
+        for order in book.market_orders[direction].orders:
+            collar = order.collar
+            if order.cancelled or collar is not None and (collar < ticks if direction == BUY else collar > ticks):
+                continue
+            yield order, None
+
+    def _auction_limit_orders(self, book, direction, ticks):
+        """Yield the resting limit orders of one side that accept a price, in
+        price-time priority, each with its price level.
+
+        Once every order of a level has been filled the whole level is taken
+        off the book in one go. The filled orders at the front of the last
+        level, which is only partly filled, are left for _drop_filled."""
+        side = book.limit_orders[direction]
+        while True:
+            level = side.best_level()
+            if level is None or (level.ticks < ticks if direction == BUY else level.ticks > ticks):
+                return
+            orders = level.orders
+            live = 0
+            for order in orders:
+                if not order.cancelled:
+                    live += 1
+                    yield order, level
+            side.size -= live
+            side.tombstones -= len(orders) - live
+            orders.clear()
+            side.pop_level()
+
+    @staticmethod
+    def _drop_filled(side):
+        """Remove the filled orders and the tombstones from the front of the
+        best level of a side, and the level itself if nothing is left of it."""
+        level = side.best_level()
+        if level is None:
+            return
+        orders = level.orders
+        while orders:
+            order = orders[0]
+            if order.cancelled:
+                side.tombstones -= 1
+            elif order.is_filled():
+                side.size -= 1
+            else:
+                return
+            orders.popleft()
+        side.pop_level()
+        side.prune()
+
+    def can_fill(self, book, order):
+        """Check whether the order would be filled in full right now, without
+        changing the book. Only looks as deep into the book as it needs to."""
+        is_buy = order.direction == "BUY"
+        other_direction = SELL if is_buy else BUY
+        is_limit = isinstance(order, LimitOrder)
+        needed = order.quantity - order.filled
+        if needed <= 0:
+            return True
+
+        if is_limit:
+            for other_order in book.market_orders[other_direction].orders:
+                if other_order.cancelled:
+                    continue
+                collar = other_order.collar
+                if collar is not None and (order.ticks < collar if is_buy else order.ticks > collar):
+                    break
+                needed -= other_order.quantity - other_order.filled
+                if needed <= 0:
+                    return True
+
+        limit = order.ticks if is_limit else order.collar
+        for level in book.limit_orders[other_direction].iter_levels():
+            if limit is not None and (level.ticks > limit if is_buy else level.ticks < limit):
+                break
+            needed -= level.quantity
+            if needed <= 0:
+                return True
+        return False
+
+    def _drain(self, book, order, side, orders, price, ticks, is_buy, collared=False, level=None):
+        """Fill the order against a queue of resting orders at one price in a
+        single pass, i.e. a price level or the queued market orders.
+
+        Fully filled and cancelled orders are popped off the front of the deque
+        as the pass walks over them. If collared is set, the pass stops at the
+        first resting market order whose collar the price is beyond. The open
+        quantity of the price level, if given, is kept up to date."""
+        units = ticks * book.tick_units
+        while orders and not order.is_filled():
+            other_order = orders[0]
+            if other_order.cancelled:
+                orders.popleft()
+                side.tombstones -= 1
+                continue
+            if collared and other_order.collar is not None and \
+                    (ticks < other_order.collar if is_buy else ticks > other_order.collar):
+                break
+            filled_qty = self._fill(book, order, other_order, price, ticks, units, is_buy)
+            if level is not None:
+                level.quantity -= filled_qty
+            if other_order.is_filled():
+                orders.popleft()
+                side.size -= 1
+
+    def _fill(self, book, order, other_order, price, ticks, units, is_buy):
+        filled_qty = other_order.fill(order.quantity - order.filled, price, units)
+        order.fill(filled_qty, price, units)
+        if is_buy:
+            self.on_trade(book, order, other_order, price, ticks, filled_qty)
+        else:
+            self.on_trade(book, other_order, order, price, ticks, filled_qty)
+        return filled_qty
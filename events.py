@@ -0,0 +1,94 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+@author: Desmond Tan
+
+Event sinks receive everything the exchange has to tell its users, instead of
+the exchange printing it in the middle of matching.
+"""
+import sys
+
+from orders import LimitOrder, StopOrder
+
+
+def format_order_accepted(order):
+    if isinstance(order, StopOrder):
+        limit = f" and a limit price of ${order.limit_price:.2f}" if order.limit_price is not None else ""
+        return (f"You have placed a stop {order.direction.lower()} order for {order.quantity} "
+                f"{order.ticker} shares at a stop price of ${order.price:.2f}{limit}. Order ID: {order.id}")
+    if isinstance(order, LimitOrder):
+        return (f"You have placed a limit {order.direction.lower()} order for {order.quantity} "
+                f"{order.ticker} shares at ${order.price:.2f} each. Order ID: {order.id}")
+    return f"You have placed a market order for {order.quantity} {order.ticker} shares. Order ID: {order.id}"
+
+
+def format_quote(ticker, bid_price, ask_price, last_price):
+    return f"{ticker} BID: ${bid_price:.2f} ASK: ${ask_price:.2f} LAST: ${last_price:.2f}"
+
+
+class EventSink:
+    """Interface of an event sink, every event is ignored by default."""
+
+    def order_accepted(self, order):
+        """An order has been accepted by the exchange."""
+
+    def trade(self, trade):
+        """Two orders have been matched."""
+
+    def quote(self, ticker, bid_price, ask_price, last_price):
+        """A user asked for a quote."""
+
+    def status(self, message):
+        """Any other message for the user, e.g. the result of a command."""
+
+    def flush(self):
+        """Write out any buffered events."""
+
+
+class NullSink(EventSink):
+    """Discards every event."""
+
+
+class ConsoleSink(EventSink):
+    """Prints the events for the user at the console, trades are not printed."""
+
+    def order_accepted(self, order):
+        print(format_order_accepted(order))
+
+    def quote(self, ticker, bid_price, ask_price, last_price):
+        print(format_quote(ticker, bid_price, ask_price, last_price))
+
+    def status(self, message):
+        print(message)
+
+
+class BufferedSink(EventSink):
+    """Writes the events, including trades, to a stream in batches of lines."""
+
+    def __init__(self, stream=None, batch_size=1024):
+        self.stream = stream if stream is not None else sys.stdout
+        self.batch_size = batch_size
+        self.buffer = []
+
+    def write(self, line):
+        self.buffer.append(line)
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+
+    def order_accepted(self, order):
+        self.write(format_order_accepted(order))
+
+    def trade(self, trade):
+        self.write(str(trade))
+
+    def quote(self, ticker, bid_price, ask_price, last_price):
+        self.write(format_quote(ticker, bid_price, ask_price, last_price))
+
+    def status(self, message):
+        self.write(message)
+
+    def flush(self):
+        if self.buffer:
+            self.buffer.append('')
+            self.stream.write('\n'.join(self.buffer))
+            self.buffer.clear()
@@ -3,126 +3,629 @@
 """
 @author: Desmond Tan
 """
-import re
-import heapq
+import itertools
+import math
+import time
+from collections import namedtuple
+from contextlib import contextmanager
 from orders import *
+from ticks import to_units, from_units
+from events import ConsoleSink
+from commands import (parse, LimitCommand, MarketCommand, StopCommand, CancelCommand, AmendCommand,
+                      QuoteCommand, ViewOrdersCommand, ViewPortfolioCommand, HelpCommand)
+from orderbook import BUY, SELL, OrderBook
+from engine import MatchingEngine
+from interning import Interner
+from tape import Trade, TradeTape
+from journal import save_snapshot, StoppedClock
+from bars import Bars, BAR_INTERVALS
+from positions import leaderboard
+from timers import TimerWheel
+from auction import auction_price
 
+BatchResult = namedtuple('BatchResult', 'order_id status filled')
 
-BUY = 0
-SELL = 1
+DAY_NANOSECONDS = 24 * 3600 * 10 ** 9
+
+# Commands that change the state of the exchange
+JOURNALED_COMMANDS = (LimitCommand, MarketCommand, StopCommand, CancelCommand, AmendCommand)
 
 
 class Exchange:
-    def __init__(self):
+    def __init__(self, sink=None, clock=None, tape_dir=None, journal=None, market_data=None,
+                 bar_intervals=BAR_INTERVALS, market_collar=0.1, metrics=None, day_end=0):
+        self.sink = sink if sink is not None else ConsoleSink()
+        # Write-ahead journal of the accepted commands, see journal.py
+        self.journal = journal
+        # Publisher of the changes to the books, see marketdata.py
+        self.market_data = market_data
+        # Latencies, counters and gauges, see metrics.py
+        self.metrics = metrics
+        # Timestamps trades in nanoseconds
+        self.clock = clock if clock is not None else time.time_ns
+        # Trade tapes are persisted in this directory if it is set
+        self.tape_dir = tape_dir
+        # OHLCV bars are kept at these intervals for every stock, see bars.py
+        self.bar_intervals = bar_intervals
+        # Market orders of users may fill at most this fraction away from the reference price
+        self.market_collar = market_collar
+        # DAY orders expire at this many seconds after midnight UTC
+        self.day_end = day_end
         self.stocks = {}
+        self.books = {}
+        self.engine = MatchingEngine(self.record_trade)
+        self.sequence = itertools.count(1)
+        # Open orders by order id
+        self.orders = {}
+        # Small integer ids of the users seen by the exchange, for the trade tapes and journal
+        self.user_ids = Interner()
         self.limit_orders = {}
         self.market_orders = {}
         self.trades = {}
-
-    def list_stock(self, stock):
-        """List the stock on the exchange."""
+        self.bars = {}
+        # Expiry of the open DAY and GTD orders, see timers.py
+        self.timers = TimerWheel()
+
+    def __getstate__(self):
+        """Get the state of the exchange for a snapshot, without the sink, clock,
+        journal, market data publisher and metrics it is connected to."""
+        state = self.__dict__.copy()
+        next_sequence = next(self.sequence)
+        self.sequence = itertools.count(next_sequence)
+        state['sequence'] = next_sequence
+        for name in ('sink', 'clock', 'journal', 'market_data', 'metrics'):
+            del state[name]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.sequence = itertools.count(state['sequence'])
+        self.sink = ConsoleSink()
+        self.clock = time.time_ns
+        self.journal = None
+        self.market_data = None
+        self.metrics = None
+
+    def list_stock(self, stock, ladder=False):
+        """List the stock on the exchange.
+
+        If ladder is set, the stock's limit orders are kept in an array-indexed
+        price ladder, which needs the stock to have a price band."""
         if stock.ticker in self.stocks:
             raise Exception('Stock already exists')
+        if ladder and (stock.min_price is None or stock.max_price is None):
+            raise Exception('A price ladder needs a price band')
+        tape = TradeTape(stock, self.user_ids, self.tape_dir)
+        book = OrderBook(stock, ladder, tape)
         self.stocks[stock.ticker] = stock
-        self.limit_orders[stock.ticker] = [[], []]
-        self.market_orders[stock.ticker] = [[], []]
-        self.trades[stock.ticker] = []
+        self.books[stock.ticker] = book
+        self.limit_orders[stock.ticker] = book.limit_orders
+        self.market_orders[stock.ticker] = book.market_orders
+        self.trades[stock.ticker] = book.trades
+        self.bars[stock.ticker] = Bars(stock, self.bar_intervals)
+        if self.metrics is not None:
+            self.metrics.watch(book)
 
     def get_bid_ask(self, ticker):
         """Get the best bid and ask for a stock."""
-        bid = self.limit_orders[ticker][BUY][0] if self.limit_orders[ticker][BUY] else None
-        ask = self.limit_orders[ticker][SELL][0] if self.limit_orders[ticker][SELL] else None
-        return bid, ask
+        limit_orders = self.limit_orders[ticker]
+        return limit_orders[BUY].peek(), limit_orders[SELL].peek()
 
     def get_last_price(self, ticker):
         """Get the last price of a stock."""
-        last_trade = self.trades[ticker][-1] if self.trades[ticker] else None
-        if last_trade:
-            return last_trade.price
+        ticks = self.trades[ticker].last_ticks()
+        if ticks is not None:
+            return self.stocks[ticker].to_price(ticks)
         return 0
 
+    def get_auction_price(self, ticker):
+        """Get the price and volume a stock in auction would uncross at now,
+        see auction.py, or None if nothing would execute."""
+        result = auction_price(self.books[ticker])
+        if result is None:
+            return None
+        ticks, volume = result
+        return self.stocks[ticker].to_price(ticks), volume
+
+    def start_auction(self, ticker):
+        """Put a stock in auction: its orders collect in the book without
+        matching until the book is uncrossed."""
+        if self.journal is not None:
+            self.journal.append_auction(self.clock(), ticker)
+        self.stocks[ticker].auction = True
+
+    def uncross(self, ticker):
+        """Uncross the book of a stock in auction at its auction price, filling
+        every order that accepts the price, and return the stock to continuous
+        matching. Returns the price and volume, or None if nothing executed.
+
+        The whole uncross runs at one time, see stopped_clock."""
+        with self.stopped_clock() as now:
+            if self.journal is not None:
+                self.journal.append_uncross(now, ticker)
+            return self.uncross_book(ticker)
+
+    def uncross_book(self, ticker):
+        stock = self.stocks[ticker]
+        book = self.books[ticker]
+        result = auction_price(book)
+        stock.auction = False
+        if result is not None:
+            ticks, volume = result
+            self.settle_auction(book, *self.engine.uncross(book, ticks), stock.to_price(ticks), ticks)
+            result = stock.to_price(ticks), volume
+        stops = book.stops
+        if stops[BUY].size or stops[SELL].size:
+            self.trigger_stops(book)
+        if self.market_data is not None:
+            self.market_data.changed(book)
+            self.market_data.publish()
+        return result
+
+    def get_mark(self, ticker):
+        """Get the price per share positions in a stock are valued at, in cash
+        units: the last price, else the best bid, else 0, e.g. for a stock that
+        is not listed."""
+        book = self.books.get(ticker)
+        if book is None:
+            return 0
+        ticks = book.trades.last_ticks()
+        if ticks is None:
+            level = book.limit_orders[BUY].best_level()
+            ticks = level.ticks if level is not None else 0
+        return ticks * book.tick_units
+
+    def settle_auction(self, book, buy_orders, sell_orders, quantities, price, ticks):
+        """Record the fills of an auction, all at one price and time, and settle
+        them with one transfer of cash and shares per user, see record_trade.
+
+        The fills go onto the tape and into the bars in one go, and each side
+        is released in a single pass over its fills, see release_auction."""
+        if not quantities:
+            return
+        metrics = self.metrics
+        if metrics is not None:
+            start = metrics.clock()
+        timestamp = self.clock()
+        units = ticks * book.tick_units
+        ticker = book.ticker
+        # Reservations are released first, so that they cover the transfers
+        bought = {}
+        sold = {}
+        buyers = self.release_auction(buy_orders, quantities, bought)
+        sellers = self.release_auction(sell_orders, quantities, sold)
+        book.trades.extend(timestamp, ticks, quantities, buyers, sellers)
+        self.bars[ticker].update(timestamp, ticks, sum(quantities), len(quantities))
+        journal = self.journal
+        if journal is not None:
+            for quantity, buyer, seller in zip(quantities, buyers, sellers):
+                journal.append_fill(ticker, ticks, quantity, buyer, seller)
+        sink = self.sink
+        for buy_order, sell_order, quantity in zip(buy_orders, sell_orders, quantities):
+            sink.trade(Trade(buy_order.user, sell_order.user, price, quantity, ticks, timestamp))
+
+        for user, quantity in bought.items():
+            user.withdraw_units(quantity * units)
+            user.receive_stock(ticker, quantity)
+        for user, quantity in sold.items():
+            user.deliver_stock(ticker, quantity)
+            user.deposit_units(quantity * units)
+        for user in bought.keys() | sold.keys():
+            user.record_fill(ticker, bought.get(user, 0) - sold.get(user, 0), units)
+        if metrics is not None:
+            metrics.latency['settle'].record(metrics.clock() - start)
+            metrics.fills[ticker] += len(quantities)
+
+    def release_auction(self, orders, quantities, totals):
+        """Release the reservations of the orders of one side of an auction,
+        add the quantity each user filled to totals, and get the interned id
+        of the user of every fill.
+
+        The fills of an order, and often of a user, follow each other, see
+        MatchingEngine.uncross, so filled orders are dropped and users are
+        interned once per run of fills rather than once per fill."""
+        intern = self.user_ids.intern
+        open_orders = self.orders
+        ids = []
+        last_order = None
+        last_user = None
+        for order, quantity in zip(orders, quantities):
+            user = order.user
+            if order.reserve is not None:
+                user.release(order, quantity)
+            if user is not last_user:
+                last_user = user
+                user_id = intern(user)
+            ids.append(user_id)
+            totals[user] = totals.get(user, 0) + quantity
+            if order is not last_order:
+                last_order = order
+                if order.is_filled():
+                    open_orders.pop(order.id, None)
+        return ids
+
+    def get_leaderboard(self, n=None):
+        """Get the users with the highest net worth, see User.get_net_worth."""
+        return leaderboard(self.user_ids.objects, n)
+
+    def get_collar(self, ticker, direction, stop_price=None):
+        """Get the worst price in ticks a market order may fill at, see collar_ticks.
+
+        The reference price is the stop price of a stop order, else the last
+        price, or the best price on the other side of the book before the
+        first trade. None if there is none of them."""
+        if stop_price is not None:
+            return collar_ticks(self.stocks[ticker].to_ticks(stop_price), direction, self.market_collar)
+        reference = self.trades[ticker].last_ticks()
+        if reference is None:
+            level = self.limit_orders[ticker][SELL if direction == "BUY" else BUY].best_level()
+            if level is None:
+                return None
+            reference = level.ticks
+        return collar_ticks(reference, direction, self.market_collar)
+
+    def get_vwap(self, ticker):
+        """Get the volume-weighted average price of all the trades of a stock."""
+        return self.bars[ticker].vwap()
+
+    def get_bars(self, ticker, interval, start=None, end=None):
+        """Get the OHLCV bars of a stock, see Bars.query."""
+        return self.bars[ticker].query(interval, start, end)
+
+    def accept_order(self, order):
+        """Stamp an incoming order with its sequence number and order id,
+        and convert the price of a limit or stop order to ticks."""
+        stock = self.stocks[order.ticker]
+        # Share the listed ticker string instead of keeping a copy per order
+        order.ticker = stock.ticker
+        if isinstance(order, LimitOrder) or isinstance(order, StopOrder):
+            order.ticks = stock.to_ticks(order.price)
+        self.user_ids.intern(order.user)
+        order.sequence = next(self.sequence)
+        if order.id is None:
+            order.id = order.sequence
+        self.orders[order.id] = order
+        order.user.reserve(order)
+        return order
+
     def place_limit_order(self, order):
         """Place a limit order on the exchange."""
-        print(
-            f"You have placed a limit {order.direction.lower()} order for {order.quantity} {order.ticker} shares at ${order.price:.2f} each.")
+        self.accept_order(order)
+        self.sink.order_accepted(order)
         self.resolve_order(order)
         return order
 
     def place_market_order(self, order):
         """Place a market order on the exchange."""
-        print(
-            f"You have placed a market order for {order.quantity} {order.ticker} shares.")
+        self.accept_order(order)
+        self.sink.order_accepted(order)
         self.resolve_order(order)
         return order
 
-    def resolve_order(self, order):
-        """Resolve an order on the exchange
+    def place_stop_order(self, order):
+        """Place a stop or stop-limit order on the exchange."""
+        self.accept_order(order)
+        self.sink.order_accepted(order)
+        self.resolve_order(order)
+        return order
 
-        There are several constraints for an order to be resolved:
-        1. The order will be first matched with the market orders before the limit orders.
-        2. Market orders can only be matched with limit orders.
-        3. Limit orders can be matched with limit orders if it is better than the bid or ask price.
-        """
-        if order.is_filled():
-            return order
+    def submit_batch(self, orders):
+        """Submit a batch of orders at once.
+
+        Orders for unlisted stocks, of no shares or at invalid prices are rejected first, before
+        the batch is journaled. Every other order is verified against its user's
+        cash and holdings, with earlier orders of the same user in the batch
+        reserving what they need. The accepted orders are then matched in arrival
+        order, without any output, all at one time, see stopped_clock. Returns a
+        BatchResult per order, rejected orders have no order id and the status
+        REJECTED."""
+        valid = [self.is_valid_order(order) for order in orders]
+        with self.stopped_clock() as now:
+            if self.journal is not None:
+                self.journal.append_batch(now, [order for order, ok in zip(orders, valid) if ok])
+            results = self.resolve_batch(orders, valid)
+        if self.journal is not None and self.journal.snapshot_due():
+            save_snapshot(self, self.journal.snapshot_path)
+        return results
+
+    def resolve_batch(self, orders, valid):
+        if self.timers.count:
+            self.expire_orders()
+        by_user = {}
+        for index, order in enumerate(orders):
+            if valid[index]:
+                by_user.setdefault(order.user, []).append(index)
+        accepted = [False] * len(orders)
+        for user, indexes in by_user.items():
+            verified = user.verify_batch([orders[index] for index in indexes])
+            for index, ok in zip(indexes, verified):
+                accepted[index] = ok
+
+        for order, ok in zip(orders, accepted):
+            if ok:
+                self.accept_order(order)
+                self.resolve_order(order)
+                order.user.place_order(order)
+
+        if self.market_data is not None:
+            self.market_data.publish()
+        return [BatchResult(order.id, order.get_status(), order.filled) if ok
+                else BatchResult(None, "REJECTED", 0)
+                for order, ok in zip(orders, accepted)]
+
+    def is_valid_order(self, order):
+        """Check that the stock of an order is listed and that its quantity and prices are valid."""
+        stock = self.stocks.get(order.ticker)
+        if stock is None or order.quantity <= 0:
+            return False
+        if isinstance(order, LimitOrder):
+            return stock.is_valid_price(order.price)
+        if isinstance(order, StopOrder):
+            return stock.is_valid_price(order.price) and \
+                (order.limit_price is None or stock.is_valid_price(order.limit_price))
+        return True
+
+    def find_order(self, user, order_id):
+        """Find an open order of the user by its order id. An order that has
+        nothing left to fill is not in the book, so it is not open."""
+        order = self.orders.get(order_id)
+        if order is None or order.user is not user or order.is_filled():
+            self.sink.status(f"Order {order_id} is not an open order.")
+            return None
+        return order
 
-        direction = BUY if order.direction == "BUY" else SELL
-        other_direction = SELL if direction == BUY else BUY
-        limit_orders = self.limit_orders[order.ticker][other_direction]
-        market_orders = self.market_orders[order.ticker][other_direction]
+    def cancel_order(self, user, order_id):
+        """Cancel an open order in O(1).
+
+        The order is only marked as cancelled in the book, it is skipped when
+        it reaches the front of the book."""
+        order = self.find_order(user, order_id)
+        if order is None:
+            return None
+        book = self.books[order.ticker]
+        book.cancel(order)
+        user.release(order, order.quantity - order.filled)
+        if self.market_data is not None:
+            self.market_data.changed(book)
+        del self.orders[order_id]
+        self.sink.status(f"Order {order_id} has been cancelled.")
+        return order
 
-        # If the order is a limit order, check if there are any bids or asks that match the order
-        bid, ask = self.get_bid_ask(order.ticker)
-        if isinstance(order, LimitOrder) and not market_orders and order.direction == "BUY" and ask and ask.price > order.price:
-            heapq.heappush(self.limit_orders[order.ticker][BUY], order)
-            return order
-        elif isinstance(order, LimitOrder) and not market_orders and order.direction == "SELL" and bid and bid.price < order.price:
-            heapq.heappush(self.limit_orders[order.ticker][SELL], order)
+    def amend_order(self, user, order_id, quantity, price=None):
+        """Amend the total quantity and/or the price of an open order.
+
+        Reducing the quantity keeps the order's place in the book. Any other
+        change cancels the order and replaces it with a new order, which goes to
+        the back of the queue and may match immediately."""
+        order = self.find_order(user, order_id)
+        if order is None:
+            return None
+        if quantity <= order.filled:
+            self.sink.status(f"Order {order_id} has already filled {order.filled} shares.")
+            return None
+        if price is not None and isinstance(order, MarketOrder):
+            self.sink.status("The price of a market order cannot be amended.")
+            return None
+        if isinstance(order, StopOrder):
+            self.sink.status("A stop order cannot be amended before it is triggered.")
+            return None
+
+        if (price is None or price == order.price) and quantity <= order.quantity:
+            user.release(order, order.quantity - quantity)
+            self.books[order.ticker].reduce(order, quantity)
+            if self.market_data is not None:
+                self.market_data.changed(self.books[order.ticker])
+            self.sink.status(f"Order {order_id} has been amended.")
             return order
 
-        # Find a market order to match with the limit order
-        # Cannot match market order with market order
-        if isinstance(order, LimitOrder) and market_orders:
-            other_order = market_orders[0]
+        # What the order has reserved may be used by its replacement
+        remaining = order.quantity - order.filled
+        new_order = order.amended(quantity - order.filled, price)
+        new_order.tif = order.tif
+        new_order.expires = order.expires
+        user.release(order, remaining)
+        if not self.verify_order(user, new_order):
+            user.hold(order, remaining)
+            return None
+        self.books[order.ticker].cancel(order)
+        del self.orders[order_id]
+        self.accept_order(new_order)
+        self.sink.status(f"Order {order_id} has been replaced by order {new_order.id}.")
+        self.resolve_order(new_order)
+        user.place_order(new_order)
+        return new_order
 
-        # Find a limit order to match with the market order or limit order
-        elif limit_orders:
-            other_order = self.limit_orders[order.ticker][other_direction][0]
+    def resolve_order(self, order):
+        """Resolve an order on the exchange
 
-        # No match
+        Matching is delegated to the matching engine, see MatchingEngine for the rules.
+        Orders are stamped with a sequence number on arrival so that orders at the
+        same price are matched first in, first out. A stop order is kept aside
+        until the last price reaches its stop price, see trigger_stops. The
+        orders of a stock in auction rest without matching until it is uncrossed.
+        """
+        if not order.sequence:
+            self.accept_order(order)
+        book = self.books[order.ticker]
+        auction = book.stock.auction
+        if isinstance(order, StopOrder):
+            book.stops[BUY if order.direction == "BUY" else SELL].push(order)
+        elif auction:
+            self.collect(book, order)
+        elif order.tif is None:
+            self.match(book, order)
         else:
-            if isinstance(order, MarketOrder):
-                self.market_orders[order.ticker][direction].append(order)
-            else:
-                heapq.heappush(
-                    self.limit_orders[order.ticker][direction], order)
-            return order
+            self.resolve_tif(book, order)
+        stops = book.stops
+        if (stops[BUY].size or stops[SELL].size) and not auction:
+            self.trigger_stops(book)
+        elif book.high_ticks is not None:
+            # No stop was waiting for these trades
+            book.high_ticks = book.low_ticks = None
+        if self.market_data is not None:
+            self.market_data.changed(book)
+        return order
+
+    def resolve_tif(self, book, order):
+        """Match an order with a time in force.
+
+        An IOC order is matched as far as it can be and the rest of it is
+        cancelled. A FOK order is only matched if it can be filled in full,
+        which is checked without changing the book, and is cancelled otherwise.
+        A DAY or GTD order rests like any other order until it expires."""
+        tif = order.tif
+        if tif == 'IOC' or tif == 'FOK':
+            if tif == 'FOK' and not self.engine.can_fill(book, order):
+                self.drop_order(order)
+                self.sink.status(f"Order {order.id} could not be filled in full and has been cancelled.")
+                return
+            self.match(book, order, rest=False)
+            if not order.is_filled():
+                self.drop_order(order)
+                self.sink.status(f"The rest of order {order.id} has been cancelled, "
+                                 f"{order.quantity - order.filled} shares were not filled.")
+            return
+
+        now = self.clock()
+        if not self.set_expiry(order, now):
+            return
+        self.match(book, order)
+        if not order.is_filled():
+            self.timers.schedule(order.expires, order, now)
+
+    def collect(self, book, order):
+        """Rest an order of a stock in auction without matching it. IOC and FOK
+        orders cannot wait for the auction and are cancelled."""
+        tif = order.tif
+        if tif == 'IOC' or tif == 'FOK':
+            self.drop_order(order)
+            self.sink.status(f"Order {order.id} cannot be filled during an auction and has been cancelled.")
+            return
+        if tif is not None:
+            now = self.clock()
+            if not self.set_expiry(order, now):
+                return
+            self.timers.schedule(order.expires, order, now)
+        self.engine.rest(book, order)
+
+    def set_expiry(self, order, now):
+        """Set when a DAY order expires, the next end of the day after now.
+        Drops a DAY or GTD order that has already expired, returns whether
+        the order is still open."""
+        if order.tif == 'DAY' and order.expires is None:
+            order.expires = now - now % DAY_NANOSECONDS + self.day_end * 10 ** 9
+            if order.expires <= now:
+                order.expires += DAY_NANOSECONDS
+        if order.expires <= now:
+            self.drop_order(order)
+            self.sink.status(f"Order {order.id} has expired.")
+            return False
+        return True
+
+    def drop_order(self, order):
+        """Close an order that is not in the book, releasing what it has reserved."""
+        order.cancelled = True
+        order.user.release(order, order.quantity - order.filled)
+        self.orders.pop(order.id, None)
+
+    def expire_orders(self, now=None):
+        """Cancel the DAY and GTD orders that have expired by now, in nanoseconds.
+
+        Expired orders are cancelled before the next command, each in O(1)
+        amortized, see TimerWheel."""
+        for order in self.timers.advance(self.clock() if now is None else now):
+            # The order may have been filled, cancelled or replaced since it was scheduled
+            if self.orders.get(order.id) is not order:
+                continue
+            book = self.books[order.ticker]
+            book.cancel(order)
+            self.drop_order(order)
+            if self.market_data is not None:
+                self.market_data.changed(book)
+            self.sink.status(f"Order {order.id} has expired.")
+
+    def match(self, book, order, rest=True):
+        """Match an order against its book, timing it if there are metrics."""
+        metrics = self.metrics
+        if metrics is None:
+            self.engine.match(book, order, rest)
+        else:
+            fills = metrics.fills[book.ticker]
+            start = metrics.clock()
+            self.engine.match(book, order, rest)
+            metrics.latency['match'].record(metrics.clock() - start)
+            metrics.orders[book.ticker] += 1
+            metrics.fills_per_order.record(metrics.fills[book.ticker] - fills)
+
+    def trigger_stops(self, book):
+        """Turn the stop orders that the prices traded at have reached into
+        market or limit orders and match them, for as long as their trades
+        reach more stops.
+
+        Stops are triggered after the order that moved the price has been
+        matched, never in the middle of matching it, but against every price
+        it traded at: buy stops against the highest and sell stops against
+        the lowest. Without new trades, e.g. for a new stop order, they are
+        checked against the last price."""
+        while True:
+            last_ticks = book.trades.last_ticks()
+            if last_ticks is None:
+                return
+            high_ticks = book.high_ticks
+            low_ticks = book.low_ticks
+            if high_ticks is None:
+                high_ticks = low_ticks = last_ticks
+            book.high_ticks = book.low_ticks = None
+            triggered = book.triggered_stops(high_ticks, low_ticks)
+            if not triggered:
+                return
+            for stop in triggered:
+                order = stop.trigger()
+                self.accept_order(order)
+                self.match(book, order)
+
+    def record_trade(self, book, buy_order, sell_order, price, ticks, quantity):
+        """Record a trade between two matched orders on the trade tape."""
+        metrics = self.metrics
+        if metrics is not None:
+            start = metrics.clock()
+        timestamp = self.clock()
+        user_ids = self.user_ids
+        buyer = user_ids.intern(buy_order.user)
+        seller = user_ids.intern(sell_order.user)
+        book.trades.append(timestamp, ticks, quantity, buyer, seller)
+        if book.high_ticks is None:
+            book.high_ticks = book.low_ticks = ticks
+        elif ticks > book.high_ticks:
+            book.high_ticks = ticks
+        elif ticks < book.low_ticks:
+            book.low_ticks = ticks
+        self.bars[book.ticker].update(timestamp, ticks, quantity)
+        if self.journal is not None:
+            self.journal.append_fill(book.ticker, ticks, quantity, buyer, seller)
+        self.sink.trade(Trade(buy_order.user, sell_order.user, price, quantity, ticks, timestamp))
+        if buy_order.is_filled():
+            self.orders.pop(buy_order.id, None)
+        if sell_order.is_filled():
+            self.orders.pop(sell_order.id, None)
+        if metrics is not None:
+            metrics.latency['settle'].record(metrics.clock() - start)
+            metrics.fills[book.ticker] += 1
+
+    def flush_trades(self):
+        """Flush the trade tapes to their files."""
+        for tape in self.trades.values():
+            tape.flush()
 
-        unfilled_quantity = order.quantity - order.filled
-        price = other_order.price if isinstance(other_order, LimitOrder) else order.price
-        filled_qty = other_order.fill(unfilled_quantity, price)
-        order.fill(filled_qty, price)
-
-        buyer = order.user if order.direction == "BUY" else other_order.user
-        seller = order.user if order.direction == "SELL" else other_order.user
-        self.trades[order.ticker].append(
-            Trade(buyer, seller, price, filled_qty))
-
-        # If the matching order is fully filled, pop it from the heap or queue
-        if other_order.is_filled():
-            if isinstance(other_order, MarketOrder):
-                self.market_orders[order.ticker][other_direction].pop(0)
-            else:
-                heapq.heappop(
-                    self.limit_orders[order.ticker][other_direction])
-
-        return self.resolve_order(order)
-    
     def get_help(self):
         """Get the help message for the exchange."""
         return "Available commands: \n" + \
-            "* BUY|SELL <ticker> LMT $<price> <quantity>\n" + \
-            "* BUY|SELL <ticker> MKT <quantity>\n" + \
+            "* BUY|SELL <ticker> LMT $<price> <quantity> [IOC|FOK|DAY|GTD <time>]\n" + \
+            "* BUY|SELL <ticker> MKT <quantity> [IOC|FOK|DAY|GTD <time>]\n" + \
+            "* BUY|SELL <ticker> STP $<stop-price> <quantity>\n" + \
+            "* BUY|SELL <ticker> STPLMT $<stop-price> $<price> <quantity>\n" + \
+            "* CANCEL <order-id>\n" + \
+            "* AMEND <order-id> [$<price>] <quantity>\n" + \
             "* QUOTE <ticker>\n" + \
             "* VIEW ORDERS\n" + \
             "* VIEW PORTFOLIO\n" + \
@@ -133,71 +636,179 @@ class Exchange:
         """Execute an action on the exchange
 
         An action is a string that would be parsed before being executed.
+        Actions that change the state of the exchange are journaled first, with
+        the time they run at, and the market data of the books they changed is published after them.
         """
-        limit_order_re = r"^(BUY|SELL) (\w+) LMT \$([0-9]*[.]?[0-9]+) (\d+)$"
-        match = re.match(limit_order_re, action)
-        if match:
-            direction, ticker, price, quantity = match.groups()
-            if direction == 'BUY':
-                order = BuyOrder(user, ticker, float(price), int(quantity))
-            else:
-                order = SellOrder(user, ticker, float(price), int(quantity))
-            if user.verify_order(order):
+        metrics = self.metrics
+        if metrics is None:
+            command = parse(action)
+        else:
+            start = metrics.clock()
+            command = parse(action)
+            metrics.latency['parse'].record(metrics.clock() - start)
+        journal = self.journal
+        if journal is None or type(command) not in JOURNALED_COMMANDS:
+            self.execute_command(user, command)
+        else:
+            with self.stopped_clock() as now:
+                journal.append_command(now, user, action)
+                self.execute_command(user, command)
+            if journal.snapshot_due():
+                save_snapshot(self, journal.snapshot_path)
+        if self.market_data is not None:
+            self.market_data.publish()
+
+    @contextmanager
+    def stopped_clock(self):
+        """Stop the clock of the exchange while a journaled command runs, giving
+        the time it stopped at to journal the command with. Every expiry and
+        timestamp of the command is then the same when it is recovered at that
+        time, see journal.recover."""
+        clock = self.clock
+        now = clock()
+        self.clock = StoppedClock(now)
+        try:
+            yield now
+        finally:
+            self.clock = clock
+
+    def verify_order(self, user, order):
+        """Verify an order against its user's account, timing it if there are metrics."""
+        metrics = self.metrics
+        if metrics is None:
+            return user.verify_order(order)
+        start = metrics.clock()
+        verified = user.verify_order(order)
+        metrics.latency['verify'].record(metrics.clock() - start)
+        return verified
+
+    def make_order(self, user, command):
+        """Make the order for a parsed limit, market or stop order command."""
+        kind = type(command)
+        if kind is StopCommand:
+            return StopOrder(user, command.ticker, command.stop_price, command.quantity, command.direction,
+                             command.price)
+        if kind is MarketCommand:
+            order = MarketOrder(user, command.ticker, command.quantity, command.direction)
+        elif command.direction == 'BUY':
+            order = BuyOrder(user, command.ticker, command.price, command.quantity)
+        else:
+            order = SellOrder(user, command.ticker, command.price, command.quantity)
+        order.tif = command.tif
+        order.expires = command.expires
+        return order
+
+    def execute_command(self, user, command):
+        """Execute a parsed command on the exchange."""
+        if self.timers.count:
+            self.expire_orders()
+        kind = type(command)
+        if kind is LimitCommand:
+            stock = self.stocks.get(command.ticker)
+            if stock is None or not stock.is_valid_price(command.price):
+                self.sink.status(f"Invalid price for {command.ticker}.")
+                return
+            order = self.make_order(user, command)
+            if self.verify_order(user, order):
                 self.place_limit_order(order)
                 user.place_order(order)
-            return
 
-        market_order_re = r"^(BUY|SELL) (\w+) MKT ([0-9]*[.]?[0-9]+)$"
-        match = re.match(market_order_re, action)
-        if match:
-            direction, ticker, quantity = match.groups()
-            order = MarketOrder(user, ticker, int(quantity), direction)
-            if user.verify_order(order):
+        elif kind is MarketCommand:
+            if command.ticker not in self.stocks:
+                self.sink.status(f"Invalid ticker {command.ticker}.")
+                return
+            order = self.make_order(user, command)
+            if self.verify_order(user, order):
                 self.place_market_order(order)
                 user.place_order(order)
-            return
 
-        quote_re = r"^QUOTE (\w+)$"
-        match = re.match(quote_re, action)
-        if match:
-            ticker = match.groups()[0]
+        elif kind is StopCommand:
+            stock = self.stocks.get(command.ticker)
+            if stock is None or not stock.is_valid_price(command.stop_price) or \
+                    command.price is not None and not stock.is_valid_price(command.price):
+                self.sink.status(f"Invalid price for {command.ticker}.")
+                return
+            order = self.make_order(user, command)
+            if self.verify_order(user, order):
+                self.place_stop_order(order)
+                user.place_order(order)
+
+        elif kind is CancelCommand:
+            self.cancel_order(user, command.order_id)
+
+        elif kind is AmendCommand:
+            self.amend_order(user, command.order_id, command.quantity, command.price)
+
+        elif kind is QuoteCommand:
+            ticker = command.ticker
+            if ticker not in self.stocks:
+                self.sink.status(f"Invalid ticker {ticker}.")
+                return
             bid, ask = self.get_bid_ask(ticker)
             bid_price = bid.price if bid else 0
             ask_price = ask.price if ask else 0
             last_price = self.get_last_price(ticker)
-            print(
-                f"{ticker} BID: ${bid_price:.2f} ASK: ${ask_price:.2f} LAST: ${last_price:.2f}")
-            return
+            self.sink.quote(ticker, bid_price, ask_price, last_price)
 
-        if action == 'VIEW ORDERS':
+        elif kind is ViewOrdersCommand:
             user.view_orders()
-            return
 
-        if action == 'VIEW PORTFOLIO':
+        elif kind is ViewPortfolioCommand:
             user.view_portfolio()
-            return
-        
-        if action == 'HELP':
-            print(self.get_help())
-            return
-        
-        print('Invalid command. Type HELP for a list of commands.')
 
+        elif kind is HelpCommand:
+            self.sink.status(self.get_help())
 
-class Stock:
-    def __init__(self, ticker):
-        self.ticker = ticker
+        else:
+            self.sink.status('Invalid command. Type HELP for a list of commands.')
+
+
+def collar_ticks(reference, direction, collar):
+    """Get the highest price in ticks a buy, or the lowest price a sell, may
+    fill at, a fraction collar away from a reference price in ticks."""
+    # Rounded first so that e.g. 10% of 100 ticks is 10 ticks, not 11
+    band = math.ceil(round(reference * collar, 9))
+    if direction == "BUY":
+        return reference + band
+    return max(1, reference - band)
 
-    def __str__(self):
-        return f"{self.ticker}"
 
+class Stock:
+    __slots__ = ('ticker', 'tick_size', 'tick_units', 'min_price', 'max_price', 'auction')
 
-class Trade:
-    def __init__(self, buyer, seller, price, quantity):
-        self.buyer = buyer
-        self.seller = seller
-        self.price = price
-        self.quantity = quantity
+    def __init__(self, ticker, tick_size=0.01, min_price=None, max_price=None, auction=False):
+        self.ticker = ticker
+        self.tick_size = tick_size
+        # Cash units per tick, see ticks.py
+        self.tick_units = to_units(tick_size)
+        if self.tick_units <= 0 or from_units(self.tick_units) != tick_size:
+            raise Exception('Tick size must be a multiple of the smallest cash unit')
+        # Optional price band, orders outside of it are rejected
+        self.min_price = min_price
+        self.max_price = max_price
+        # Orders collect without matching while the stock is in auction, see Exchange.uncross
+        self.auction = auction
+
+    def is_valid_price(self, price):
+        """Check that the price is positive, a whole number of ticks and within the price band."""
+        units = to_units(price)
+        if units <= 0 or units % self.tick_units or from_units(units) != price:
+            return False
+        if self.min_price is not None and price < self.min_price:
+            return False
+        if self.max_price is not None and price > self.max_price:
+            return False
+        return True
+
+    def to_ticks(self, price):
+        """Convert a price to a whole number of ticks."""
+        if not self.is_valid_price(price):
+            raise Exception(f'Price must be a multiple of the tick size {self.tick_size} within the price band')
+        return to_units(price) // self.tick_units
+
+    def to_price(self, ticks):
+        """Convert a number of ticks to a price."""
+        return from_units(ticks * self.tick_units)
 
     def __str__(self):
-        return f"{self.buyer} bought {self.quantity} shares from {self.seller} at ${self.price:.2f} each."
+        return f"{self.ticker}"
@@ -0,0 +1,241 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+@author: Desmond Tan
+
+asyncio TCP gateway in front of the exchange.
+
+Clients talk to the gateway one line at a time. A session starts with
+  LOGIN <user> [<password>]
+after which every line is an action, as typed at the main.py prompt, until
+QUIT. Sessions may pipeline any number of actions without waiting for the
+replies. All the actions go through one bounded queue to a single sequencer
+task, which is the only code that touches the exchange, so actions are
+executed one at a time in the order they reached the gateway. Replies,
+fills and quotes are pushed back to the sessions as they happen.
+
+Backpressure: a session is not read from while the sequencer queue is full,
+or while its own replies have not been sent to the client.
+
+Run the gateway with `python3 gateway.py serve`, and a load generator
+against it with `python3 gateway.py load`.
+"""
+import argparse
+import asyncio
+import logging
+import random
+import time
+
+from events import EventSink, format_order_accepted, format_quote
+from exchange import Exchange, Stock
+from metrics import LatencyHistogram
+from reports import TICKERS
+from user import Admin, User
+
+
+# Gateway-level command, answered with PONG once every earlier action of the session has been executed
+PING = 'PING'
+
+
+class Session:
+    def __init__(self, user, writer):
+        self.user = user
+        self.writer = writer
+
+    def send(self, line):
+        # The client may have left while its actions were queued
+        if not self.writer.is_closing():
+            self.writer.write(line.encode() + b'\n')
+
+
+class GatewaySink(EventSink):
+    """Sends the events of the exchange to the sessions they are for.
+
+    Fills go to the sessions of the buyer and the seller, everything else to
+    the session whose action is being executed."""
+
+    def __init__(self, sessions):
+        self.sessions = sessions
+        self.current = None
+
+    def order_accepted(self, order):
+        self.current.send(format_order_accepted(order))
+
+    def trade(self, trade):
+        for user in (trade.buyer, trade.seller):
+            session = self.sessions.get(user)
+            if session is not None:
+                session.send(str(trade))
+
+    def quote(self, ticker, bid_price, ask_price, last_price):
+        self.current.send(format_quote(ticker, bid_price, ask_price, last_price))
+
+    def status(self, message):
+        self.current.send(message)
+
+
+class Gateway:
+    """Accepts client sessions for an exchange.
+
+    If accounts is given, it maps every user name to its password, otherwise
+    any user name is accepted. Users are made with make_user the first time
+    they log in and are kept for their later sessions.
+    """
+
+    def __init__(self, exchange, accounts=None, make_user=None, queue_size=4096):
+        self.exchange = exchange
+        self.accounts = accounts
+        self.make_user = make_user if make_user is not None else User
+        self.users = {}
+        # Connected sessions by user
+        self.sessions = {}
+        self.sink = GatewaySink(self.sessions)
+        exchange.sink = self.sink
+        self.queue = asyncio.Queue(queue_size)
+        self.server = None
+        self.sequencer = None
+
+    async def start(self, host='127.0.0.1', port=8888):
+        self.sequencer = asyncio.create_task(self.run_sequencer())
+        self.server = await asyncio.start_server(self.handle_client, host, port)
+        return self.server
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+        self.sequencer.cancel()
+
+    def login(self, line):
+        """Get the user of a LOGIN line, or None if the login is not valid."""
+        words = line.split()
+        if len(words) not in (2, 3) or words[0] != 'LOGIN':
+            return None
+        name = words[1]
+        password = words[2] if len(words) == 3 else None
+        if self.accounts is not None and self.accounts.get(name) != password:
+            return None
+        user = self.users.get(name)
+        if user is None:
+            user = self.users[name] = self.make_user(name, self.exchange)
+        return user
+
+    async def handle_client(self, reader, writer):
+        line = (await reader.readline()).decode().strip()
+        user = self.login(line)
+        if user is None or user in self.sessions:
+            writer.write(b'Login failed.\n')
+            await writer.drain()
+            writer.close()
+            return
+
+        session = Session(user, writer)
+        self.sessions[user] = session
+        session.send(f"Welcome {user.name}.")
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                action = line.decode().strip()
+                if action == 'QUIT':
+                    break
+                await self.queue.put((session, action))
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            del self.sessions[user]
+            writer.close()
+
+    async def run_sequencer(self):
+        """Execute the queued actions one at a time."""
+        queue = self.queue
+        sink = self.sink
+        execute = self.exchange.execute
+        while True:
+            session, action = await queue.get()
+            while True:
+                sink.current = session
+                if action == PING:
+                    session.send('PONG')
+                else:
+                    # A failing action must not stop the sequencer, every session would hang
+                    try:
+                        execute(session.user, action)
+                    except Exception as error:
+                        logging.exception("Action %r of %s failed", action, session.user)
+                        session.send(f"Error: {error}")
+                # Execute everything already queued before yielding to the sessions
+                if queue.empty():
+                    break
+                session, action = queue.get_nowait()
+
+
+def make_exchange(tickers=TICKERS):
+    exchange = Exchange()
+    for ticker in tickers:
+        exchange.list_stock(Stock(ticker))
+    return exchange
+
+
+async def serve(host, port, admin):
+    gateway = Gateway(make_exchange(), make_user=Admin if admin else None)
+    server = await gateway.start(host, port)
+    print(f"Gateway listening on {host}:{port}")
+    async with server:
+        await server.serve_forever()
+
+
+async def run_client(host, port, name, orders, window, histogram, rng):
+    """Log in and pipeline orders in windows of up to window orders, timing
+    each window until the gateway has answered all of it."""
+    reader, writer = await asyncio.open_connection(host, port)
+    writer.write(f"LOGIN {name}\n".encode())
+    await reader.readline()
+    sent = 0
+    while sent < orders:
+        count = min(window, orders - sent)
+        lines = [f"{rng.choice(('BUY', 'SELL'))} {rng.choice(TICKERS)} LMT ${rng.randint(90, 110)} "
+                 f"{rng.randint(1, 100)}\n" for _ in range(count)]
+        start = time.perf_counter_ns()
+        writer.write(''.join(lines).encode() + b'PING\n')
+        await writer.drain()
+        while (await reader.readline()) != b'PONG\n':
+            pass
+        histogram.record(time.perf_counter_ns() - start)
+        sent += count
+    writer.write(b'QUIT\n')
+    await writer.drain()
+    writer.close()
+
+
+async def load(host, port, sessions, orders, window, seed):
+    """Run concurrent client sessions against a gateway and report the results."""
+    histogram = LatencyHistogram()
+    rng = random.Random(seed)
+    start = time.perf_counter()
+    await asyncio.gather(*(run_client(host, port, f"load{i}", orders, window, histogram,
+                                      random.Random(rng.random()))
+                           for i in range(sessions)))
+    elapsed = time.perf_counter() - start
+    total = sessions * orders
+    print(f"{sessions} sessions placed {total} orders in {elapsed:.3f}s ({total / elapsed:.0f} orders/s)")
+    print(f"Round trip of {window} orders p50: {histogram.percentile(50) / 1e6:.2f}ms "
+          f"p99: {histogram.percentile(99) / 1e6:.2f}ms")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('mode', choices=('serve', 'load'))
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8888)
+    parser.add_argument('--admin', action='store_true', help='log users in as admins, e.g. for load tests')
+    parser.add_argument('--sessions', type=int, default=100, help='number of concurrent load sessions')
+    parser.add_argument('--orders', type=int, default=1000, help='number of orders per load session')
+    parser.add_argument('--window', type=int, default=50, help='number of orders pipelined at once')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    if args.mode == 'serve':
+        asyncio.run(serve(args.host, args.port, args.admin))
+    else:
+        asyncio.run(load(args.host, args.port, args.sessions, args.orders, args.window, args.seed))
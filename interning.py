@@ -0,0 +1,32 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+@author: Desmond Tan
+"""
+
+
+class Interner:
+    """Assigns small integer ids to objects, e.g. users or tickers, in the order
+    they are first seen, so that records can refer to them by id."""
+
+    def __init__(self):
+        self.ids = {}
+        self.objects = []
+
+    def intern(self, obj):
+        """Get the id of an object, assigning the next id if it is new."""
+        id = self.ids.get(obj)
+        if id is None:
+            id = self.ids[obj] = len(self.objects)
+            self.objects.append(obj)
+        return id
+
+    def lookup(self, id):
+        """Get the object with the given id."""
+        return self.objects[id]
+
+    def __contains__(self, obj):
+        return obj in self.ids
+
+    def __len__(self):
+        return len(self.objects)
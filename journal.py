@@ -0,0 +1,231 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+@author: Desmond Tan
+
+Crash recovery for the exchange.
+
+The journal is a sequential write-ahead log of the commands accepted by the
+exchange and of the fills they caused, one tab-separated record per line:
+  C <time> <user> <action>    a command executed with Exchange.execute
+  B <time> <count>            a batch submitted with Exchange.submit_batch,
+  O <user> <action>           followed by one record per order of the batch
+  F <ticker> <ticks> <quantity> <buyer id> <seller id>    a fill
+  A <time> <ticker>           a stock put in auction with Exchange.start_auction
+  U <time> <ticker>           a stock uncrossed with Exchange.uncross
+
+The time of a command is the time of the exchange's clock, in nanoseconds,
+that the command ran at. The clock is stopped at that time while it runs,
+and recovery runs it at the same time, so that it expires the same orders
+and timestamps its trades the same, see Exchange.stopped_clock.
+
+A snapshot is a pickle of the whole exchange, taken together with the
+position in the journal it includes everything up to. Recovery loads the
+snapshot and replays only the commands after that position; fills are
+not replayed, as matching the same commands again gives the same fills.
+"""
+import itertools
+import os
+import pickle
+import time
+
+from commands import parse, format_expiry
+from events import NullSink
+from orders import LimitOrder, StopOrder
+
+
+def order_action(order):
+    """Format an order as the action that would place it."""
+    if isinstance(order, LimitOrder):
+        return f"{order.direction} {order.ticker} LMT ${order.price} {order.quantity}{tif_suffix(order)}"
+    if isinstance(order, StopOrder):
+        if order.limit_price is None:
+            return f"{order.direction} {order.ticker} STP ${order.price} {order.quantity}"
+        return f"{order.direction} {order.ticker} STPLMT ${order.price} ${order.limit_price} {order.quantity}"
+    return f"{order.direction} {order.ticker} MKT {order.quantity}{tif_suffix(order)}"
+
+
+def tif_suffix(order):
+    """Format the time in force of an order as it ends an action."""
+    if order.tif is None:
+        return ""
+    if order.tif == 'GTD':
+        return f" GTD {format_expiry(order.expires)}"
+    return f" {order.tif}"
+
+
+class Journal:
+    """Write-ahead journal with group commit.
+
+    Records are buffered and written with a single write and fsync once
+    group_size records are buffered or group_interval seconds have passed
+    since the last commit. If snapshot_path is set, the exchange saves a
+    snapshot there after every snapshot_every commands.
+    """
+
+    def __init__(self, path, group_size=512, group_interval=0.01, snapshot_path=None, snapshot_every=100000):
+        self.path = path
+        self.group_size = group_size
+        self.group_interval = group_interval
+        self.snapshot_path = snapshot_path
+        self.snapshot_every = snapshot_every
+        self.file = open(path, 'ab')
+        self.buffer = []
+        self.last_commit = time.monotonic()
+        self.commands = 0
+
+    def write(self, record):
+        self.buffer.append(record)
+        if len(self.buffer) >= self.group_size or time.monotonic() - self.last_commit >= self.group_interval:
+            self.commit()
+
+    def append_command(self, now, user, action):
+        self.commands += 1
+        self.write(f"C\t{now}\t{user.name}\t{action}\n")
+
+    def append_batch(self, now, orders):
+        self.commands += len(orders)
+        self.write(f"B\t{now}\t{len(orders)}\n" + "".join(
+            f"O\t{order.user.name}\t{order_action(order)}\n" for order in orders))
+
+    def append_auction(self, now, ticker):
+        self.write(f"A\t{now}\t{ticker}\n")
+
+    def append_uncross(self, now, ticker):
+        self.write(f"U\t{now}\t{ticker}\n")
+
+    def append_fill(self, ticker, ticks, quantity, buyer, seller):
+        self.write(f"F\t{ticker}\t{ticks}\t{quantity}\t{buyer}\t{seller}\n")
+
+    def snapshot_due(self):
+        """Check whether a snapshot should be saved, restarting the count if so."""
+        if self.snapshot_path is None or self.commands < self.snapshot_every:
+            return False
+        self.commands = 0
+        return True
+
+    def commit(self):
+        """Write the buffered records and fsync them to disk."""
+        if self.buffer:
+            self.file.write("".join(self.buffer).encode())
+            self.buffer.clear()
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.last_commit = time.monotonic()
+
+    def tell(self):
+        """Commit, and get the position of the end of the journal."""
+        self.commit()
+        return self.file.tell()
+
+    def close(self):
+        self.commit()
+        self.file.close()
+
+
+class StoppedClock:
+    """A clock that always gives the same time in nanoseconds, e.g. the time
+    of the journaled command being run or recovered."""
+    __slots__ = ('now',)
+
+    def __init__(self, now=0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def save_snapshot(exchange, path):
+    """Save a snapshot of the exchange, atomically replacing any older snapshot."""
+    offset = exchange.journal.tell() if exchange.journal is not None else 0
+    exchange.flush_trades()
+    temp_path = path + '.tmp'
+    with open(temp_path, 'wb') as f:
+        pickle.dump((offset, exchange), f, protocol=pickle.HIGHEST_PROTOCOL)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+    return offset
+
+
+def load_snapshot(path):
+    """Load a snapshot, returns the journal position it was taken at and the exchange."""
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+
+def read_records(path, offset=0):
+    """Read the complete records of a journal from the given position.
+
+    Yields (position after the record, fields) pairs. A torn record at the
+    end of the journal, from a crash in the middle of a write, is ignored."""
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        for line in f:
+            if not line.endswith(b'\n'):
+                return
+            offset += len(line)
+            yield offset, line[:-1].decode().split('\t')
+
+
+def recover(journal_path, snapshot_path=None, exchange=None, users=(), sink=None, **journal_options):
+    """Recover an exchange from its latest snapshot and the tail of its journal.
+
+    Without a snapshot, the journal is replayed from the start onto the given
+    exchange, which should have the same stocks listed as the original one.
+    Any trades already on its tapes are dropped, matching the journal again records them.
+    Users that are not in the snapshot, e.g. because they had not placed an
+    order when it was taken, must be given in users. The journal is reopened on the recovered exchange,
+    with the given journal options.
+    """
+    offset = 0
+    if snapshot_path is not None and os.path.exists(snapshot_path):
+        offset, exchange = load_snapshot(snapshot_path)
+    else:
+        # Every trade is matched again, trades already on the tapes, e.g. in a
+        # tape directory shared with the crashed exchange, would be recorded twice
+        for tape in exchange.trades.values():
+            tape.truncate()
+    by_name = {user.name: user for user in exchange.user_ids.objects}
+    for user in users:
+        if user.name not in by_name:
+            user.exchange = exchange
+            by_name[user.name] = user
+
+    exchange.journal = None
+    exchange.sink = NullSink()
+    # The commands run at the times they were journaled at
+    clock = exchange.clock
+    exchange.clock = replay_clock = StoppedClock()
+    end = offset
+    if os.path.exists(journal_path):
+        records = read_records(journal_path, offset)
+        for position, fields in records:
+            kind = fields[0]
+            if kind != 'F':
+                replay_clock.now = int(fields[1])
+            if kind == 'C':
+                exchange.execute(by_name[fields[2]], fields[3])
+            elif kind == 'B':
+                count = int(fields[2])
+                orders = []
+                for position, (_, name, action) in itertools.islice(records, count):
+                    orders.append(exchange.make_order(by_name[name], parse(action)))
+                if len(orders) < count:
+                    # The batch was torn
+                    break
+                exchange.submit_batch(orders)
+            elif kind == 'A':
+                exchange.start_auction(fields[2])
+            elif kind == 'U':
+                exchange.uncross(fields[2])
+            end = position
+
+        # Drop any torn record so that new records are appended after the last complete one
+        with open(journal_path, 'ab') as f:
+            f.truncate(end)
+
+    exchange.clock = clock
+    exchange.sink = sink if sink is not None else NullSink()
+    exchange.journal = Journal(journal_path, snapshot_path=snapshot_path, **journal_options)
+    return exchange
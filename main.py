@@ -19,11 +19,13 @@ Here are the functions that it should support:
   7. The user should be able to view all order status. E.g. filled, partially filled, pending.
   8. The user is able to exit the exchange program. (In real life, you exit the client)
 """
+import argparse
 import random
 
 from orders import *
 from exchange import *
 from user import *
+from profiling import profile
 
 
 TICKERS = ['AAPL', 'MSFT', 'GOOG', 'FB', 'AMZN', 'SNAP']
@@ -35,15 +37,20 @@ def init_stocks(exchange, tickers=TICKERS):
 
 
 def init_order_books(exchange):
+    """Seed the books with an opening auction around a random mark price,
+    which sets the opening price and leaves orders on both sides."""
     user = User("admin", exchange)
     user.deposit(1000000)
     for ticker in TICKERS:
         user.add_stock(ticker, 100)
-        mark_price = random.randint(2, 10)
-        exchange.place_limit_order(BuyOrder(
-            user, ticker, mark_price - 1, 100))
-        exchange.place_limit_order(SellOrder(
-            user, ticker, mark_price + 1, 100))
+        mark_price = random.randint(3, 10)
+        exchange.start_auction(ticker)
+        for _ in range(4):
+            exchange.place_limit_order(BuyOrder(
+                user, ticker, mark_price + random.randint(-2, 1), 25))
+            exchange.place_limit_order(SellOrder(
+                user, ticker, mark_price + random.randint(-1, 2), 25))
+        exchange.uncross(ticker)
 
 
 def main():
@@ -62,4 +69,11 @@ def main():
 
 
 if __name__ == '__main__':
-    main()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--profile', nargs='?', const='profile', default=None, metavar='PREFIX',
+                        help='profile the session and write PREFIX.prof, PREFIX.txt and PREFIX.folded, see profiling.py')
+    args = parser.parse_args()
+    if args.profile is not None:
+        profile(main, args.profile)
+    else:
+        main()
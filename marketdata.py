@@ -0,0 +1,199 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+@author: Desmond Tan
+
+Incremental market data.
+
+The exchange tells the publisher which books have changed, and after each
+command the publisher compares the top of those books with what it last
+published. Only the differences are sent to the subscribers:
+  TopOfBook      the best bid and ask with their quantities, and the last price (L1)
+  DepthUpdate    the new open quantity at one price level of the top levels (L2),
+                 a quantity of 0 means the level is gone
+  Snapshot       the full top of a book, sent when subscribing and then every
+                 snapshot_interval updates, so that subscribers can resynchronize
+Every message carries a sequence number per ticker, and a subscriber that
+sees a gap can recover from the next snapshot.
+"""
+from collections import namedtuple
+
+from orderbook import BUY, SELL
+
+
+TopOfBook = namedtuple('TopOfBook', 'ticker sequence bid bid_quantity ask ask_quantity last')
+DepthUpdate = namedtuple('DepthUpdate', 'ticker sequence side price quantity')
+Snapshot = namedtuple('Snapshot', 'ticker sequence top bids asks')
+
+SIDES = ('BID', 'ASK')
+
+
+class Subscription:
+    """Receives the market data of some tickers, or of every ticker.
+
+    Messages are passed to the callback as they are published, or else kept
+    until poll(). A conflated subscription only keeps the latest top of book
+    per ticker and the latest quantity per price level, and a snapshot drops
+    everything kept for its ticker, so a slow subscriber gets the current
+    state rather than every step in between. The sequence numbers of a
+    conflated stream have gaps.
+    """
+
+    def __init__(self, tickers=None, conflate=False, callback=None):
+        self.tickers = set(tickers) if tickers is not None else None
+        self.conflate = conflate
+        self.callback = callback
+        self.messages = {} if conflate else []
+
+    def wants(self, ticker):
+        return self.tickers is None or ticker in self.tickers
+
+    def deliver(self, message):
+        if self.callback is not None:
+            self.callback(message)
+        elif not self.conflate:
+            self.messages.append(message)
+        else:
+            kind = type(message)
+            if kind is Snapshot:
+                for key in [key for key in self.messages if key[1] == message.ticker]:
+                    del self.messages[key]
+                self.messages[(Snapshot, message.ticker)] = message
+            elif kind is TopOfBook:
+                self.messages[(TopOfBook, message.ticker)] = message
+            else:
+                self.messages[(DepthUpdate, message.ticker, message.side, message.price)] = message
+
+    def poll(self):
+        """Get the messages received since the last poll, in sequence order per ticker."""
+        if self.conflate:
+            messages = sorted(self.messages.values(), key=lambda message: (message.ticker, message.sequence))
+            self.messages = {}
+        else:
+            messages = self.messages
+            self.messages = []
+        return messages
+
+
+class BookState:
+    """What was last published for a book."""
+    __slots__ = ('sequence', 'top', 'depth', 'updates')
+
+    def __init__(self):
+        self.sequence = 0
+        self.top = None
+        # Open quantity by price in ticks of the published levels of each side
+        self.depth = [{}, {}]
+        self.updates = 0
+
+
+class MarketDataPublisher:
+    """Publishes the top of book and the top depth levels of changed books.
+
+    Attach it to an exchange with Exchange.market_data. The books that change
+    are only marked, publish() computes and sends their updates, so a book
+    that changes several times between two publishes is only looked at once.
+    """
+
+    def __init__(self, depth=5, snapshot_interval=1000):
+        self.depth = depth
+        self.snapshot_interval = snapshot_interval
+        self.subscriptions = []
+        self.books = {}
+        self.states = {}
+        # Tickers of the changed books, in the order they changed
+        self.dirty = {}
+
+    def changed(self, book):
+        """Mark a book as changed."""
+        self.dirty[book.ticker] = True
+        self.books[book.ticker] = book
+
+    def subscribe(self, tickers=None, conflate=False, callback=None):
+        """Subscribe to some tickers, or to every ticker, starting with a
+        snapshot of each book that has been published so far."""
+        subscription = Subscription(tickers, conflate, callback)
+        self.subscriptions.append(subscription)
+        for ticker in self.states:
+            if subscription.wants(ticker):
+                subscription.deliver(self.snapshot(ticker))
+        return subscription
+
+    def unsubscribe(self, subscription):
+        self.subscriptions.remove(subscription)
+
+    def send(self, message):
+        for subscription in self.subscriptions:
+            if subscription.wants(message.ticker):
+                subscription.deliver(message)
+
+    def top(self, book):
+        """Get the top of a book as (bid ticks, bid quantity, ask ticks, ask quantity, last ticks)."""
+        top = []
+        for side in book.limit_orders:
+            level = side.best_level()
+            if level is None:
+                top += (None, 0)
+            else:
+                top += (level.ticks, level.quantity)
+        top.append(book.trades.last_ticks())
+        return tuple(top)
+
+    def make_top(self, ticker, sequence, top):
+        to_price = self.books[ticker].stock.to_price
+        bid, bid_quantity, ask, ask_quantity, last = top
+        return TopOfBook(ticker, sequence, to_price(bid) if bid is not None else 0, bid_quantity,
+                         to_price(ask) if ask is not None else 0, ask_quantity,
+                         to_price(last) if last is not None else 0)
+
+    def snapshot(self, ticker):
+        """Get a snapshot of the last published state of a book."""
+        state = self.states[ticker]
+        to_price = self.books[ticker].stock.to_price
+        bids, asks = (tuple((to_price(ticks), quantity) for ticks, quantity in
+                            sorted(levels.items(), reverse=direction == BUY))
+                      for direction, levels in enumerate(state.depth))
+        return Snapshot(ticker, state.sequence, self.make_top(ticker, state.sequence, state.top), bids, asks)
+
+    def publish(self):
+        """Send the updates of every book that has changed since the last publish."""
+        if not self.dirty:
+            return
+        for ticker in self.dirty:
+            self.publish_book(ticker)
+        self.dirty.clear()
+
+    def publish_book(self, ticker):
+        book = self.books[ticker]
+        state = self.states.get(ticker)
+        if state is None:
+            state = self.states[ticker] = BookState()
+        to_price = book.stock.to_price
+        send = self.send
+
+        for direction in (BUY, SELL):
+            ticks, quantities = book.limit_orders[direction].depth(self.depth)
+            levels = dict(zip(ticks, quantities))
+            published = state.depth[direction]
+            if levels == published:
+                continue
+            for level_ticks, quantity in levels.items():
+                if published.get(level_ticks) != quantity:
+                    state.sequence += 1
+                    send(DepthUpdate(ticker, state.sequence, SIDES[direction], to_price(level_ticks), quantity))
+            for level_ticks in published.keys() - levels.keys():
+                state.sequence += 1
+                send(DepthUpdate(ticker, state.sequence, SIDES[direction], to_price(level_ticks), 0))
+            state.depth[direction] = levels
+            state.updates += 1
+
+        top = self.top(book)
+        if top != state.top:
+            state.sequence += 1
+            state.top = top
+            send(self.make_top(ticker, state.sequence, top))
+            state.updates += 1
+
+        if state.updates >= self.snapshot_interval:
+            state.updates = 0
+            send(self.snapshot(ticker))
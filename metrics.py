@@ -0,0 +1,169 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+@author: Desmond Tan
+"""
+import heapq
+import json
+import math
+import time
+
+
+class LatencyHistogram:
+    """Histogram of latencies in nanoseconds that takes constant memory.
+
+    Values below 2 * 2**precision are counted exactly. Larger values are
+    counted in buckets 2**-precision of their magnitude wide, so percentiles
+    are accurate to about 3% with the default precision of 5 bits.
+    """
+
+    def __init__(self, precision=5):
+        self.precision = precision
+        self.sub_buckets = 1 << precision
+        self.counts = [0] * ((66 - precision) * self.sub_buckets)
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def index(self, value):
+        """Get the index of the bucket a value is counted in."""
+        shift = value.bit_length() - self.precision - 1
+        if shift <= 0:
+            return value
+        return shift * self.sub_buckets + (value >> shift)
+
+    def value(self, index):
+        """Get the highest value counted in a bucket."""
+        if index < 2 * self.sub_buckets:
+            return index
+        shift = index // self.sub_buckets - 1
+        mantissa = index - shift * self.sub_buckets
+        return ((mantissa + 1) << shift) - 1
+
+    def record(self, value):
+        self.counts[self.index(value)] += 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        """Add the values counted by another histogram of the same precision."""
+        if other.precision != self.precision:
+            raise Exception('Cannot merge histograms of different precisions')
+        for index, count in enumerate(other.counts):
+            self.counts[index] += count
+        self.count += other.count
+        self.total += other.total
+        for value in (other.min, other.max):
+            if value is not None:
+                self.min = value if self.min is None else min(self.min, value)
+                self.max = value if self.max is None else max(self.max, value)
+
+    def mean(self):
+        return self.total / self.count if self.count else 0
+
+    def percentile(self, percent):
+        """Get the value at a percentile from 0 to 100, or 0 if nothing was recorded."""
+        if not self.count:
+            return 0
+        rank = max(1, math.ceil(percent / 100 * self.count))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(max(self.value(index), self.min), self.max)
+        return self.max
+
+
+# Stages of an order that are timed, see Metrics
+STAGES = ('parse', 'verify', 'match', 'settle')
+PERCENTILES = (50, 99, 99.9)
+
+
+def summarize(histogram):
+    """Get the count, mean, percentiles and max of a histogram as a dict."""
+    summary = {'count': histogram.count, 'mean': histogram.mean()}
+    for percent in PERCENTILES:
+        summary[f'p{percent:g}'] = histogram.percentile(percent)
+    summary['max'] = histogram.max or 0
+    return summary
+
+
+class Metrics:
+    """Latencies, counters and gauges of an exchange, see Exchange.metrics.
+
+    The latency of each stage of STAGES is recorded in nanoseconds: parsing an
+    action, verifying an order against its user's account, matching an order,
+    which includes settling its fills, and settling a single fill. The number
+    of orders and fills is counted per ticker, and the number of fills of each
+    matched order is kept in a histogram. The gauges, the open limit orders
+    and queued market orders of each side of each book, are read from the
+    books when the metrics are exported, so they cost nothing to keep.
+
+    An exchange without metrics, which is the default, does not time anything.
+    """
+
+    def __init__(self, precision=5):
+        self.clock = time.perf_counter_ns
+        self.latency = {stage: LatencyHistogram(precision) for stage in STAGES}
+        self.fills_per_order = LatencyHistogram(precision)
+        self.orders = {}
+        self.fills = {}
+        self.books = {}
+
+    def watch(self, book):
+        """Add the gauges and counters of a book."""
+        self.books[book.ticker] = book
+        self.orders[book.ticker] = 0
+        self.fills[book.ticker] = 0
+
+    def gauges(self, ticker):
+        """Get the number of open limit orders and queued market orders of each side of a book."""
+        book = self.books[ticker]
+        return {'bids': book.limit_orders[0].size, 'asks': book.limit_orders[1].size,
+                'market_bids': book.market_orders[0].size, 'market_asks': book.market_orders[1].size}
+
+    def hot_tickers(self, n=10):
+        """Get the n tickers with the most orders, as (ticker, orders) pairs."""
+        return heapq.nlargest(n, self.orders.items(), key=lambda item: item[1])
+
+    def as_dict(self):
+        return {
+            'latency': {stage: summarize(histogram) for stage, histogram in self.latency.items()},
+            'fills_per_order': summarize(self.fills_per_order),
+            'tickers': {ticker: {'orders': self.orders[ticker], 'fills': self.fills[ticker], **self.gauges(ticker)}
+                        for ticker in self.books},
+        }
+
+    def to_json(self):
+        """Export the metrics as JSON."""
+        return json.dumps(self.as_dict())
+
+    def to_text(self):
+        """Export the metrics in the Prometheus text format."""
+        lines = ['# TYPE exchange_latency_ns summary']
+        for stage, histogram in self.latency.items():
+            for percent in PERCENTILES:
+                lines.append(f'exchange_latency_ns{{stage="{stage}",quantile="{percent / 100:g}"}} '
+                             f'{histogram.percentile(percent)}')
+            lines.append(f'exchange_latency_ns_sum{{stage="{stage}"}} {histogram.total}')
+            lines.append(f'exchange_latency_ns_count{{stage="{stage}"}} {histogram.count}')
+        lines.append('# TYPE exchange_fills_per_order summary')
+        for percent in PERCENTILES:
+            lines.append(f'exchange_fills_per_order{{quantile="{percent / 100:g}"}} '
+                         f'{self.fills_per_order.percentile(percent)}')
+        lines.append(f'exchange_fills_per_order_sum {self.fills_per_order.total}')
+        lines.append(f'exchange_fills_per_order_count {self.fills_per_order.count}')
+        for name, counts in (('orders', self.orders), ('fills', self.fills)):
+            lines.append(f'# TYPE exchange_{name}_total counter')
+            lines.extend(f'exchange_{name}_total{{ticker="{ticker}"}} {count}' for ticker, count in counts.items())
+        lines.append('# TYPE exchange_book_orders gauge')
+        for ticker in self.books:
+            gauges = self.gauges(ticker)
+            for name in ('bids', 'asks', 'market_bids', 'market_asks'):
+                lines.append(f'exchange_book_orders{{ticker="{ticker}",side="{name}"}} {gauges[name]}')
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,459 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+@author: Desmond Tan
+"""
+import heapq
+from array import array
+from collections import deque
+
+from orders import LimitOrder, StopOrder
+
+
+BUY = 0
+SELL = 1
+
+# A book is compacted once more than this share of its entries are cancelled orders,
+# as long as there are at least COMPACT_MIN of them
+COMPACT_RATIO = 0.5
+COMPACT_MIN = 64
+
+
+class PriceLevel:
+    """All the resting orders at a single price, in arrival order.
+
+    quantity is the total quantity still open on the live orders of the
+    level. It is kept up to date as orders are added, filled, cancelled and
+    amended, so reading the depth of a book does not walk its orders."""
+    __slots__ = ('price', 'ticks', 'orders', 'quantity')
+
+    def __init__(self, price, ticks):
+        self.price = price
+        self.ticks = ticks
+        self.orders = deque()
+        self.quantity = 0
+
+    def __len__(self):
+        return len(self.orders)
+
+    def open_quantity(self):
+        """Total quantity still open on the live orders of the level, in O(1)."""
+        return self.quantity
+
+
+def depth_arrays(levels, n):
+    """Collect up to n non-empty levels, in priority order, into contiguous
+    arrays of prices in ticks and of open quantities."""
+    ticks = array('q')
+    quantities = array('q')
+    for level in levels:
+        quantity = level.quantity
+        if quantity:
+            ticks.append(level.ticks)
+            quantities.append(quantity)
+            if len(ticks) == n:
+                break
+    return ticks, quantities
+
+
+class BookSide:
+    """One side (bids or asks) of an order book.
+
+    Price levels are stored in a dict keyed by a sort key, with a heap of
+    the same keys on top so that the best level is always at the top.
+    Opening a new level is O(log levels), joining an existing level is O(1).
+    Orders within a level are kept in arrival order, which gives price-time
+    priority. The best level is cached so that the top of the book is O(1).
+
+    Cancelled orders are left in place as tombstones and skipped once they
+    reach the front of their level, so the order at the front of the best
+    level is always live.
+    """
+
+    def __init__(self, direction):
+        self.direction = direction
+        self.levels = {}
+        self.keys = []
+        self.size = 0
+        self.tombstones = 0
+        self.best = None
+
+    def key(self, ticks):
+        """Sort key of a price in ticks; bids are keyed on the negated price so
+        that the highest bid sits at the top of the heap."""
+        return -ticks if self.direction == BUY else ticks
+
+    def push(self, order):
+        """Add an order to the back of its price level."""
+        key = self.key(order.ticks)
+        level = self.levels.get(key)
+        if level is None:
+            level = self.levels[key] = PriceLevel(order.price, order.ticks)
+            heapq.heappush(self.keys, key)
+            if self.keys[0] == key:
+                self.best = level
+        level.orders.append(order)
+        level.quantity += order.quantity - order.filled
+        self.size += 1
+
+    def level_of(self, order):
+        """Get the price level of a resting order."""
+        return self.levels[self.key(order.ticks)]
+
+    def reduce(self, order, quantity):
+        """Reduce the total quantity of a resting order, keeping its place in its level."""
+        self.level_of(order).quantity -= order.quantity - quantity
+        order.quantity = quantity
+
+    def cancel(self, order):
+        """Cancel a resting order in O(1) by turning it into a tombstone."""
+        self.level_of(order).quantity -= order.quantity - order.filled
+        order.cancelled = True
+        self.size -= 1
+        self.tombstones += 1
+        self.prune()
+        if self.tombstones >= COMPACT_MIN and self.tombstones > COMPACT_RATIO * (self.size + self.tombstones):
+            self.compact()
+
+    def best_level(self):
+        """Get the best price level, or None if the side is empty."""
+        return self.best
+
+    def pop_level(self):
+        """Remove the best price level."""
+        key = heapq.heappop(self.keys)
+        del self.levels[key]
+        self.best = self.levels[self.keys[0]] if self.keys else None
+
+    def prune(self):
+        """Drop tombstones and empty levels from the top of the book."""
+        best = self.best
+        while best is not None:
+            orders = best.orders
+            while orders and orders[0].cancelled:
+                orders.popleft()
+                self.tombstones -= 1
+            if orders:
+                return
+            self.pop_level()
+            best = self.best
+
+    def compact(self):
+        """Rebuild the side without any of its tombstones."""
+        levels = {}
+        for key, level in self.levels.items():
+            orders = deque(order for order in level.orders if not order.cancelled)
+            if orders:
+                level.orders = orders
+                levels[key] = level
+        self.levels = levels
+        self.keys = list(levels)
+        heapq.heapify(self.keys)
+        self.best = levels[self.keys[0]] if self.keys else None
+        self.tombstones = 0
+
+    def peek(self):
+        """Get the order with the highest priority, or None if the side is empty."""
+        best = self.best
+        return best.orders[0] if best is not None else None
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, index):
+        # Only the top of the book is addressable, like heap[0] used to be
+        if index != 0 or not self.size:
+            raise IndexError('Only the best order of a non-empty book can be accessed')
+        return self.peek()
+
+    def __iter__(self):
+        """Iterate over the resting orders in priority order."""
+        for key in sorted(self.keys):
+            for order in self.levels[key].orders:
+                if not order.cancelled:
+                    yield order
+
+    def iter_levels(self):
+        """Iterate over the levels from the best level outwards.
+
+        Walks the heap of keys best-first, so reading the top n levels costs
+        O(n log n) however many levels the side has."""
+        keys = self.keys
+        levels = self.levels
+        if not keys:
+            return
+        count = len(keys)
+        frontier = [(keys[0], 0)]
+        while frontier:
+            key, index = heapq.heappop(frontier)
+            yield levels[key]
+            child = 2 * index + 1
+            if child < count:
+                heapq.heappush(frontier, (keys[child], child))
+                if child + 1 < count:
+                    heapq.heappush(frontier, (keys[child + 1], child + 1))
+
+    def depth(self, n):
+        """Get the top n price levels as arrays of prices in ticks and of open quantities."""
+        return depth_arrays(self.iter_levels(), n)
+
+
+class LadderSide:
+    """One side of an order book for a stock with a bounded price band.
+
+    Every tick in the band has a preallocated price level in an array, and a
+    cursor points at the best level, so inserting, cancelling and reading the
+    top of the book are O(1). When the best level empties the cursor walks
+    to the next level with orders. Works as a drop-in for BookSide.
+    """
+
+    def __init__(self, direction, stock):
+        self.direction = direction
+        self.min_ticks = stock.to_ticks(stock.min_price)
+        self.max_ticks = stock.to_ticks(stock.max_price)
+        self.levels = [PriceLevel(stock.to_price(ticks), ticks)
+                       for ticks in range(self.min_ticks, self.max_ticks + 1)]
+        # Direction the cursor walks in when the best level empties
+        self.step = -1 if direction == BUY else 1
+        self.cursor = None
+        self.size = 0
+        self.tombstones = 0
+        self.best = None
+
+    def push(self, order):
+        """Add an order to the back of its price level."""
+        index = order.ticks - self.min_ticks
+        if not 0 <= index < len(self.levels):
+            raise Exception('Price is outside of the price band')
+        level = self.levels[index]
+        level.orders.append(order)
+        level.quantity += order.quantity - order.filled
+        self.size += 1
+        cursor = self.cursor
+        if cursor is None or (index > cursor if self.direction == BUY else index < cursor):
+            self.cursor = index
+            self.best = self.levels[index]
+
+    def level_of(self, order):
+        """Get the price level of a resting order."""
+        return self.levels[order.ticks - self.min_ticks]
+
+    def reduce(self, order, quantity):
+        """Reduce the total quantity of a resting order, keeping its place in its level."""
+        self.level_of(order).quantity -= order.quantity - quantity
+        order.quantity = quantity
+
+    def cancel(self, order):
+        """Cancel a resting order in O(1) by turning it into a tombstone."""
+        self.level_of(order).quantity -= order.quantity - order.filled
+        order.cancelled = True
+        self.size -= 1
+        self.tombstones += 1
+        self.prune()
+        if self.tombstones >= COMPACT_MIN and self.tombstones > COMPACT_RATIO * (self.size + self.tombstones):
+            self.compact()
+
+    def best_level(self):
+        """Get the best price level, or None if the side is empty."""
+        return self.best
+
+    def pop_level(self):
+        """Move the cursor past the best level, to the next level with any orders."""
+        if not self.size:
+            self.cursor = self.best = None
+            return
+        levels = self.levels
+        step = self.step
+        index = self.cursor + step
+        while not levels[index].orders:
+            index += step
+        self.cursor = index
+        self.best = levels[index]
+
+    def prune(self):
+        """Drop tombstones and empty levels from the top of the book."""
+        best = self.best
+        while best is not None:
+            orders = best.orders
+            while orders and orders[0].cancelled:
+                orders.popleft()
+                self.tombstones -= 1
+            if orders:
+                return
+            self.pop_level()
+            best = self.best
+
+    def compact(self):
+        """Drop every tombstone from the levels."""
+        for level in self.levels:
+            if level.orders:
+                level.orders = deque(order for order in level.orders if not order.cancelled)
+        self.tombstones = 0
+
+    def peek(self):
+        """Get the order with the highest priority, or None if the side is empty."""
+        best = self.best
+        return best.orders[0] if best is not None else None
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, index):
+        if index != 0 or not self.size:
+            raise IndexError('Only the best order of a non-empty book can be accessed')
+        return self.peek()
+
+    def iter_levels(self):
+        """Iterate over the levels from the best level outwards."""
+        if self.cursor is None:
+            return iter(())
+        if self.direction == BUY:
+            return reversed(self.levels[:self.cursor + 1])
+        return iter(self.levels[self.cursor:])
+
+    def __iter__(self):
+        """Iterate over the resting orders in priority order."""
+        for level in self.iter_levels():
+            for order in level.orders:
+                if not order.cancelled:
+                    yield order
+
+    def depth(self, n):
+        """Get the top n price levels as arrays of prices in ticks and of open quantities."""
+        return depth_arrays(self.iter_levels(), n)
+
+
+class OrderQueue:
+    """Queued market orders of one side of a book, in arrival order.
+
+    Backed by a deque so that removing the order at the front is O(1), also
+    when a large order drains many queued orders in one go. Cancelled orders
+    are tombstones, the same as in BookSide, so the order at the front of
+    the queue is always live.
+    """
+
+    def __init__(self):
+        self.orders = deque()
+        self.size = 0
+        self.tombstones = 0
+
+    def append(self, order):
+        self.orders.append(order)
+        self.size += 1
+
+    def pop(self):
+        """Remove the order at the front of the queue."""
+        self.orders.popleft()
+        self.size -= 1
+        self.prune()
+
+    def cancel(self, order):
+        """Cancel a queued order in O(1) by turning it into a tombstone."""
+        order.cancelled = True
+        self.size -= 1
+        self.tombstones += 1
+        self.prune()
+        if self.tombstones >= COMPACT_MIN and self.tombstones > COMPACT_RATIO * (self.size + self.tombstones):
+            self.compact()
+
+    def prune(self):
+        """Drop tombstones from the front of the queue."""
+        orders = self.orders
+        while orders and orders[0].cancelled:
+            orders.popleft()
+            self.tombstones -= 1
+
+    def compact(self):
+        """Rebuild the queue without any of its tombstones."""
+        self.orders = deque(order for order in self.orders if not order.cancelled)
+        self.tombstones = 0
+
+    def peek(self):
+        """Get the order at the front of the queue, or None if it is empty."""
+        return self.orders[0] if self.orders else None
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, index):
+        if index != 0 or not self.size:
+            raise IndexError('Only the first order of a non-empty queue can be accessed')
+        return self.orders[0]
+
+    def __iter__(self):
+        """Iterate over the queued orders in arrival order."""
+        for order in self.orders:
+            if not order.cancelled:
+                yield order
+
+
+class OrderBook:
+    """All the resting orders and trades of a single stock.
+
+    The limit orders are kept in a BookSide per side by default, or in a
+    LadderSide for stocks with a price band if ladder is set.
+    """
+
+    def __init__(self, stock, ladder=False, trades=None):
+        self.stock = stock
+        self.ticker = stock.ticker
+        self.tick_units = stock.tick_units
+        if ladder:
+            self.limit_orders = [LadderSide(BUY, stock), LadderSide(SELL, stock)]
+        else:
+            self.limit_orders = [BookSide(BUY), BookSide(SELL)]
+        self.market_orders = [OrderQueue(), OrderQueue()]
+        # Pending stop orders by stop price, the buy stops with the lowest stop
+        # price at the top and the sell stops with the highest, see triggered_stops
+        self.stops = [BookSide(SELL), BookSide(BUY)]
+        self.trades = trades if trades is not None else []
+        # Highest and lowest prices in ticks traded since the stops were last
+        # checked, None if nothing has traded since, see Exchange.trigger_stops
+        self.high_ticks = None
+        self.low_ticks = None
+
+    def depth(self, n):
+        """Get the top n levels of the bids and of the asks, see BookSide.depth."""
+        return self.limit_orders[BUY].depth(n), self.limit_orders[SELL].depth(n)
+
+    def cancel(self, order):
+        """Cancel a resting limit order, a pending stop order or a queued market order."""
+        direction = BUY if order.direction == "BUY" else SELL
+        if isinstance(order, LimitOrder):
+            self.limit_orders[direction].cancel(order)
+        elif isinstance(order, StopOrder):
+            self.stops[direction].cancel(order)
+        else:
+            self.market_orders[direction].cancel(order)
+
+    def reduce(self, order, quantity):
+        """Reduce the total quantity of a resting limit order or queued market
+        order in place, keeping its priority."""
+        if isinstance(order, LimitOrder):
+            self.limit_orders[BUY if order.direction == "BUY" else SELL].reduce(order, quantity)
+        else:
+            order.quantity = quantity
+
+    def triggered_stops(self, high_ticks, low_ticks=None):
+        """Remove and return the pending stop orders that the prices traded at
+        have reached, buy stops first, each in stop price then arrival order.
+
+        Buy stops are triggered by the highest price in ticks and sell stops by
+        the lowest, which is the same as the highest if it is not given.
+
+        Only the crossed stop prices are visited, so this is O(log n) per
+        crossed stop price plus O(1) per triggered order."""
+        if low_ticks is None:
+            low_ticks = high_ticks
+        triggered = []
+        for side, direction in ((self.stops[BUY], BUY), (self.stops[SELL], SELL)):
+            level = side.best_level()
+            while level is not None and (level.ticks <= high_ticks if direction == BUY else
+                                         level.ticks >= low_ticks):
+                live = [order for order in level.orders if not order.cancelled]
+                triggered += live
+                side.size -= len(live)
+                side.tombstones -= len(level.orders) - len(live)
+                side.pop_level()
+                level = side.best_level()
+        return triggered
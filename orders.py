@@ -3,29 +3,51 @@
 """
 @author: Desmond Tan
 """
+from ticks import to_units
 
 
 class Order:
+    __slots__ = ('user', 'ticker', 'quantity', 'direction', 'filled', 'sequence', 'id', 'cancelled', 'reserve',
+                 'tif', 'expires')
+
     def __init__(self, user, ticker, quantity, direction):
         self.user = user
         self.ticker = ticker
         self.quantity = quantity
         self.direction = direction
         self.filled = 0
-
-    def fill(self, quantity, price):
+        # Assigned by the exchange when the order is accepted, gives time priority
+        self.sequence = 0
+        self.id = None
+        self.cancelled = False
+        # Cash units reserved per share of a buy order, or 0 for the shares of a sell
+        # order, while the order is open. None if nothing is reserved, see User.reserve
+        self.reserve = None
+        # Time in force, IOC, FOK, DAY or GTD, or None for good till cancelled, and
+        # the time a DAY or GTD order expires at, in nanoseconds since the epoch
+        self.tif = None
+        self.expires = None
+
+    def fill(self, quantity, price, units=None):
         """Fill the order with the given quantity.
-        Ensures that the order is not filled beyond the quantity."""
+        Ensures that the order is not filled beyond the quantity.
+        The price per share may also be given in cash units, which is used to settle the trade."""
         remaning = self.quantity - self.filled
         fill_quantity = min(remaning, quantity)
         self.filled += fill_quantity
+        if units is None:
+            units = to_units(price)
+        if self.reserve is not None:
+            self.user.release(self, fill_quantity)
 
         if self.direction == "BUY":
-            self.user.withdraw(fill_quantity * price)
-            self.user.add_stock(self.ticker, fill_quantity)
+            self.user.withdraw_units(fill_quantity * units)
+            self.user.receive_stock(self.ticker, fill_quantity)
+            self.user.record_fill(self.ticker, fill_quantity, units)
         else:
-            self.user.remove_stock(self.ticker, fill_quantity)
-            self.user.deposit(fill_quantity * price)
+            self.user.deliver_stock(self.ticker, fill_quantity)
+            self.user.deposit_units(fill_quantity * units)
+            self.user.record_fill(self.ticker, -fill_quantity, units)
             
         return fill_quantity
 
@@ -33,7 +55,9 @@ class Order:
         return self.filled == self.quantity
 
     def get_status(self):
-        if self.is_filled():
+        if self.cancelled:
+            return "CANCELLED"
+        elif self.is_filled():
             return "FILLED"
         elif self.filled > 0:
             return "PARTIAL"
@@ -42,39 +66,118 @@ class Order:
 
 
 class MarketOrder(Order):
+    __slots__ = ('collar',)
+
     def __init__(self, user, ticker, quantity, direction):
         super().__init__(user, ticker, quantity, direction)
+        # Worst price in ticks the order may fill at, the highest for a buy and the
+        # lowest for a sell. Set when the order is accepted, None for no limit
+        self.collar = None
 
     def __str__(self) -> str:
         status = self.get_status()
         return f"{self.ticker} MKT {self.direction} {self.filled}/{self.quantity} {status}"
 
+    def amended(self, quantity, price=None):
+        """Create an order to replace this one with a new quantity, keeping its collar."""
+        order = MarketOrder(self.user, self.ticker, quantity, self.direction)
+        order.collar = self.collar
+        return order
+
+
+def needs_collar(order):
+    """Check whether an order fills at the market, and so needs a collar: a
+    market order, or a stop order that becomes one."""
+    return isinstance(order, MarketOrder) or isinstance(order, StopOrder) and order.limit_price is None
+
 
 class LimitOrder(Order):
+    __slots__ = ('price', 'ticks')
+
     def __init__(self, user, ticker, price, quantity, direction):
         self.price = price
+        # The price as a number of ticks, assigned by the exchange when the order is accepted
+        self.ticks = None
         super().__init__(user, ticker, quantity, direction)
 
     def __str__(self):
         status = self.get_status()
         return f"{self.ticker} LMT {self.direction} ${self.price:.2f} {self.filled}/{self.quantity} {status}"
 
+    def amended(self, quantity, price=None):
+        """Create an order to replace this one with a new quantity and price."""
+        price = self.price if price is None else price
+        return LimitOrder(self.user, self.ticker, price, quantity, self.direction)
+
 
 class BuyOrder(LimitOrder):
-    """Implemented such that the order with the highest price is always given priority"""
+    __slots__ = ()
 
     def __init__(self, user, ticker, price, quantity):
         super().__init__(user, ticker, price, quantity, "BUY")
 
-    def __lt__(self, other):
-        return self.price > other.price
+    def amended(self, quantity, price=None):
+        return BuyOrder(self.user, self.ticker, self.price if price is None else price, quantity)
 
 
 class SellOrder(LimitOrder):
-    """Implemented such that the order with the lowest price is always given priority"""
+    __slots__ = ()
 
     def __init__(self, user, ticker, price, quantity):
         super().__init__(user, ticker, price, quantity, "SELL")
 
-    def __lt__(self, other):
-        return self.price < other.price
+    def amended(self, quantity, price=None):
+        return SellOrder(self.user, self.ticker, self.price if price is None else price, quantity)
+
+
+class StopOrder(Order):
+    """Waits until the last price reaches its stop price, at or above it for a
+    buy and at or below it for a sell, and then becomes a market order, or a
+    limit order at limit_price for a stop-limit order.
+
+    price and ticks are the stop price, so that pending stop orders can be
+    kept in a BookSide, see OrderBook.stops. Once triggered, the status of
+    the order is the status of the order it became."""
+    __slots__ = ('price', 'ticks', 'limit_price', 'collar', 'triggered')
+
+    def __init__(self, user, ticker, price, quantity, direction, limit_price=None):
+        self.price = price
+        # The stop price as a number of ticks, assigned by the exchange when the order is accepted
+        self.ticks = None
+        self.limit_price = limit_price
+        # Collar of the market order a stop order becomes, see MarketOrder
+        self.collar = None
+        self.triggered = None
+        super().__init__(user, ticker, quantity, direction)
+
+    def __str__(self):
+        kind = "STP" if self.limit_price is None else f"STPLMT ${self.limit_price:.2f}"
+        order = self.triggered if self.triggered is not None else self
+        return (f"{self.ticker} {kind} {self.direction} ${self.price:.2f} "
+                f"{order.filled}/{order.quantity} {self.get_status()}")
+
+    def get_status(self):
+        if self.triggered is not None:
+            return self.triggered.get_status()
+        return super().get_status()
+
+    def amended(self, quantity, price=None):
+        """Create the order this stop order becomes, with a new quantity and limit price."""
+        if self.limit_price is None:
+            order = MarketOrder(self.user, self.ticker, quantity, self.direction)
+            order.collar = self.collar
+            return order
+        price = self.limit_price if price is None else price
+        if self.direction == "BUY":
+            return BuyOrder(self.user, self.ticker, price, quantity)
+        return SellOrder(self.user, self.ticker, price, quantity)
+
+    def trigger(self):
+        """Create the order this stop order becomes once triggered. It takes
+        over the order id and what the stop order has reserved."""
+        order = self.amended(self.quantity - self.filled)
+        order.id = self.id
+        order.reserve = self.reserve
+        self.reserve = None
+        self.triggered = order
+        return order
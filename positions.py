@@ -0,0 +1,64 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+@author: Desmond Tan
+
+Positions and P&L of the users, kept up to date on every fill. They are
+marked at the last prices when they are read, in O(1) per position of the
+user, so a trade costs nothing for the other holders of the stock.
+
+Amounts are in integer cash units, see ticks.py. Positions are signed, an
+admin selling shares it does not hold goes short.
+"""
+import heapq
+
+from ticks import from_units
+
+
+class Position:
+    """A user's position in a single stock, at average cost.
+
+    cost is the cost basis of the open quantity, realized the P&L of the
+    quantity that has been closed, and mark the last price per share the
+    position has been valued at."""
+    __slots__ = ('quantity', 'cost', 'realized', 'mark')
+
+    def __init__(self, mark):
+        self.quantity = 0
+        self.cost = 0
+        self.realized = 0
+        self.mark = mark
+
+    def fill(self, quantity, units):
+        """Add a fill of a signed quantity, positive for a buy, at units per share."""
+        held = self.quantity
+        if held and (held > 0) != (quantity > 0):
+            # Close as much of the position as the fill covers, at average cost
+            closed = min(abs(quantity), abs(held))
+            basis = self.cost * closed // abs(held)
+            value = closed * units if held > 0 else -closed * units
+            self.realized += value - basis
+            self.cost -= basis
+            held += closed if held < 0 else -closed
+            quantity += closed if quantity < 0 else -closed
+        self.cost += quantity * units
+        self.quantity = held + quantity
+
+    def average_cost(self):
+        """Get the average price paid per share of the open quantity."""
+        return from_units(self.cost) / self.quantity if self.quantity else 0
+
+    def unrealized(self):
+        """Get the P&L of the open quantity at the mark price, in cash units."""
+        return self.quantity * self.mark - self.cost
+
+
+def leaderboard(users, n=None):
+    """Get the users with the highest net worth, as (user, net worth) pairs."""
+    for user in users:
+        user.mark_positions()
+    if n is None:
+        ranked = sorted(users, key=lambda user: user.balance + user.market_value, reverse=True)
+    else:
+        ranked = heapq.nlargest(n, users, key=lambda user: user.balance + user.market_value)
+    return [(user, from_units(user.balance + user.market_value)) for user in ranked]
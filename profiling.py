@@ -0,0 +1,155 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+@author: Desmond Tan
+
+Profiling of a run, for the --profile option of main.py and stress_test.py.
+
+A run is profiled with cProfile, which counts every call, while a sampler
+thread takes the stack of the run every millisecond. Three files are written
+with the given prefix:
+  <prefix>.prof    the cProfile statistics, for pstats or snakeviz
+  <prefix>.txt     the cost of the functions in SCOPES and of what they call
+  <prefix>.folded  the sampled stacks in the folded format of flamegraph.pl,
+                   which speedscope can also open
+"""
+import cProfile
+import gc
+import io
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+
+from exchange import Exchange
+from orders import Order
+from user import User
+
+
+# Functions whose costs are reported, with their overrides in subclasses
+SCOPES = ((Exchange, 'resolve_order'), (Order, 'fill'), (User, 'verify_order'), (Exchange, 'execute'))
+
+
+# Qualified names of the code objects, for Pythons before 3.11, see qualified_name
+QUALIFIED_NAMES = {}
+
+
+def qualified_name(code):
+    """Get the qualified name of the function of a code object. Code objects
+    only have it from Python 3.11, before that it is looked up once from the
+    function that refers to the code object."""
+    name = getattr(code, 'co_qualname', None)
+    if name is None:
+        name = QUALIFIED_NAMES.get(code)
+        if name is None:
+            name = QUALIFIED_NAMES[code] = lookup_qualified_name(code)
+    return name
+
+
+def lookup_qualified_name(code):
+    for referrer in gc.get_referrers(code):
+        if getattr(referrer, '__code__', None) is code:
+            return referrer.__qualname__
+    return code.co_name
+
+
+def frame_name(code):
+    module = code.co_filename.rsplit('/', 1)[-1].removesuffix('.py')
+    return f"{module}.{qualified_name(code)}"
+
+
+class StackSampler:
+    """Counts the stacks of a thread, sampled every interval seconds from a
+    background thread. Stacks are kept folded, from the outermost frame to
+    the innermost joined with ';'."""
+
+    def __init__(self, interval=0.001, thread_id=None):
+        self.interval = interval
+        self.thread_id = thread_id if thread_id is not None else threading.get_ident()
+        self.stacks = Counter()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            names = []
+            while frame is not None:
+                names.append(frame_name(frame.f_code))
+                frame = frame.f_back
+            if names:
+                self.stacks[';'.join(reversed(names))] += 1
+
+    def write_folded(self, path):
+        with open(path, 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+def scoped_functions(cls, name):
+    """Get the pstats keys of a method of a class and of its overrides in subclasses."""
+    keys = []
+    classes = [cls]
+    while classes:
+        klass = classes.pop()
+        function = vars(klass).get(name)
+        if function is not None:
+            code = function.__code__
+            keys.append((code.co_filename, code.co_firstlineno, code.co_name))
+        classes.extend(klass.__subclasses__())
+    return keys
+
+
+def scoped_report(stats, scopes=SCOPES, limit=15):
+    """Get a report of the calls, own time and cumulative time of the scoped
+    functions, and of the functions they call that cost the most."""
+    stats.calc_callees()
+    out = io.StringIO()
+    for cls, name in scopes:
+        out.write(f"=== {cls.__name__}.{name} ===\n")
+        for key in scoped_functions(cls, name):
+            entry = stats.stats.get(key)
+            if entry is None:
+                continue
+            _, calls, own, cumulative, _ = entry
+            out.write(f"{pstats.func_std_string(key)}: {calls} calls, own {own:.3f}s, "
+                      f"cumulative {cumulative:.3f}s, {cumulative / calls * 1e6:.1f}us per call\n")
+            callees = stats.all_callees.get(key, {})
+            # Each callee is (calls, recursive calls, own time, cumulative time) when called from this function
+            for callee, (calls, _, own, cumulative) in sorted(callees.items(), key=lambda item: -item[1][3])[:limit]:
+                out.write(f"    {cumulative:8.3f}s {own:8.3f}s {calls:9d}  {pstats.func_std_string(callee)}\n")
+        out.write("\n")
+    out.write("=== Top functions by own time ===\n")
+    stats.stream = out
+    stats.sort_stats('tottime').print_stats(limit)
+    return out.getvalue()
+
+
+def profile(run, prefix='profile', interval=0.001):
+    """Call run() under cProfile and the stack sampler, and write the reports
+    of SCOPES with the given file prefix. Returns what run() returns."""
+    profiler = cProfile.Profile()
+    sampler = StackSampler(interval)
+    sampler.start()
+    start = time.perf_counter()
+    profiler.enable()
+    try:
+        return run()
+    finally:
+        profiler.disable()
+        elapsed = time.perf_counter() - start
+        sampler.stop()
+        profiler.dump_stats(f"{prefix}.prof")
+        with open(f"{prefix}.txt", 'w') as f:
+            f.write(scoped_report(pstats.Stats(profiler)))
+        sampler.write_folded(f"{prefix}.folded")
+        print(f"Profiled {elapsed:.3f}s, wrote {prefix}.prof, {prefix}.txt and {prefix}.folded", file=sys.stderr)
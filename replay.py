@@ -0,0 +1,147 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+@author: Desmond Tan
+
+Replays a command log of "<user>: <action>" lines, e.g. results/orders.txt,
+through the exchange and checks that it gives the same results as a golden run.
+
+The log is streamed line by line, the trades are spilled to a trade tape on
+disk and the users keep no history of their orders, so a log of any size is
+replayed in constant memory, apart from the orders resting on the books and
+the users and stocks seen.
+"""
+import argparse
+import filecmp
+import os
+import sys
+import tempfile
+import time
+
+from commands import parse_many, LimitCommand, MarketCommand, StopCommand
+from events import NullSink
+from exchange import Exchange, Stock
+from metrics import LatencyHistogram, Metrics
+from reports import RESULTS_DIR, TICKERS, write_trades, write_prices
+from user import Admin
+
+
+REPORTS = ('trades.txt', 'prices.txt')
+
+
+def replay(lines, exchange, batch_size=0, histogram=None):
+    """Replay the lines of a command log on the exchange.
+
+    Users are created as admins without an order history the first time
+    they appear, and stocks are listed the first time they appear.
+    Every command is timed into the histogram. If batch_size is set, runs of
+    orders are submitted with Exchange.submit_batch in batches of up to that
+    many, and each order is timed as an equal share of its batch.
+    Returns the number of commands replayed.
+    """
+    if histogram is None:
+        histogram = LatencyHistogram()
+    clock = time.perf_counter_ns
+    users = {}
+    stocks = exchange.stocks
+    batch = []
+    replayed = 0
+
+    def submit():
+        start = clock()
+        exchange.submit_batch(batch)
+        share = (clock() - start) // len(batch)
+        for _ in batch:
+            histogram.record(share)
+        batch.clear()
+
+    for name, command in parse_many(lines, with_user=True):
+        user = users.get(name)
+        if user is None:
+            user = users[name] = Admin(name, exchange, history=False)
+        kind = type(command)
+        if kind is LimitCommand or kind is MarketCommand or kind is StopCommand:
+            if command.ticker not in stocks:
+                exchange.list_stock(Stock(command.ticker))
+            if batch_size:
+                batch.append(exchange.make_order(user, command))
+                if len(batch) >= batch_size:
+                    submit()
+                replayed += 1
+                continue
+        if batch:
+            submit()
+        start = clock()
+        exchange.execute_command(user, command)
+        histogram.record(clock() - start)
+        replayed += 1
+    if batch:
+        submit()
+    return replayed
+
+
+def compare_reports(output_dir, golden_dir):
+    """Get the names of the reports that differ from the golden ones."""
+    return [name for name in REPORTS
+            if not filecmp.cmp(os.path.join(output_dir, name), os.path.join(golden_dir, name), shallow=False)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1],
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('log', nargs='?', default=os.path.join(RESULTS_DIR, 'orders.txt'),
+                        help='command log to replay (default: %(default)s)')
+    parser.add_argument('--batch', type=int, default=0, metavar='N',
+                        help='submit orders in batches of up to N orders')
+    parser.add_argument('--golden', default=None, metavar='DIR',
+                        help='directory of the golden trades.txt and prices.txt (default: the directory of the log)')
+    parser.add_argument('--output', default=None, metavar='DIR',
+                        help='write trades.txt and prices.txt to DIR instead of a temporary directory')
+    parser.add_argument('--no-verify', action='store_true', help='do not compare the results with the golden run')
+    parser.add_argument('--record', action='store_true',
+                        help='record the results as the golden run instead of comparing them')
+    parser.add_argument('--metrics', choices=('text', 'json'), default=None,
+                        help='print the metrics of the exchange after the replay in this format')
+    args = parser.parse_args()
+
+    golden_dir = args.golden if args.golden is not None else os.path.dirname(args.log)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        output_dir = args.output if args.output is not None else temp_dir
+        if args.record:
+            output_dir = golden_dir
+        os.makedirs(output_dir, exist_ok=True)
+        metrics = Metrics() if args.metrics is not None else None
+        exchange = Exchange(sink=NullSink(), tape_dir=os.path.join(temp_dir, 'tape'), metrics=metrics)
+        for ticker in TICKERS:
+            exchange.list_stock(Stock(ticker))
+
+        histogram = LatencyHistogram()
+        start = time.perf_counter()
+        with open(args.log) as f:
+            replayed = replay(f, exchange, args.batch, histogram)
+        elapsed = time.perf_counter() - start
+        print(f"Replayed {replayed} commands in {elapsed:.3f}s ({replayed / elapsed:.0f} orders/s)")
+        print(f"Latency p50: {histogram.percentile(50) / 1000:.1f}us "
+              f"p99: {histogram.percentile(99) / 1000:.1f}us "
+              f"p99.9: {histogram.percentile(99.9) / 1000:.1f}us "
+              f"max: {histogram.max / 1000 if histogram.max else 0:.1f}us")
+        if args.metrics == 'text':
+            print(metrics.to_text(), end='')
+        elif args.metrics == 'json':
+            print(metrics.to_json())
+
+        tickers = list(exchange.stocks)
+        write_trades(exchange, os.path.join(output_dir, 'trades.txt'), tickers)
+        write_prices(exchange, os.path.join(output_dir, 'prices.txt'), tickers)
+        if args.no_verify or args.record:
+            return 0
+        mismatched = compare_reports(output_dir, golden_dir)
+        for name in mismatched:
+            print(f"{name} does not match {os.path.join(golden_dir, name)}")
+        if not mismatched:
+            print(f"Results match the golden run in {golden_dir}")
+        return 1 if mismatched else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,44 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+@author: Desmond Tan
+
+Writes the results of a run of the exchange in the format of the files in results/.
+"""
+import os
+
+
+RESULTS_DIR = 'results'
+ORDERS_FILE = os.path.join(RESULTS_DIR, 'orders.txt')
+TRADES_FILE = os.path.join(RESULTS_DIR, 'trades.txt')
+PRICES_FILE = os.path.join(RESULTS_DIR, 'prices.txt')
+
+
+TICKERS = ['AAPL', 'MSFT', 'GOOG', 'FB', 'AMZN', 'SNAP']
+
+
+def write_orders(orders, path=ORDERS_FILE):
+    """Write the "<user>: <action>" lines of the orders that were placed."""
+    with open(path, 'w') as f:
+        f.write("\n".join(orders))
+
+
+def write_trades(exchange, path=TRADES_FILE, tickers=TICKERS):
+    """Write the trades of every stock, streaming them from the trade tapes."""
+    with open(path, 'w') as f:
+        for ticker in tickers:
+            f.write(ticker + '\n')
+            for trade in exchange.trades[ticker]:
+                f.write(str(trade) + '\n')
+
+
+def write_prices(exchange, path=PRICES_FILE, tickers=TICKERS):
+    """Write the bid, ask and last price of every stock."""
+    with open(path, 'w') as f:
+        for ticker in tickers:
+            bid, ask = exchange.get_bid_ask(ticker)
+            bid_price = bid.price if bid else 0
+            ask_price = ask.price if ask else 0
+            last_price = exchange.get_last_price(ticker)
+            f.write(
+                f"{ticker} BID: ${bid_price:.2f} ASK: ${ask_price:.2f} LAST: ${last_price:.2f}\n")
@@ -0,0 +1,380 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+@author: Desmond Tan
+
+Sharded exchange: the order books are split by ticker across worker processes.
+
+The router, in the main process, parses every command, verifies it against
+the user's account, reserves what the order needs and forwards it to the
+shard that owns the ticker. Each
+shard matches the orders of its tickers on its own Exchange, with a stand-in
+admin per user, and reports the fills back. The router is also the central
+account service: it settles every fill on the real orders and users, so cash
+and holdings live in one place.
+
+Messages from the router to a shard, sent in batches:
+  ('O', order_id, user, command, collar)      place a limit, market or stop order
+  ('C', order_id, user)                       cancel an order
+  ('A', order_id, user, quantity, price, new_id)  amend an order
+  ('Q', ticker)                               quote a stock
+Events from a shard to the router, one list per batch:
+  ('F', buy_id, sell_id, ticker, ticks, quantity)  a fill
+  ('X', order_id)                             an order has been cancelled
+  ('A', order_id, quantity)                   an order has been amended in place
+  ('R', order_id, new_id, quantity, price)    an order has been replaced by a new order
+  ('Q', ticker, bid_price, ask_price, last_price)  a quote
+  ('S', message)                              any other message for the user
+"""
+import multiprocessing
+import zlib
+
+from commands import *
+from events import ConsoleSink, EventSink
+from exchange import Exchange, collar_ticks
+from orders import LimitOrder
+from positions import leaderboard
+from tape import Trade
+from user import Admin
+
+
+class ShardSink(EventSink):
+    """Collects the events of a shard to be sent to the router."""
+
+    def __init__(self):
+        self.events = []
+
+    def quote(self, ticker, bid_price, ask_price, last_price):
+        self.events.append(('Q', ticker, bid_price, ask_price, last_price))
+
+    def status(self, message):
+        self.events.append(('S', message))
+
+
+class ShardExchange(Exchange):
+    """The exchange of a shard, which keeps the order ids given by the router
+    and reports fills, cancels and amendments."""
+
+    def __init__(self, stocks):
+        super().__init__(sink=ShardSink())
+        for stock in stocks:
+            self.list_stock(stock)
+        self.users = {}
+        # (order id, new order id) of the order being amended, given by the router
+        self.replacing = None
+
+    def user(self, name):
+        user = self.users.get(name)
+        if user is None:
+            user = self.users[name] = Admin(name, self)
+        return user
+
+    def accept_order(self, order):
+        if self.replacing is not None:
+            # Reported before the replacement is matched, so that its fills can be settled
+            order_id, order.id = self.replacing
+            self.replacing = None
+            self.sink.events.append(('R', order_id, order.id, order.quantity, getattr(order, 'price', None)))
+        return super().accept_order(order)
+
+    def record_trade(self, book, buy_order, sell_order, price, ticks, quantity):
+        super().record_trade(book, buy_order, sell_order, price, ticks, quantity)
+        self.sink.events.append(('F', buy_order.id, sell_order.id, book.ticker, ticks, quantity))
+
+    def cancel_order(self, user, order_id):
+        order = super().cancel_order(user, order_id)
+        if order is not None:
+            self.sink.events.append(('X', order_id))
+        return order
+
+    def drop_order(self, order):
+        super().drop_order(order)
+        self.sink.events.append(('X', order.id))
+
+    def amend_order(self, user, order_id, quantity, price=None):
+        new_order = super().amend_order(user, order_id, quantity, price)
+        if new_order is not None and new_order.id == order_id:
+            self.sink.events.append(('A', order_id, quantity))
+        return new_order
+
+    def process(self, messages):
+        """Process a batch of messages from the router, returns the events."""
+        if self.timers.count:
+            self.expire_orders()
+        for message in messages:
+            kind = message[0]
+            if kind == 'O':
+                _, order_id, name, command, collar = message
+                order = self.make_order(self.user(name), command)
+                order.id = order_id
+                if collar is not None:
+                    order.collar = collar
+                self.accept_order(order)
+                self.resolve_order(order)
+            elif kind == 'C':
+                self.cancel_order(self.user(message[2]), message[1])
+            elif kind == 'A':
+                _, order_id, name, quantity, price, new_id = message
+                self.replacing = (order_id, new_id)
+                self.amend_order(self.user(name), order_id, quantity, price)
+                self.replacing = None
+            elif kind == 'Q':
+                self.execute_command(None, QuoteCommand(message[1]))
+        events = self.sink.events
+        self.sink.events = []
+        return events
+
+
+def run_shard(index, stocks, inbox, outbox):
+    """Main loop of a shard process."""
+    exchange = ShardExchange(stocks)
+    while True:
+        messages = inbox.get()
+        if messages is None:
+            break
+        outbox.put((index, exchange.process(messages)))
+
+
+def shard_of(ticker, shards):
+    """Assign a ticker to a shard, the same way in every process."""
+    return zlib.crc32(ticker.encode()) % shards
+
+
+class ShardedExchange:
+    """Exchange that matches each ticker on one of several shard processes.
+
+    Commands are sent to the shards in batches of batch_size messages, with at
+    most max_pending batches in flight per shard, after which the router waits
+    for the shards to catch up. Fills are settled as the shards report them,
+    sync() waits until everything sent so far has been settled.
+    """
+
+    def __init__(self, stocks, shards=None, sink=None, batch_size=256, max_pending=8, market_collar=0.1):
+        self.sink = sink if sink is not None else ConsoleSink()
+        self.stocks = {stock.ticker: stock for stock in stocks}
+        self.shards = shards if shards is not None else multiprocessing.cpu_count()
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self.market_collar = market_collar
+        # Open orders by order id, settled by the router as the shards report fills
+        self.orders = {}
+        self.next_id = 1
+        self.last_ticks = {}
+        # Users that have placed orders, in the order they first did
+        self.users = {}
+        self.batches = [[] for _ in range(self.shards)]
+        self.pending = [0] * self.shards
+        self.routes = {ticker: shard_of(ticker, self.shards) for ticker in self.stocks}
+
+        self.outbox = multiprocessing.Queue()
+        self.inboxes = []
+        self.processes = []
+        for index in range(self.shards):
+            inbox = multiprocessing.Queue()
+            owned = [stock for stock in stocks if self.routes[stock.ticker] == index]
+            process = multiprocessing.Process(target=run_shard, args=(index, owned, inbox, self.outbox),
+                                              daemon=True)
+            process.start()
+            self.inboxes.append(inbox)
+            self.processes.append(process)
+
+    def get_last_price(self, ticker):
+        """Get the last settled price of a stock."""
+        ticks = self.last_ticks.get(ticker)
+        return self.stocks[ticker].to_price(ticks) if ticks is not None else 0
+
+    def get_mark(self, ticker):
+        """Get the price per share positions in a stock are valued at, in cash
+        units: the last settled price, else 0, as the books are in the shards."""
+        ticks = self.last_ticks.get(ticker)
+        return ticks * self.stocks[ticker].tick_units if ticks is not None else 0
+
+    def get_leaderboard(self, n=None):
+        """Get the users with the highest net worth, see User.get_net_worth."""
+        return leaderboard(self.users, n)
+
+    def get_collar(self, ticker, direction, stop_price=None):
+        """Get the collar of a market order, see Exchange.get_collar. The books
+        are in the shards, so only the last settled price is a reference, or
+        the stop price of a stop order."""
+        if stop_price is not None:
+            return collar_ticks(self.stocks[ticker].to_ticks(stop_price), direction, self.market_collar)
+        reference = self.last_ticks.get(ticker)
+        if reference is None:
+            return None
+        return collar_ticks(reference, direction, self.market_collar)
+
+    def send(self, shard, message):
+        batch = self.batches[shard]
+        batch.append(message)
+        if len(batch) >= self.batch_size:
+            self.flush_shard(shard)
+
+    def flush_shard(self, shard):
+        batch = self.batches[shard]
+        if not batch:
+            return
+        while self.pending[shard] >= self.max_pending:
+            self.receive()
+        self.inboxes[shard].put(batch)
+        self.batches[shard] = []
+        self.pending[shard] += 1
+
+    def flush(self):
+        """Send every buffered message to its shard."""
+        for shard in range(self.shards):
+            self.flush_shard(shard)
+
+    def sync(self):
+        """Wait until the shards have processed everything sent so far and
+        their fills have been settled."""
+        self.flush()
+        while any(self.pending):
+            self.receive()
+
+    def receive(self):
+        """Wait for a batch of events from any shard and settle it."""
+        shard, events = self.outbox.get()
+        self.pending[shard] -= 1
+        self.settle(events)
+
+    def settle(self, events):
+        """Apply the events of a shard to the orders and accounts."""
+        orders = self.orders
+        sink = self.sink
+        for event in events:
+            kind = event[0]
+            if kind == 'F':
+                _, buy_id, sell_id, ticker, ticks, quantity = event
+                stock = self.stocks[ticker]
+                price = stock.to_price(ticks)
+                units = ticks * stock.tick_units
+                buy_order = orders[buy_id]
+                sell_order = orders[sell_id]
+                # The resting order, which arrived first, is filled first like in MatchingEngine
+                if buy_id < sell_id:
+                    buy_order.fill(quantity, price, units)
+                    sell_order.fill(quantity, price, units)
+                else:
+                    sell_order.fill(quantity, price, units)
+                    buy_order.fill(quantity, price, units)
+                self.last_ticks[ticker] = ticks
+                sink.trade(Trade(buy_order.user, sell_order.user, price, quantity, ticks))
+                if buy_order.is_filled():
+                    del orders[buy_id]
+                if sell_order.is_filled():
+                    del orders[sell_id]
+            elif kind == 'X':
+                order = orders.pop(event[1])
+                order.cancelled = True
+                order.user.release(order, order.quantity - order.filled)
+            elif kind == 'A':
+                order = orders[event[1]]
+                order.user.release(order, order.quantity - event[2])
+                order.quantity = event[2]
+            elif kind == 'R':
+                _, order_id, new_id, quantity, price = event
+                order = orders.pop(order_id)
+                order.cancelled = True
+                order.user.release(order, order.quantity - order.filled)
+                new_order = order.amended(quantity, price)
+                new_order.tif = order.tif
+                new_order.expires = order.expires
+                new_order.id = new_id
+                orders[new_id] = new_order
+                new_order.user.reserve(new_order)
+                new_order.user.place_order(new_order)
+            elif kind == 'Q':
+                sink.quote(*event[1:])
+            else:
+                sink.status(event[1])
+
+    def place_order(self, user, command):
+        stock = self.stocks.get(command.ticker)
+        kind = type(command)
+        if stock is None or (kind is LimitCommand and not stock.is_valid_price(command.price)) or \
+                kind is StopCommand and (not stock.is_valid_price(command.stop_price) or
+                                         command.price is not None and not stock.is_valid_price(command.price)):
+            self.sink.status(f"Invalid price for {command.ticker}.")
+            return None
+        order = Exchange.make_order(self, user, command)
+        if not user.verify_order(order):
+            return None
+        order.ticker = stock.ticker
+        self.users.setdefault(user, True)
+        order.id = self.next_id
+        self.next_id += 1
+        self.orders[order.id] = order
+        user.reserve(order)
+        user.place_order(order)
+        self.sink.order_accepted(order)
+        self.send(self.routes[stock.ticker], ('O', order.id, user.name, command, getattr(order, 'collar', None)))
+        return order
+
+    def find_order(self, user, order_id):
+        order = self.orders.get(order_id)
+        if order is None or order.user is not user:
+            self.sink.status(f"Order {order_id} is not an open order.")
+            return None
+        return order
+
+    def execute(self, user, action):
+        """Execute an action, see Exchange.execute.
+
+        Order commands are answered by the shards asynchronously."""
+        self.execute_command(user, parse(action))
+
+    def execute_command(self, user, command):
+        kind = type(command)
+        if kind is LimitCommand or kind is MarketCommand or kind is StopCommand:
+            self.place_order(user, command)
+
+        elif kind is CancelCommand:
+            order = self.find_order(user, command.order_id)
+            if order is not None:
+                self.send(self.routes[order.ticker], ('C', order.id, user.name))
+
+        elif kind is AmendCommand:
+            order = self.find_order(user, command.order_id)
+            if order is None:
+                return
+            new_id = None
+            if command.price is not None and isinstance(order, LimitOrder) or command.quantity > order.quantity:
+                # The order may be replaced, check that the user can afford the replacement
+                # with what the order has reserved
+                remaining = order.quantity - order.filled
+                user.release(order, remaining)
+                verified = user.verify_order(order.amended(command.quantity - order.filled, command.price))
+                user.hold(order, remaining)
+                if not verified:
+                    return
+                new_id = self.next_id
+                self.next_id += 1
+            self.send(self.routes[order.ticker],
+                      ('A', order.id, user.name, command.quantity, command.price, new_id))
+
+        elif kind is QuoteCommand:
+            if command.ticker in self.routes:
+                self.send(self.routes[command.ticker], ('Q', command.ticker))
+            else:
+                self.sink.status(f"Invalid ticker {command.ticker}.")
+
+        elif kind is ViewOrdersCommand:
+            user.view_orders()
+
+        elif kind is ViewPortfolioCommand:
+            user.view_portfolio()
+
+        elif kind is HelpCommand:
+            self.sink.status(Exchange.get_help(self))
+
+        else:
+            self.sink.status('Invalid command. Type HELP for a list of commands.')
+
+    def close(self):
+        """Settle everything and stop the shard processes."""
+        self.sync()
+        for inbox in self.inboxes:
+            inbox.put(None)
+        for process in self.processes:
+            process.join()
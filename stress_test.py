@@ -4,22 +4,49 @@
 """
 @author: Desmond Tan
 """
+import argparse
+import json
 import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import namedtuple
 from faker import Faker
 import os
 
 from orders import *
 from exchange import *
 from user import *
+from events import NullSink
+from journal import Journal, recover, save_snapshot
+from reports import *
+from metrics import LatencyHistogram
+from sharding import ShardedExchange
+from profiling import profile
+from auction import auction_price
 
 
-RESULTS_DIR = 'results'
-ORDERS_FILE = os.path.join(RESULTS_DIR, 'orders.txt')
-TRADES_FILE = os.path.join(RESULTS_DIR, 'trades.txt')
-PRICES_FILE = os.path.join(RESULTS_DIR, 'prices.txt')
+# A benchmark scenario:
+#   actions        number of measured actions, after warmup actions that are timed separately
+#   book_size      resting limit orders placed on the books before the run
+#   market_ratio   share of the orders that are market orders
+#   cancel_ratio   share of the actions that cancel an earlier order
+#   tickers        number of stocks listed
+#   prices         'uniform' prices from $1 to $100, or 'normal' prices clustered around $50
+#   users          number of users placing the orders
+Scenario = namedtuple('Scenario', 'name actions warmup book_size market_ratio cancel_ratio tickers prices users',
+                      defaults=(10000, 1000, 0, 0.1, 0.0, len(TICKERS), 'uniform', 100))
 
-
-TICKERS = ['AAPL', 'MSFT', 'GOOG', 'FB', 'AMZN', 'SNAP']
+SCENARIOS = {scenario.name: scenario for scenario in (
+    Scenario('baseline'),
+    Scenario('deep_book', book_size=100000),
+    Scenario('market_heavy', market_ratio=0.5),
+    Scenario('cancel_heavy', cancel_ratio=0.3),
+    Scenario('many_tickers', tickers=500),
+    Scenario('narrow_prices', prices='normal'),
+    Scenario('many_users', users=10000),
+)}
 
 
 def init_stocks(exchange, tickers=TICKERS):
@@ -27,56 +54,393 @@ def init_stocks(exchange, tickers=TICKERS):
         exchange.list_stock(Stock(ticker))
 
 
-def main():
+def scenario_tickers(scenario):
+    if scenario.tickers <= len(TICKERS):
+        return TICKERS[:scenario.tickers]
+    return TICKERS + [f"T{i}" for i in range(scenario.tickers - len(TICKERS))]
+
+
+def random_price(rng, prices):
+    if prices == 'normal':
+        return max(0.01, round(rng.gauss(50, 2), 2))
+    return rng.randint(1, 100)
+
+
+def generate_actions(scenario, rng, users, tickers, n, owners):
+    """Generate n (user, action) pairs for the scenario.
+
+    owners lists the user of every order placed so far, in order id order, so
+    that cancels can pick an earlier order and the user it belongs to."""
+    actions = []
+    for _ in range(n):
+        if owners and rng.random() < scenario.cancel_ratio:
+            order_id = rng.randint(1, len(owners))
+            actions.append((owners[order_id - 1], f"CANCEL {order_id}"))
+            continue
+        user = rng.choice(users)
+        direction = rng.choice(('BUY', 'SELL'))
+        ticker = rng.choice(tickers)
+        quantity = rng.randint(1, 100)
+        if rng.random() < scenario.market_ratio:
+            action = f"{direction} {ticker} MKT {quantity}"
+        else:
+            action = f"{direction} {ticker} LMT ${random_price(rng, scenario.prices)} {quantity}"
+        owners.append(user)
+        actions.append((user, action))
+    return actions
+
+
+def seed_books(exchange, scenario, rng, tickers, owners):
+    """Rest book_size limit orders on the books, bids below $50 and asks above."""
+    maker = Admin('maker', exchange)
+    for i in range(scenario.book_size):
+        ticker = tickers[i % len(tickers)]
+        if i % 2:
+            order = SellOrder(maker, ticker, round(rng.uniform(50.01, 100), 2), rng.randint(1, 100))
+        else:
+            order = BuyOrder(maker, ticker, round(rng.uniform(1, 49.99), 2), rng.randint(1, 100))
+        exchange.resolve_order(order)
+        owners.append(maker)
+
+
+def run_actions(exchange, actions, histogram=None):
+    """Execute the actions, returns the time taken in seconds."""
+    clock = time.perf_counter_ns
+    start = clock()
+    if histogram is None:
+        for user, action in actions:
+            exchange.execute(user, action)
+    else:
+        for user, action in actions:
+            before = clock()
+            exchange.execute(user, action)
+            histogram.record(clock() - before)
+    return (clock() - start) / 1e9
+
+
+def run_scenario(scenario, seed=0):
+    """Run a scenario and get its results as a dict.
+
+    Every action is generated from the seeded RNG before it is timed, so a run
+    only measures the exchange and is the same every time for the same seed."""
+    rng = random.Random(seed)
+    exchange = Exchange(sink=NullSink())
+    tickers = scenario_tickers(scenario)
+    init_stocks(exchange, tickers)
+    users = [Admin(f"user{i}", exchange) for i in range(scenario.users)]
+    owners = []
+
+    start = time.perf_counter()
+    seed_books(exchange, scenario, rng, tickers, owners)
+    setup_seconds = time.perf_counter() - start
+    warmup = generate_actions(scenario, rng, users, tickers, scenario.warmup, owners)
+    actions = generate_actions(scenario, rng, users, tickers, scenario.actions, owners)
+
+    warmup_seconds = run_actions(exchange, warmup)
+    histogram = LatencyHistogram()
+    seconds = run_actions(exchange, actions, histogram)
+    return {
+        'scenario': scenario._asdict(),
+        'seed': seed,
+        'setup_seconds': setup_seconds,
+        'warmup_seconds': warmup_seconds,
+        'seconds': seconds,
+        'actions_per_second': scenario.actions / seconds if seconds else 0,
+        'latency_us': {
+            'p50': histogram.percentile(50) / 1000,
+            'p99': histogram.percentile(99) / 1000,
+            'p99.9': histogram.percentile(99.9) / 1000,
+            'max': (histogram.max or 0) / 1000,
+            'mean': histogram.mean() / 1000,
+        },
+        'trades': sum(len(tape) for tape in exchange.trades.values()),
+        'resting_orders': len(exchange.orders),
+    }
+
+
+def run_suite(names, seed=0, actions=None):
+    """Run the named scenarios, optionally overriding their number of actions."""
+    results = []
+    for name in names:
+        scenario = SCENARIOS[name]
+        if actions is not None:
+            scenario = scenario._replace(actions=actions)
+        result = run_scenario(scenario, seed)
+        latency = result['latency_us']
+        print(f"{name}: {result['actions_per_second']:.0f} actions/s, p50 {latency['p50']:.1f}us "
+              f"p99 {latency['p99']:.1f}us p99.9 {latency['p99.9']:.1f}us "
+              f"(warmup {result['warmup_seconds']:.3f}s)", file=sys.stderr)
+        results.append(result)
+    return results
+
+
+def write_results(seed=0):
+    """Run 10,000 random actions over 100 users and write the orders, trades and
+    prices to results/, the golden run that replay.py checks against."""
+    rng = random.Random(seed)
     fake = Faker()
+    fake.seed_instance(seed)
 
-    exchange = Exchange()
+    exchange = Exchange(sink=NullSink())
     init_stocks(exchange)
     users = [Admin(fake.name(), exchange) for _ in range(100)]
     options = ['BUY', 'SELL', 'QUOTE', 'VIEW ORDERS']
 
     orders = []
     for _ in range(10000):
-        user = random.choice(users)
-        option = random.choice(options)
+        user = rng.choice(users)
+        option = rng.choice(options)
         if option == 'BUY' or option == 'SELL':
-            ticker = random.choice(TICKERS)
-            order_type = random.choices(['LMT', 'MKT'], weights=[0.9, 0.1], k=1)[0]
-            quantity = random.randint(1, 100)
+            ticker = rng.choice(TICKERS)
+            order_type = rng.choices(['LMT', 'MKT'], weights=[0.9, 0.1], k=1)[0]
+            quantity = rng.randint(1, 100)
             if order_type == 'LMT':
-                price = random.randint(1, 100)
+                price = rng.randint(1, 100)
                 action = f"{option} {ticker} {order_type} ${price} {quantity}"
             else:
                 action = f"{option} {ticker} {order_type} {quantity}"
             orders.append(str(user) + ': ' + action)
         elif option == 'QUOTE':
-            action = option + ' ' + random.choice(TICKERS)
+            action = option + ' ' + rng.choice(TICKERS)
         else:
             action = option
-        print(action)
         exchange.execute(user, action)
-    
+
     if not os.path.exists(RESULTS_DIR):
         os.makedirs(RESULTS_DIR)
-    
-    with open(ORDERS_FILE, 'w') as f:
-        f.write("\n".join(orders))
-
-    with open(TRADES_FILE, 'w') as f:
-        for ticker in TICKERS:
-            f.write(ticker + '\n')
-            for trade in exchange.trades[ticker]:
-                f.write(str(trade) + '\n')
-    
-    with open(PRICES_FILE, 'w') as f:
-        for ticker in TICKERS:
-            bid, ask = exchange.get_bid_ask(ticker)
-            bid_price = bid.price if bid else 0
-            ask_price = ask.price if ask else 0
-            last_price = exchange.get_last_price(ticker)
-            f.write(
-                f"{ticker} BID: ${bid_price:.2f} ASK: ${ask_price:.2f} LAST: ${last_price:.2f}\n")
+
+    write_orders(orders)
+    write_trades(exchange)
+    write_prices(exchange)
+
+
+def benchmark_market_backlog(sizes=(12500, 25000, 50000)):
+    """Time a single large limit order clearing a backlog of queued market orders."""
+    for size in sizes:
+        exchange = Exchange(sink=NullSink())
+        init_stocks(exchange, ['AAPL'])
+        user = Admin('benchmark', exchange)
+        for _ in range(size):
+            exchange.resolve_order(MarketOrder(user, 'AAPL', 1, 'BUY'))
+
+        start = time.perf_counter()
+        exchange.resolve_order(SellOrder(user, 'AAPL', 10, size))
+        elapsed = time.perf_counter() - start
+        print(f"Cleared {size} queued market orders in {elapsed:.3f}s "
+              f"({elapsed / size * 1e6:.2f}us per order)")
+
+
+class DictRecord:
+    """A plain dict-backed record, the layout orders and trades used to have."""
+
+    def __init__(self, **fields):
+        self.__dict__.update(fields)
+
+
+def bytes_per_object(factory, n):
+    """Measure the average memory allocated for each of n objects."""
+    tracemalloc.start()
+    start, _ = tracemalloc.get_traced_memory()
+    objects = [factory(i) for i in range(n)]
+    end, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    # The list holding the objects is not part of the cost of an object
+    return (end - start) / n - 8
+
+
+def benchmark_memory(n=100000):
+    """Compare the memory per order and per trade of the slotted records with
+    the dict-backed records they replace."""
+    exchange = Exchange(sink=NullSink())
+    user = Admin('benchmark', exchange)
+    ticker = 'AAPL'
+
+    def dict_order(i):
+        # Every parsed action used to carry its own copy of the ticker
+        return DictRecord(user=user, ticker=''.join(('AA', 'PL')), quantity=100, direction='BUY', filled=0,
+                          sequence=i, id=i, cancelled=False, price=10.5, ticks=1050)
+
+    def slotted_order(i):
+        order = BuyOrder(user, ticker, 10.5, 100)
+        order.sequence = order.id = i
+        order.ticks = 1050
+        return order
+
+    def dict_trade(i):
+        return DictRecord(buyer=user, seller=user, price=10.5, quantity=100, ticks=1050)
+
+    def slotted_trade(i):
+        return Trade(user, user, 10.5, 100, 1050)
+
+    for name, before, after in (('order', dict_order, slotted_order), ('trade', dict_trade, slotted_trade)):
+        before = bytes_per_object(before, n)
+        after = bytes_per_object(after, n)
+        print(f"Bytes per {name}: {before:.0f} dict-backed, {after:.0f} slotted")
+
+    tape = TradeTape(Stock('AAPL'), exchange.user_ids)
+    tracemalloc.start()
+    start, _ = tracemalloc.get_traced_memory()
+    for i in range(n):
+        tape.append(i, 1050, 100, 0, 0)
+    end, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"Bytes per trade on the trade tape: {(end - start) / n:.0f}")
+
+
+def benchmark_auction(n=1000000):
+    """Time uncrossing a call auction of n resting orders, whose bids and asks
+    overlap around $50, first finding the price and then the whole uncross."""
+    exchange = Exchange(sink=NullSink())
+    exchange.list_stock(Stock('AAPL', auction=True))
+    user = Admin('benchmark', exchange)
+    rng = random.Random(0)
+    start = time.perf_counter()
+    for i in range(n):
+        if i % 2:
+            order = BuyOrder(user, 'AAPL', rng.randint(4000, 5100) / 100, rng.randint(1, 100))
+        else:
+            order = SellOrder(user, 'AAPL', rng.randint(4900, 6000) / 100, rng.randint(1, 100))
+        exchange.resolve_order(order)
+    elapsed = time.perf_counter() - start
+    print(f"Collected {n} orders in auction in {elapsed:.3f}s")
+
+    start = time.perf_counter()
+    auction_price(exchange.books['AAPL'])
+    elapsed = time.perf_counter() - start
+    print(f"Found the uncrossing price of {n} orders in {elapsed:.3f}s")
+
+    start = time.perf_counter()
+    price, volume = exchange.uncross('AAPL')
+    elapsed = time.perf_counter() - start
+    print(f"Uncrossed {n} orders in {elapsed:.3f}s, {volume} shares at ${price:.2f} "
+          f"in {len(exchange.trades['AAPL'])} fills")
+
+
+def benchmark_journal(n=1000000, tail=100000):
+    """Time journaling n orders with a snapshot taken before the last tail of
+    them, then recovering the exchange from the journal alone and from the
+    snapshot and the tail of the journal."""
+    with tempfile.TemporaryDirectory() as directory:
+        journal_path = os.path.join(directory, 'journal.log')
+        snapshot_path = os.path.join(directory, 'snapshot.pickle')
+        exchange = Exchange(sink=NullSink(), journal=Journal(journal_path))
+        init_stocks(exchange, ['AAPL'])
+        users = [Admin(f'user{i}', exchange) for i in range(100)]
+        rng = random.Random(0)
+        actions = [(rng.choice(users), f"{rng.choice(('BUY', 'SELL'))} AAPL LMT ${rng.randint(900, 1100) / 100} "
+                                        f"{rng.randint(1, 100)}") for _ in range(n)]
+
+        start = time.perf_counter()
+        for user, action in actions[:n - tail]:
+            exchange.execute(user, action)
+        elapsed = time.perf_counter() - start
+        start = time.perf_counter()
+        save_snapshot(exchange, snapshot_path)
+        snapshot_elapsed = time.perf_counter() - start
+        start = time.perf_counter()
+        for user, action in actions[n - tail:]:
+            exchange.execute(user, action)
+        exchange.journal.close()
+        elapsed += time.perf_counter() - start
+        print(f"Executed and journaled {n} orders in {elapsed:.3f}s ({n / elapsed:.0f} orders/s), "
+              f"with a snapshot after {n - tail} of them in {snapshot_elapsed:.3f}s "
+              f"({os.path.getsize(snapshot_path) / 2 ** 20:.1f}MiB)")
+
+        replayed = Exchange(sink=NullSink())
+        init_stocks(replayed, ['AAPL'])
+        start = time.perf_counter()
+        replayed = recover(journal_path, exchange=replayed, users=[Admin(user.name, replayed) for user in users])
+        elapsed = time.perf_counter() - start
+        replayed.journal.close()
+        print(f"Recovered {n} orders from the journal in {elapsed:.3f}s ({n / elapsed:.0f} orders/s)")
+
+        start = time.perf_counter()
+        recovered = recover(journal_path, snapshot_path, users=users)
+        elapsed = time.perf_counter() - start
+        recovered.journal.close()
+        print(f"Recovered {n} orders from the snapshot and a tail of {tail} in {elapsed:.3f}s "
+              f"({n / elapsed:.0f} orders/s)")
+        if len(recovered.orders) != len(replayed.orders) or len(recovered.trades['AAPL']) != len(replayed.trades['AAPL']):
+            raise Exception('The recovered exchanges differ')
+
+
+def benchmark_sharding(n=200000, shards=(1, 2, 4), tickers=TICKERS):
+    """Time n limit orders spread over the tickers on a single exchange, then
+    on a sharded exchange with each number of shards."""
+    rng = random.Random(0)
+    actions = [(rng.randrange(100), f"{rng.choice(('BUY', 'SELL'))} {rng.choice(tickers)} LMT "
+                                    f"${rng.randint(90, 110)} {rng.randint(1, 100)}") for _ in range(n)]
+
+    exchange = Exchange(sink=NullSink())
+    init_stocks(exchange, tickers)
+    users = [Admin(f"user{i}", exchange) for i in range(100)]
+    start = time.perf_counter()
+    for index, action in actions:
+        exchange.execute(users[index], action)
+    elapsed = time.perf_counter() - start
+    print(f"Single exchange: {n / elapsed:.0f} orders/s")
+
+    for count in shards:
+        exchange = ShardedExchange([Stock(ticker) for ticker in tickers], shards=count, sink=NullSink())
+        users = [Admin(f"user{i}", exchange) for i in range(100)]
+        start = time.perf_counter()
+        for index, action in actions:
+            exchange.execute(users[index], action)
+        exchange.sync()
+        elapsed = time.perf_counter() - start
+        exchange.close()
+        print(f"Sharded exchange with {count} shards: {n / elapsed:.0f} orders/s")
+
+
+def run(args):
+    """Run the benchmark chosen by the command line arguments."""
+    if args.backlog:
+        benchmark_market_backlog()
+    elif args.memory:
+        benchmark_memory()
+    elif args.auction:
+        benchmark_auction(args.auction)
+    elif args.journal:
+        benchmark_journal(args.journal)
+    elif args.sharding:
+        benchmark_sharding(args.sharding)
+    elif args.results:
+        write_results(args.seed)
+    else:
+        results = run_suite(args.scenario or list(SCENARIOS), args.seed, args.actions)
+        if args.json is not None:
+            with open(args.json, 'w') as f:
+                json.dump(results, f, indent=2)
+        else:
+            json.dump(results, sys.stdout, indent=2)
+            print()
 
 
 if __name__ == '__main__':
-    main()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sharding', type=int, nargs='?', const=200000, metavar='N',
+                        help='benchmark N orders on a single exchange against a sharded exchange')
+    parser.add_argument('--scenario', action='append', choices=sorted(SCENARIOS),
+                        help='scenario to run, can be repeated (default: all of them)')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the RNG (default: %(default)s)')
+    parser.add_argument('--actions', type=int, default=None, metavar='N',
+                        help='number of measured actions per scenario')
+    parser.add_argument('--json', default=None, metavar='PATH',
+                        help='write the results as JSON to PATH instead of stdout')
+    parser.add_argument('--results', action='store_true',
+                        help='write a seeded run to results/ as the golden run for replay.py')
+    parser.add_argument('--backlog', action='store_true',
+                        help='benchmark clearing a backlog of queued market orders')
+    parser.add_argument('--memory', action='store_true',
+                        help='benchmark the memory used per order and per trade')
+    parser.add_argument('--auction', type=int, nargs='?', const=1000000, metavar='N',
+                        help='benchmark uncrossing a call auction of N orders')
+    parser.add_argument('--journal', type=int, nargs='?', const=1000000, metavar='N',
+                        help='benchmark journaling N orders and recovering them with and without a snapshot')
+    parser.add_argument('--profile', nargs='?', const='profile', default=None, metavar='PREFIX',
+                        help='profile the run and write PREFIX.prof, PREFIX.txt and PREFIX.folded, see profiling.py')
+    args = parser.parse_args()
+    if args.profile is not None:
+        profile(lambda: run(args), args.profile)
+    else:
+        run(args)
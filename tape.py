@@ -0,0 +1,199 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+@author: Desmond Tan
+"""
+import mmap
+import os
+from array import array
+
+
+# Name and array typecode of every column of the tape
+COLUMNS = (
+    ('timestamp', 'q'),
+    ('ticks', 'q'),
+    ('quantity', 'q'),
+    ('buyer', 'i'),
+    ('seller', 'i'),
+)
+
+
+class Trade:
+    __slots__ = ('buyer', 'seller', 'price', 'quantity', 'ticks', 'timestamp')
+
+    def __init__(self, buyer, seller, price, quantity, ticks=None, timestamp=None):
+        self.buyer = buyer
+        self.seller = seller
+        self.price = price
+        self.quantity = quantity
+        self.ticks = ticks
+        self.timestamp = timestamp
+
+    def __str__(self):
+        return f"{self.buyer} bought {self.quantity} shares from {self.seller} at ${self.price:.2f} each."
+
+
+class TradeTape:
+    """Append-only tape of the trades of a single stock, stored column by column.
+
+    Each column is a typed array holding a timestamp in nanoseconds, the price
+    in ticks, the quantity and the interned ids of the buyer and the seller.
+    If the tape has a directory, the rows are flushed every flush_size trades
+    to one binary file per column, and the flushed rows are read back from
+    memory maps of those files. A new tape picks up the files it finds, so
+    history can be reopened without parsing anything.
+    """
+
+    def __init__(self, stock, users, directory=None, flush_size=65536):
+        self.stock = stock
+        self.users = users
+        self.directory = directory
+        self.flush_size = flush_size
+        # Rows that have not been flushed yet
+        self.timestamp = array('q')
+        self.ticks = array('q')
+        self.quantity = array('q')
+        self.buyer = array('i')
+        self.seller = array('i')
+        # Rows that have been flushed, as memory-mapped columns
+        self.maps = {}
+        self.mapped = {}
+        self.flushed = 0
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+            self.map_files()
+
+    def path(self, column):
+        return os.path.join(self.directory, f"{self.stock.ticker}.{column}.bin")
+
+    def map_files(self):
+        """Map the column files into memory."""
+        self.unmap_files()
+        for name, typecode in COLUMNS:
+            path = self.path(name)
+            if not os.path.exists(path) or not os.path.getsize(path):
+                continue
+            with open(path, 'rb') as f:
+                self.maps[name] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self.mapped[name] = memoryview(self.maps[name]).cast(typecode)
+        self.flushed = len(self.mapped['ticks']) if self.mapped else 0
+
+    def unmap_files(self):
+        for view in self.mapped.values():
+            view.release()
+        for file_map in self.maps.values():
+            file_map.close()
+        self.maps = {}
+        self.mapped = {}
+        self.flushed = 0
+
+    def append(self, timestamp, ticks, quantity, buyer, seller):
+        """Append a trade, given the ids of the buyer and the seller."""
+        self.timestamp.append(timestamp)
+        self.ticks.append(ticks)
+        self.quantity.append(quantity)
+        self.buyer.append(buyer)
+        self.seller.append(seller)
+        if self.directory is not None and len(self.ticks) >= self.flush_size:
+            self.flush()
+
+    def extend(self, timestamp, ticks, quantities, buyers, sellers):
+        """Append trades made at one time and price, given lists of their
+        quantities and of the ids of their buyers and sellers."""
+        count = len(quantities)
+        self.timestamp.extend(array('q', (timestamp,)) * count)
+        self.ticks.extend(array('q', (ticks,)) * count)
+        self.quantity.fromlist(quantities)
+        self.buyer.fromlist(buyers)
+        self.seller.fromlist(sellers)
+        if self.directory is not None and len(self.ticks) >= self.flush_size:
+            self.flush()
+
+    def flush(self):
+        """Append the unflushed rows to the column files."""
+        if self.directory is None or not self.ticks:
+            return
+        for name, _ in COLUMNS:
+            column = getattr(self, name)
+            with open(self.path(name), 'ab') as f:
+                column.tofile(f)
+            del column[:]
+        self.map_files()
+
+    def close(self):
+        self.flush()
+        self.unmap_files()
+
+    def truncate(self, rows=0):
+        """Drop every trade after the first rows, which must have been flushed,
+        from the column files as well as from memory."""
+        for name, _ in COLUMNS:
+            del getattr(self, name)[:]
+        if self.directory is None:
+            return
+        self.unmap_files()
+        for name, typecode in COLUMNS:
+            path = self.path(name)
+            if os.path.exists(path):
+                with open(path, 'ab') as f:
+                    f.truncate(rows * array(typecode).itemsize)
+        self.map_files()
+
+    def __getstate__(self):
+        """Get the state of the tape for a snapshot.
+
+        Flushed rows stay in their files and are not part of the state."""
+        self.flush()
+        state = self.__dict__.copy()
+        del state['maps'], state['mapped']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.maps = {}
+        self.mapped = {}
+        if self.directory is not None:
+            # Rows flushed after the snapshot was taken will be matched again
+            self.truncate(self.flushed)
+
+    def last_ticks(self):
+        """Get the price in ticks of the last trade in O(1), or None if there are no trades."""
+        if self.ticks:
+            return self.ticks[-1]
+        if self.flushed:
+            return self.mapped['ticks'][-1]
+        return None
+
+    def column(self, name):
+        """Get a whole column as an array."""
+        typecode = dict(COLUMNS)[name]
+        values = array(typecode, bytes(self.mapped[name])) if self.flushed else array(typecode)
+        values.extend(getattr(self, name))
+        return values
+
+    def row(self, index):
+        """Get a trade as a (timestamp, ticks, quantity, buyer id, seller id) tuple."""
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('Trade index out of range')
+        if index < self.flushed:
+            mapped = self.mapped
+            return (mapped['timestamp'][index], mapped['ticks'][index], mapped['quantity'][index],
+                    mapped['buyer'][index], mapped['seller'][index])
+        index -= self.flushed
+        return (self.timestamp[index], self.ticks[index], self.quantity[index],
+                self.buyer[index], self.seller[index])
+
+    def __len__(self):
+        return self.flushed + len(self.ticks)
+
+    def __getitem__(self, index):
+        """Get a trade as a Trade object."""
+        timestamp, ticks, quantity, buyer, seller = self.row(index)
+        return Trade(self.users.lookup(buyer), self.users.lookup(seller),
+                     self.stock.to_price(ticks), quantity, ticks, timestamp)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
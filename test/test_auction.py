@@ -0,0 +1,65 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+@author: Desmond Tan
+"""
+import unittest
+
+from auction import *
+from exchange import Exchange, Stock
+from orders import *
+from user import Admin
+
+
+class TestUncrossingPrice(unittest.TestCase):
+    def test_maximum_volume(self):
+        bids = {1010: 5, 1005: 10, 1000: 10}
+        asks = {995: 5, 1000: 5, 1005: 10, 1010: 20}
+        # 15 shares are bid at $10.05 or more and 20 offered at $10.05 or less
+        self.assertEqual(uncrossing_price(bids, asks), (1005, 15))
+
+    def test_smallest_surplus(self):
+        bids = {1010: 10}
+        asks = {990: 5, 1000: 5, 1010: 10}
+        # 10 shares execute at $10.00 and at $10.10, where 10 shares offered are left over
+        self.assertEqual(uncrossing_price(bids, asks), (1000, 10))
+
+    def test_market_pressure(self):
+        # Buyers are left over at both $10 and $11, so the higher price is taken
+        self.assertEqual(uncrossing_price({1100: 10}, {1000: 5}), (1100, 5))
+        self.assertEqual(uncrossing_price({1100: 5}, {1000: 10}), (1000, 5))
+
+    def test_reference_price(self):
+        bids = {1100: 5, 1000: 5}
+        asks = {1000: 5, 1100: 5}
+        self.assertEqual(uncrossing_price(bids, asks, reference=1090), (1100, 5))
+        self.assertEqual(uncrossing_price(bids, asks, reference=900), (1000, 5))
+        self.assertEqual(uncrossing_price(bids, asks), (1000, 5))
+
+    def test_market_orders(self):
+        self.assertEqual(uncrossing_price({}, {1000: 5, 1010: 5}, market_buys=8), (1010, 8))
+        # Market orders alone cross at the reference price, if there is one
+        self.assertEqual(uncrossing_price({}, {}, 10, 4, reference=1000), (1000, 4))
+        self.assertIsNone(uncrossing_price({}, {}, 10, 4))
+
+    def test_no_cross(self):
+        self.assertIsNone(uncrossing_price({990: 5}, {1000: 5}))
+        self.assertIsNone(uncrossing_price({}, {1000: 5}))
+
+    def test_auction_depth(self):
+        exchange = Exchange()
+        exchange.list_stock(Stock("AAPL", auction=True))
+        maker = Admin("Jane", exchange)
+        for order in (BuyOrder(maker, "AAPL", 10, 5), BuyOrder(maker, "AAPL", 10, 3), BuyOrder(maker, "AAPL", 9, 2),
+                      MarketOrder(maker, "AAPL", 4, "BUY")):
+            exchange.resolve_order(order)
+        collared = MarketOrder(maker, "AAPL", 6, "BUY")
+        collared.collar = 900
+        exchange.resolve_order(collared)
+        book = exchange.books["AAPL"]
+        self.assertEqual(auction_depth(book, BUY), ({1000: 8, 900: 8}, 4))
+        self.assertEqual(auction_depth(book, SELL), ({}, 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+@author: Desmond Tan
+"""
+import unittest
+
+from bars import *
+from events import NullSink
+from exchange import *
+from user import *
+
+SECOND = 10 ** 9
+
+
+class TestBars(unittest.TestCase):
+    def setUp(self) -> None:
+        self.bars = Bars(Stock("AAPL"), ('1s', '1m'))
+
+    def test_parse_interval(self):
+        self.assertEqual(parse_interval('5m'), 300 * SECOND)
+        self.assertEqual(parse_interval('1h'), 3600 * SECOND)
+        for interval in ('5', 'm', '0s', '1d', '-1s'):
+            self.assertRaises(Exception, parse_interval, interval)
+
+    def test_update(self):
+        for timestamp, ticks, quantity in ((0, 1000, 10), (SECOND // 2, 1050, 5), (SECOND - 1, 990, 5),
+                                           (SECOND, 1010, 20), (61 * SECOND, 1020, 1)):
+            self.bars.update(timestamp, ticks, quantity)
+        seconds = self.bars.query('1s')
+        self.assertEqual(list(seconds['time']), [0, SECOND, 61 * SECOND])
+        self.assertEqual(list(seconds['open']), [10, 10.1, 10.2])
+        self.assertEqual(list(seconds['high']), [10.5, 10.1, 10.2])
+        self.assertEqual(list(seconds['low']), [9.9, 10.1, 10.2])
+        self.assertEqual(list(seconds['close']), [9.9, 10.1, 10.2])
+        self.assertEqual(list(seconds['volume']), [20, 20, 1])
+        self.assertEqual(list(seconds['trades']), [3, 1, 1])
+        self.assertAlmostEqual(seconds['vwap'][0], (10 * 10 + 10.5 * 5 + 9.9 * 5) / 20)
+
+        minutes = self.bars.query('1m')
+        self.assertEqual(list(minutes['volume']), [40, 1])
+        self.assertAlmostEqual(self.bars.vwap(), (100 + 52.5 + 49.5 + 202 + 10.2) / 41)
+
+    def test_query_range(self):
+        for second in range(10):
+            self.bars.update(second * SECOND, 1000 + second, 1)
+        bars = self.bars.query('1s', 3 * SECOND, 6 * SECOND)
+        self.assertEqual(list(bars['close']), [10.03, 10.04, 10.05])
+        self.assertEqual(len(self.bars.query('1s', 20 * SECOND)['time']), 0)
+        self.assertRaises(Exception, self.bars.query, '5m')
+
+    def test_exchange_updates_bars(self):
+        clock = iter(range(0, 100 * SECOND, SECOND)).__next__
+        exchange = Exchange(sink=NullSink(), clock=clock)
+        exchange.list_stock(Stock("AAPL"))
+        john = Admin("John", exchange)
+        self.assertEqual(exchange.get_vwap("AAPL"), 0)
+        exchange.execute(john, "SELL AAPL LMT $10 5")
+        exchange.execute(john, "SELL AAPL LMT $12 5")
+        exchange.execute(john, "BUY AAPL MKT 10")
+        self.assertEqual(exchange.get_vwap("AAPL"), 11)
+        self.assertEqual(list(exchange.get_bars("AAPL", "1s")['close']), [10, 12])
+        self.assertEqual(list(exchange.get_bars("AAPL", "1m")['high']), [12])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+@author: Desmond Tan
+"""
+import unittest
+
+from commands import *
+
+
+class TestParse(unittest.TestCase):
+    def test_parse_limit_order(self):
+        command = parse("BUY AAPL LMT $10.5 10")
+        self.assertEqual(command, LimitCommand("BUY", "AAPL", 10.5, 10))
+        self.assertIsInstance(command.price, float)
+
+    def test_parse_market_order(self):
+        self.assertEqual(parse("SELL AAPL MKT 10"), MarketCommand("SELL", "AAPL", 10))
+
+    def test_parse_stop_orders(self):
+        self.assertEqual(parse("SELL AAPL STP $9.5 10"), StopCommand("SELL", "AAPL", 9.5, None, 10))
+        self.assertEqual(parse("BUY AAPL STPLMT $10 $10.5 10"), StopCommand("BUY", "AAPL", 10, 10.5, 10))
+        self.assertIsNone(parse("BUY AAPL STPLMT $10 10"))
+
+    def test_parse_time_in_force(self):
+        self.assertEqual(parse("BUY AAPL LMT $10 10 IOC"), LimitCommand("BUY", "AAPL", 10, 10, "IOC"))
+        self.assertEqual(parse("SELL AAPL MKT 10 FOK"), MarketCommand("SELL", "AAPL", 10, "FOK"))
+        self.assertEqual(parse("BUY AAPL LMT $10 10 DAY"), LimitCommand("BUY", "AAPL", 10, 10, "DAY"))
+        self.assertEqual(parse("BUY AAPL LMT $10 10 GTD 2024-01-02T03:04:05"),
+                         LimitCommand("BUY", "AAPL", 10, 10, "GTD", 1704164645 * 10 ** 9))
+        self.assertEqual(parse("BUY AAPL LMT $10 10 GTD 2024-01-02T03:04:05+01:00").expires,
+                         1704161045 * 10 ** 9)
+        for action in ["BUY AAPL LMT $10 10 GTD", "BUY AAPL LMT $10 10 GTD tomorrow",
+                       "BUY AAPL STP $10 10 IOC", "BUY AAPL LMT $10 10 GTC"]:
+            self.assertIsNone(parse(action), action)
+
+    def test_parse_cancel(self):
+        self.assertEqual(parse("CANCEL 12"), CancelCommand(12))
+
+    def test_parse_amend(self):
+        self.assertEqual(parse("AMEND 12 $9.5 20"), AmendCommand(12, 9.5, 20))
+        self.assertEqual(parse("AMEND 12 20"), AmendCommand(12, None, 20))
+
+    def test_parse_other_commands(self):
+        self.assertEqual(parse("QUOTE AAPL"), QuoteCommand("AAPL"))
+        self.assertIsInstance(parse("VIEW ORDERS"), ViewOrdersCommand)
+        self.assertIsInstance(parse("VIEW PORTFOLIO"), ViewPortfolioCommand)
+        self.assertIsInstance(parse("HELP"), HelpCommand)
+
+    def test_parse_invalid(self):
+        for action in ["", "BUY", "BUY AAPL LMT 10 10", "SELL AAPL MKT 1.5", "QUOTE",
+                       "VIEW", "HELP ME", "CANCEL x", "BUY AAPL LMT $10 10 extra", "BUY AAPL LMT $10 0",
+                       "SELL AAPL MKT 00", "SELL AAPL STP $10 0"]:
+            self.assertIsNone(parse(action), action)
+
+    def test_parse_many(self):
+        lines = ["BUY AAPL MKT 10\n", "\n", "QUOTE AAPL\n", "bad\n"]
+        self.assertEqual(list(parse_many(lines)),
+                         [MarketCommand("BUY", "AAPL", 10), QuoteCommand("AAPL"), None])
+
+    def test_parse_many_with_user(self):
+        lines = ["Jane Doe: SELL AAPL LMT $10 5\n"]
+        self.assertEqual(list(parse_many(lines, with_user=True)),
+                         [("Jane Doe", LimitCommand("SELL", "AAPL", 10.0, 5))])
@@ -0,0 +1,54 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+@author: Desmond Tan
+"""
+from io import StringIO
+import unittest
+from unittest.mock import patch
+
+from events import *
+from exchange import *
+from orders import *
+from user import *
+
+
+class TestSinks(unittest.TestCase):
+    def test_console_sink(self):
+        exchange = Exchange(sink=ConsoleSink())
+        exchange.list_stock(Stock("AAPL"))
+        user = Admin("John", exchange)
+        with patch('sys.stdout', new=StringIO()) as fake_out:
+            exchange.execute(user, "BUY AAPL LMT $10 10")
+            exchange.execute(user, "SELL AAPL MKT 5")
+            self.assertEqual(fake_out.getvalue(),
+                             "You have placed a limit buy order for 10 AAPL shares at $10.00 each. Order ID: 1\n"
+                             "You have placed a market order for 5 AAPL shares. Order ID: 2\n")
+
+    def test_null_sink(self):
+        exchange = Exchange(sink=NullSink())
+        exchange.list_stock(Stock("AAPL"))
+        user = Admin("John", exchange)
+        with patch('sys.stdout', new=StringIO()) as fake_out:
+            for action in ["BUY AAPL LMT $10 10", "QUOTE AAPL", "VIEW ORDERS", "VIEW PORTFOLIO", "HELP", "BAD"]:
+                exchange.execute(user, action)
+            self.assertEqual(fake_out.getvalue(), "")
+
+    def test_buffered_sink(self):
+        stream = StringIO()
+        sink = BufferedSink(stream, batch_size=3)
+        exchange = Exchange(sink=sink)
+        exchange.list_stock(Stock("AAPL"))
+        user1 = Admin("John", exchange)
+        user2 = Admin("Jane", exchange)
+        exchange.execute(user1, "BUY AAPL LMT $10 10")
+        self.assertEqual(stream.getvalue(), "")
+        exchange.execute(user2, "SELL AAPL LMT $10 4")
+        self.assertEqual(stream.getvalue().splitlines(), [
+            "You have placed a limit buy order for 10 AAPL shares at $10.00 each. Order ID: 1",
+            "You have placed a limit sell order for 4 AAPL shares at $10.00 each. Order ID: 2",
+            "John bought 4 shares from Jane at $10.00 each.",
+        ])
+        exchange.execute(user1, "QUOTE AAPL")
+        sink.flush()
+        self.assertEqual(stream.getvalue().splitlines()[-1], "AAPL BID: $10.00 ASK: $0.00 LAST: $10.00")
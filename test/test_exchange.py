@@ -7,9 +7,11 @@ from io import StringIO
 import unittest
 from unittest.mock import patch
 
+from events import NullSink
 from exchange import *
 from orders import *
 from user import *
+from ticks import to_units
 
 
 BUY = 0
@@ -242,3 +244,488 @@ class TestExchange(unittest.TestCase):
             exchange.execute(user, "VIEW ORDERS")
             self.assertEqual(fake_out.getvalue(),
                              "1. AAPL LMT BUY $10.00 0/10 PENDING\n2. AAPL LMT SELL $11.00 0/10 PENDING\n")
+
+    def test_time_priority(self):
+        exchange = Exchange()
+        aapl = Stock("AAPL")
+        exchange.list_stock(aapl)
+        user1 = Admin("John", exchange)
+        user2 = Admin("Jane", exchange)
+        user3 = Admin("Jack", exchange)
+        order1 = SellOrder(user1, "AAPL", 10, 5)
+        order2 = SellOrder(user2, "AAPL", 10, 5)
+        exchange.place_limit_order(order1)
+        exchange.place_limit_order(order2)
+        self.assertLess(order1.sequence, order2.sequence)
+        exchange.place_market_order(MarketOrder(user3, "AAPL", 6, "BUY"))
+        self.assertTrue(order1.is_filled())
+        self.assertEqual(order2.filled, 1)
+        self.assertEqual(exchange.get_bid_ask("AAPL")[1], order2)
+
+    def test_execute_cancel(self):
+        exchange = Exchange()
+        aapl = Stock("AAPL")
+        exchange.list_stock(aapl)
+        user1 = Admin("John", exchange)
+        user2 = Admin("Jane", exchange)
+        exchange.execute(user1, "SELL AAPL LMT $10 10")
+        exchange.execute(user1, "SELL AAPL LMT $11 10")
+        order = user1.orders[0]
+        exchange.execute(user1, f"CANCEL {order.id}")
+        self.assertEqual(order.get_status(), "CANCELLED")
+        self.assertEqual(len(exchange.limit_orders["AAPL"][SELL]), 1)
+        self.assertEqual(exchange.get_bid_ask("AAPL")[1].price, 11)
+        self.assertNotIn(order.id, exchange.orders)
+        exchange.execute(user2, "BUY AAPL MKT 5")
+        self.assertEqual(order.filled, 0)
+        self.assertEqual(exchange.trades["AAPL"][0].price, 11)
+
+    def test_orders_of_no_shares(self):
+        exchange = Exchange(sink=NullSink())
+        exchange.list_stock(Stock("AAPL"))
+        user = Admin("John", exchange)
+        self.assertFalse(user.verify_order(BuyOrder(user, "AAPL", 10, 0)))
+        self.assertEqual(exchange.submit_batch([SellOrder(user, "AAPL", 10, 0)])[0].status, "REJECTED")
+
+        order = exchange.resolve_order(BuyOrder(user, "AAPL", 10, 0))
+        self.assertIsNone(exchange.cancel_order(user, order.id))
+        self.assertEqual(len(exchange.limit_orders["AAPL"][BUY]), 0)
+
+    def test_execute_cancel_other_user(self):
+        exchange = Exchange()
+        aapl = Stock("AAPL")
+        exchange.list_stock(aapl)
+        user1 = Admin("John", exchange)
+        user2 = Admin("Jane", exchange)
+        exchange.execute(user1, "BUY AAPL MKT 10")
+        order = user1.orders[0]
+        with patch('sys.stdout', new=StringIO()) as fake_out:
+            exchange.execute(user2, f"CANCEL {order.id}")
+            self.assertEqual(fake_out.getvalue(), f"Order {order.id} is not an open order.\n")
+        self.assertEqual(len(exchange.market_orders["AAPL"][BUY]), 1)
+
+    def test_execute_amend_quantity_down(self):
+        exchange = Exchange()
+        aapl = Stock("AAPL")
+        exchange.list_stock(aapl)
+        user1 = Admin("John", exchange)
+        user2 = Admin("Jane", exchange)
+        exchange.execute(user1, "SELL AAPL LMT $10 10")
+        exchange.execute(user2, "SELL AAPL LMT $10 10")
+        order = user1.orders[0]
+        exchange.execute(user1, f"AMEND {order.id} 4")
+        self.assertEqual(order.quantity, 4)
+        # Still first in the queue
+        self.assertEqual(exchange.get_bid_ask("AAPL")[1], order)
+
+    def test_execute_amend_price(self):
+        exchange = Exchange()
+        aapl = Stock("AAPL")
+        exchange.list_stock(aapl)
+        user1 = Admin("John", exchange)
+        user2 = Admin("Jane", exchange)
+        exchange.execute(user1, "BUY AAPL LMT $9 10")
+        exchange.execute(user2, "SELL AAPL LMT $10 4")
+        order = user1.orders[0]
+        exchange.execute(user1, f"AMEND {order.id} $10 10")
+        self.assertEqual(order.get_status(), "CANCELLED")
+        new_order = user1.orders[1]
+        self.assertNotEqual(new_order.id, order.id)
+        self.assertEqual(new_order.filled, 4)
+        self.assertEqual(exchange.get_bid_ask("AAPL"), (new_order, None))
+
+    def test_submit_batch(self):
+        exchange = Exchange()
+        aapl = Stock("AAPL")
+        exchange.list_stock(aapl)
+        buyer = User("John", exchange)
+        buyer.deposit(150)
+        seller = Admin("Jane", exchange)
+        orders = [
+            SellOrder(seller, "AAPL", 10, 10),
+            BuyOrder(buyer, "AAPL", 10, 10),
+            BuyOrder(buyer, "AAPL", 10, 10),
+            MarketOrder(seller, "AAPL", 5, "SELL"),
+        ]
+        with patch('sys.stdout', new=StringIO()) as fake_out:
+            results = exchange.submit_batch(orders)
+            self.assertEqual(fake_out.getvalue(), "")
+        self.assertEqual([result.status for result in results], ["FILLED", "FILLED", "REJECTED", "PENDING"])
+        self.assertEqual(results[0], (orders[0].id, "FILLED", 10))
+        self.assertIsNone(results[2].order_id)
+        self.assertEqual(buyer.get_balance(), 50)
+        self.assertEqual(len(buyer.orders), 1)
+        self.assertEqual(len(exchange.market_orders["AAPL"][SELL]), 1)
+
+    def test_submit_batch_invalid_orders(self):
+        exchange = Exchange(sink=NullSink())
+        exchange.list_stock(Stock("AAPL"))
+        buyer = User("John", exchange)
+        buyer.deposit(150)
+        seller = Admin("Jane", exchange)
+        orders = [
+            SellOrder(seller, "AAPL", 10, 10),
+            BuyOrder(buyer, "AAPL", 10.005, 5),
+            MarketOrder(buyer, "ZZZ", 5, "BUY"),
+            StopOrder(seller, "AAPL", 9, 5, "SELL", 8.001),
+            BuyOrder(buyer, "AAPL", 10, 5),
+        ]
+        results = exchange.submit_batch(orders)
+        self.assertEqual([result.status for result in results], ["PARTIAL", "REJECTED", "REJECTED", "REJECTED",
+                                                                 "FILLED"])
+        self.assertEqual(buyer.get_balance(), 100)
+        self.assertEqual(buyer.reserved, 0)
+
+    def test_execute_invalid_tick(self):
+        exchange = Exchange()
+        exchange.list_stock(Stock("AAPL", tick_size=0.05))
+        user = Admin("John", exchange)
+        with patch('sys.stdout', new=StringIO()) as fake_out:
+            exchange.execute(user, "BUY AAPL LMT $10.01 10")
+            exchange.execute(user, "BUY MSFT LMT $10 10")
+            self.assertEqual(fake_out.getvalue(), "Invalid price for AAPL.\nInvalid price for MSFT.\n")
+        exchange.execute(user, "BUY AAPL LMT $10.05 10")
+        self.assertEqual(exchange.limit_orders["AAPL"][BUY][0].ticks, 201)
+
+    def test_execute_unknown_ticker(self):
+        exchange = Exchange()
+        exchange.list_stock(Stock("AAPL"))
+        user = User("John", exchange)
+        user.deposit(100)
+        with patch('sys.stdout', new=StringIO()) as fake_out:
+            exchange.execute(user, "QUOTE ZZZ")
+            exchange.execute(user, "BUY ZZZ MKT 1")
+            self.assertEqual(fake_out.getvalue(), "Invalid ticker ZZZ.\nInvalid ticker ZZZ.\n")
+        self.assertEqual(user.orders, [])
+
+    def test_cash_does_not_drift(self):
+        exchange = Exchange()
+        exchange.list_stock(Stock("AAPL"))
+        buyer = User("John", exchange)
+        buyer.deposit(1000)
+        seller = Admin("Jane", exchange)
+        for _ in range(1000):
+            exchange.resolve_order(SellOrder(seller, "AAPL", 0.1, 1))
+            exchange.resolve_order(BuyOrder(buyer, "AAPL", 0.1, 1))
+        self.assertEqual(buyer.get_balance(), 900)
+        self.assertEqual(buyer.balance, 900 * 10000)
+        self.assertEqual(exchange.trades["AAPL"][0].ticks, 10)
+
+    def test_market_collar(self):
+        exchange = Exchange(market_collar=0.1)
+        exchange.list_stock(Stock("AAPL"))
+        buyer = User("John", exchange)
+        buyer.deposit(1000)
+        seller = Admin("Jane", exchange)
+        exchange.resolve_order(SellOrder(seller, "AAPL", 10, 1))
+        exchange.resolve_order(BuyOrder(buyer, "AAPL", 10, 1))
+        exchange.resolve_order(SellOrder(seller, "AAPL", 11, 5))
+        exchange.resolve_order(SellOrder(seller, "AAPL", 12, 5))
+        self.assertEqual(exchange.get_collar("AAPL", "BUY"), 1100)
+        self.assertEqual(exchange.get_collar("AAPL", "SELL"), 900)
+        order = MarketOrder(buyer, "AAPL", 10, "BUY")
+        with patch('sys.stdout', new=StringIO()):
+            exchange.place_market_order(order)
+        # The sweep stops at the collar and the rest of the order waits
+        self.assertEqual(order.filled, 5)
+        self.assertEqual(exchange.market_orders["AAPL"][BUY].orders[0], order)
+        self.assertEqual(buyer.reserved, 5 * to_units(11))
+        # A queued market order is not filled beyond its collar either
+        exchange.resolve_order(SellOrder(seller, "AAPL", 11.5, 5))
+        self.assertEqual(order.filled, 5)
+        exchange.resolve_order(SellOrder(seller, "AAPL", 10.5, 5))
+        self.assertTrue(order.is_filled())
+        self.assertEqual(buyer.reserved, 0)
+
+    def test_stop_orders(self):
+        exchange = Exchange()
+        exchange.list_stock(Stock("AAPL"))
+        user = User("John", exchange)
+        user.deposit(1000)
+        user.add_stock("AAPL", 10)
+        maker = Admin("Jane", exchange)
+        with patch('sys.stdout', new=StringIO()) as fake_out:
+            exchange.execute(user, "BUY AAPL STP $11 5")
+            exchange.execute(user, "SELL AAPL STPLMT $9 $8.5 10")
+            self.assertEqual(fake_out.getvalue(),
+                             "You have placed a stop buy order for 5 AAPL shares at a stop price of $11.00. "
+                             "Order ID: 1\n"
+                             "You have placed a stop sell order for 10 AAPL shares at a stop price of $9.00 "
+                             "and a limit price of $8.50. Order ID: 2\n")
+            # The buy stop reserves its collar, 10% above the stop price
+            self.assertEqual(user.reserved, 5 * to_units(12.1))
+            self.assertEqual(user.reserved_stock, {"AAPL": 10})
+            exchange.execute(user, "AMEND 1 6")
+            self.assertIn("A stop order cannot be amended before it is triggered.", fake_out.getvalue())
+
+            exchange.execute(maker, "SELL AAPL LMT $10 1")
+            exchange.execute(maker, "BUY AAPL LMT $10 1")
+            self.assertEqual(user.orders[0].get_status(), "PENDING")
+            exchange.execute(maker, "SELL AAPL LMT $11 10")
+            exchange.execute(maker, "BUY AAPL LMT $11 1")
+            # The trade at $11 triggers the buy stop, which buys at $11
+            self.assertEqual(user.orders[0].get_status(), "FILLED")
+            self.assertEqual(str(user.orders[0]), "AAPL STP BUY $11.00 5/5 FILLED")
+            self.assertEqual(user.reserved, 0)
+            self.assertEqual(user.get_balance(), 945)
+
+            exchange.execute(maker, "BUY AAPL LMT $9 4")
+            exchange.execute(maker, "SELL AAPL MKT 4")
+            # The trade at $9 triggers the sell stop-limit, which rests at $8.50 as there are no bids left
+            self.assertEqual(exchange.get_last_price("AAPL"), 9)
+            self.assertEqual(str(user.orders[1]), "AAPL STPLMT $8.50 SELL $9.00 0/10 PENDING")
+            self.assertEqual(exchange.get_bid_ask("AAPL")[1].id, 2)
+            exchange.execute(user, "CANCEL 2")
+        self.assertEqual(user.orders[1].get_status(), "CANCELLED")
+        self.assertEqual(user.reserved_stock, {"AAPL": 0})
+
+    def test_stops_cascade(self):
+        exchange = Exchange(sink=NullSink())
+        exchange.list_stock(Stock("AAPL"))
+        maker = Admin("Jane", exchange)
+        for price in (10, 9, 8):
+            exchange.execute(maker, f"BUY AAPL LMT ${price} 1")
+        exchange.execute(maker, "SELL AAPL STP $9 1")
+        exchange.execute(maker, "SELL AAPL STP $8 1")
+        exchange.execute(maker, "SELL AAPL STP $12 1")
+        exchange.execute(maker, "SELL AAPL MKT 1")
+        # $10 triggers the stop at $12, which sells at $9, which triggers the stop at $9,
+        # which sells at $8, which triggers the stop at $8, which finds no bids left
+        self.assertEqual([trade.ticks for trade in exchange.trades["AAPL"]], [1000, 900, 800])
+        self.assertEqual(exchange.books["AAPL"].stops[SELL].size, 0)
+        self.assertEqual(len(exchange.market_orders["AAPL"][SELL]), 1)
+
+    def test_stops_trigger_on_every_trade(self):
+        exchange = Exchange(sink=NullSink())
+        exchange.list_stock(Stock("AAPL"))
+        maker = Admin("Jane", exchange)
+        exchange.execute(maker, "SELL AAPL LMT $10 1")
+        exchange.execute(maker, "BUY AAPL LMT $10 1")
+        exchange.execute(maker, "BUY AAPL STP $12 1")
+        exchange.execute(maker, "SELL AAPL STP $8 1")
+        buy_stop, sell_stop = maker.orders[2:]
+        exchange.execute(maker, "BUY AAPL LMT $13 1")
+        exchange.execute(maker, "BUY AAPL LMT $11 1")
+        # Trades at $13 then $11, the last price never reaches the stop at $12
+        exchange.execute(maker, "SELL AAPL MKT 2")
+        self.assertEqual(exchange.get_last_price("AAPL"), 11)
+        self.assertIsNotNone(buy_stop.triggered)
+        self.assertIsNone(sell_stop.triggered)
+
+        # Fills the market order the buy stop became
+        exchange.execute(maker, "SELL AAPL LMT $11 1")
+        self.assertEqual(buy_stop.get_status(), "FILLED")
+        exchange.execute(maker, "SELL AAPL LMT $7 1")
+        exchange.execute(maker, "SELL AAPL LMT $9 1")
+        # Trades at $7 then $9, the last price never reaches the stop at $8
+        exchange.execute(maker, "BUY AAPL MKT 2")
+        self.assertEqual(exchange.get_last_price("AAPL"), 9)
+        self.assertIsNotNone(sell_stop.triggered)
+
+    def test_immediate_or_cancel(self):
+        exchange = Exchange(sink=NullSink())
+        exchange.list_stock(Stock("AAPL"))
+        buyer = User("John", exchange)
+        buyer.deposit(1000)
+        seller = Admin("Jane", exchange)
+        exchange.execute(seller, "SELL AAPL LMT $10 5")
+        exchange.execute(buyer, "BUY AAPL LMT $10 8 IOC")
+        order = buyer.orders[0]
+        # The rest of the order is cancelled instead of resting in the book
+        self.assertEqual(order.filled, 5)
+        self.assertEqual(order.get_status(), "CANCELLED")
+        self.assertEqual(exchange.get_bid_ask("AAPL"), (None, None))
+        self.assertNotIn(order.id, exchange.orders)
+        self.assertEqual(buyer.reserved, 0)
+        self.assertEqual(buyer.get_balance(), 950)
+
+    def test_fill_or_kill(self):
+        exchange = Exchange(sink=NullSink())
+        exchange.list_stock(Stock("AAPL"))
+        buyer = User("John", exchange)
+        buyer.deposit(1000)
+        seller = Admin("Jane", exchange)
+        exchange.execute(seller, "SELL AAPL LMT $10 5")
+        exchange.execute(seller, "SELL AAPL LMT $11 5")
+        exchange.execute(buyer, "BUY AAPL LMT $10 8 FOK")
+        # Only 5 shares are offered at $10, the order is cancelled and the book is untouched
+        self.assertEqual(buyer.orders[0].get_status(), "CANCELLED")
+        self.assertEqual(buyer.orders[0].filled, 0)
+        self.assertEqual(len(exchange.trades["AAPL"]), 0)
+        self.assertEqual(exchange.get_bid_ask("AAPL")[1].quantity, 5)
+        self.assertEqual(buyer.reserved, 0)
+        exchange.execute(buyer, "BUY AAPL LMT $11 8 FOK")
+        self.assertEqual(buyer.orders[1].get_status(), "FILLED")
+        self.assertEqual(buyer.get_balance(), 1000 - 50 - 33)
+        exchange.execute(buyer, "BUY AAPL MKT 3 FOK")
+        self.assertEqual(buyer.orders[2].get_status(), "CANCELLED")
+        self.assertEqual(exchange.get_bid_ask("AAPL")[1].filled, 3)
+
+    def test_orders_expire(self):
+        now = [10 ** 9]
+        exchange = Exchange(sink=NullSink(), clock=lambda: now[0], day_end=3600)
+        exchange.list_stock(Stock("AAPL"))
+        maker = Admin("Jane", exchange)
+        exchange.execute(maker, "BUY AAPL LMT $10 5 DAY")
+        exchange.execute(maker, "BUY AAPL LMT $9 5 GTD 1970-01-01T00:00:05")
+        exchange.execute(maker, "BUY AAPL LMT $8 5")
+        day, gtd, gtc = maker.orders
+        self.assertEqual(day.expires, 3600 * 10 ** 9)
+        self.assertEqual(gtd.expires, 5 * 10 ** 9)
+        exchange.execute(maker, "SELL AAPL LMT $10 2")
+        now[0] = 5 * 10 ** 9
+        exchange.execute(maker, "QUOTE AAPL")
+        self.assertEqual(gtd.get_status(), "CANCELLED")
+        self.assertEqual(day.get_status(), "PARTIAL")
+        now[0] = 3600 * 10 ** 9
+        exchange.execute(maker, "QUOTE AAPL")
+        self.assertEqual(day.get_status(), "CANCELLED")
+        self.assertEqual(gtc.get_status(), "PENDING")
+        self.assertEqual(exchange.get_bid_ask("AAPL")[0], gtc)
+        self.assertEqual(list(exchange.orders), [gtc.id])
+        # A DAY order placed after the end of the day lasts until the end of the next day
+        exchange.execute(maker, "BUY AAPL LMT $7 5 DAY")
+        self.assertEqual(maker.orders[-1].expires, (24 + 1) * 3600 * 10 ** 9)
+
+    def test_call_auction(self):
+        exchange = Exchange(sink=NullSink())
+        exchange.list_stock(Stock("AAPL"))
+        buyer = User("John", exchange)
+        buyer.deposit(1000)
+        maker = Admin("Jane", exchange)
+        exchange.start_auction("AAPL")
+        exchange.execute(buyer, "BUY AAPL LMT $11 10")
+        exchange.execute(maker, "BUY AAPL LMT $10 5")
+        exchange.execute(maker, "SELL AAPL LMT $9 8")
+        exchange.execute(maker, "SELL AAPL LMT $10 4")
+        exchange.execute(maker, "SELL AAPL MKT 2")
+        exchange.execute(buyer, "BUY AAPL LMT $11 1 IOC")
+        # Nothing matches while the stock is in auction, the book stays crossed
+        self.assertEqual(len(exchange.trades["AAPL"]), 0)
+        self.assertEqual(exchange.get_bid_ask("AAPL")[0].price, 11)
+        self.assertEqual(buyer.orders[1].get_status(), "CANCELLED")
+        self.assertEqual(exchange.get_auction_price("AAPL"), (10, 14))
+
+        self.assertEqual(exchange.uncross("AAPL"), (10, 14))
+        self.assertFalse(exchange.stocks["AAPL"].auction)
+        self.assertEqual({trade.price for trade in exchange.trades["AAPL"]}, {10})
+        self.assertEqual(sum(trade.quantity for trade in exchange.trades["AAPL"]), 14)
+        self.assertEqual(buyer.orders[0].get_status(), "FILLED")
+        self.assertEqual(buyer.get_balance(), 900)
+        self.assertEqual(buyer.reserved, 0)
+        self.assertEqual(exchange.get_bid_ask("AAPL")[0].filled, 4)
+        self.assertIsNone(exchange.get_bid_ask("AAPL")[1])
+        self.assertEqual(exchange.market_orders["AAPL"][SELL].size, 0)
+        # Back to continuous matching
+        exchange.execute(maker, "SELL AAPL LMT $10 1")
+        self.assertEqual(len(exchange.trades["AAPL"]), 4)
+
+    def test_auction_market_orders(self):
+        exchange = Exchange(sink=NullSink())
+        exchange.list_stock(Stock("AAPL"))
+        maker = Admin("Jane", exchange)
+        exchange.start_auction("AAPL")
+        exchange.execute(maker, "BUY AAPL MKT 5")
+        exchange.execute(maker, "SELL AAPL MKT 3")
+        # Market orders alone have no price to cross at before the first trade
+        self.assertIsNone(exchange.uncross("AAPL"))
+        exchange.execute(maker, "SELL AAPL LMT $9.5 2")
+        exchange.execute(maker, "SELL AAPL MKT 1")
+        self.assertEqual([trade.price for trade in exchange.trades["AAPL"]], [9.5])
+        exchange.start_auction("AAPL")
+        # With a last price they cross at it
+        self.assertEqual(exchange.uncross("AAPL"), (9.5, 3))
+        self.assertEqual(exchange.market_orders["AAPL"][BUY].size, 0)
+        self.assertEqual(exchange.market_orders["AAPL"][SELL].size, 1)
+
+    def test_auction_takes_off_whole_levels(self):
+        results = []
+        for ladder in (False, True):
+            exchange = Exchange(sink=NullSink())
+            exchange.list_stock(Stock("AAPL", min_price=1, max_price=100), ladder=ladder)
+            maker = Admin("Jane", exchange)
+            exchange.start_auction("AAPL")
+            for price in (10, 10, 10, 9.5, 9.5):
+                exchange.execute(maker, f"BUY AAPL LMT ${price} 4")
+            for price, quantity in ((9, 3), (9, 3), (9.5, 5), (9.5, 5), (9.5, 5), (10.5, 3)):
+                exchange.execute(maker, f"SELL AAPL LMT ${price} {quantity}")
+            # Cancelled orders inside levels that are filled in full
+            exchange.execute(maker, "CANCEL 2")
+            exchange.execute(maker, "CANCEL 7")
+            self.assertEqual(exchange.uncross("AAPL"), (9.5, 16))
+            bids, asks = exchange.books["AAPL"].limit_orders
+            self.assertEqual((len(bids), len(asks)), (0, 2))
+            self.assertIsNone(bids.best_level())
+            self.assertEqual((asks.peek().id, asks.peek().filled), (10, 3))
+            self.assertEqual(asks.best_level().quantity, 2)
+            self.assertEqual(exchange.bars["AAPL"].query('1m')['trades'][0], len(exchange.trades["AAPL"]))
+            self.assertEqual(sorted(exchange.orders), [10, 11])
+            results.append([exchange.trades["AAPL"].row(i)[1:] for i in range(len(exchange.trades["AAPL"]))])
+        self.assertEqual(results[0], results[1])
+
+    def test_cannot_over_commit(self):
+        exchange = Exchange()
+        exchange.list_stock(Stock("AAPL"))
+        buyer = User("John", exchange)
+        buyer.deposit(100)
+        with patch('sys.stdout', new=StringIO()):
+            exchange.execute(buyer, "BUY AAPL LMT $10 10")
+            exchange.execute(buyer, "BUY AAPL LMT $9 10")
+            exchange.execute(buyer, "AMEND 1 $11 10")
+        self.assertEqual(len(buyer.orders), 1)
+        self.assertEqual(buyer.reserved, to_units(100))
+        # A sweep through the orders of the buyer settles every fill
+        with patch('sys.stdout', new=StringIO()):
+            exchange.execute(Admin("Jane", exchange), "SELL AAPL MKT 20")
+        self.assertEqual(buyer.orders[0].filled, 10)
+        self.assertEqual(buyer.get_balance(), 0)
+        self.assertEqual(buyer.reserved, 0)
+
+    def test_batch_keeps_verified_collar(self):
+        exchange = Exchange(sink=NullSink())
+        exchange.list_stock(Stock("AAPL"))
+        admin = Admin("Jane", exchange)
+        buyer = User("John", exchange)
+        buyer.deposit(110)
+        exchange.execute(admin, "SELL AAPL LMT $10 1")
+        exchange.execute(admin, "BUY AAPL LMT $10 1")
+        exchange.execute(admin, "SELL AAPL LMT $20 1")
+        exchange.execute(admin, "SELL AAPL LMT $21 10")
+        # The first order moves the last price to $20, the market order was verified with a collar at $11
+        results = exchange.submit_batch([BuyOrder(admin, "AAPL", 20, 1), MarketOrder(buyer, "AAPL", 10, "BUY")])
+        self.assertEqual([result.status for result in results], ["FILLED", "PENDING"])
+        self.assertEqual(exchange.get_last_price("AAPL"), 20)
+        self.assertEqual(buyer.reserved, to_units(110))
+        self.assertEqual(len(exchange.trades["AAPL"]), 2)
+        self.assertEqual(len(exchange.market_orders["AAPL"][BUY]), 1)
+
+
+class TestStock(unittest.TestCase):
+    def test_ticks(self):
+        stock = Stock("AAPL", tick_size=0.25)
+        self.assertEqual(stock.to_ticks(10.5), 42)
+        self.assertEqual(stock.to_price(42), 10.5)
+        self.assertTrue(stock.is_valid_price(0.25))
+        self.assertFalse(stock.is_valid_price(10.1))
+        self.assertFalse(stock.is_valid_price(0))
+        with self.assertRaises(Exception):
+            stock.to_ticks(10.1)
+
+    def test_invalid_tick_size(self):
+        with self.assertRaises(Exception):
+            Stock("AAPL", tick_size=0.00001)
+
+    def test_accept_order_interns(self):
+        exchange = Exchange()
+        aapl = Stock("AAPL")
+        exchange.list_stock(aapl)
+        user1 = Admin("John", exchange)
+        user2 = Admin("Jane", exchange)
+        exchange.execute(user1, "BUY AAPL LMT $10 10")
+        exchange.execute(user2, "SELL AAPL LMT $11 10")
+        exchange.execute(user1, "BUY AAPL MKT 10")
+        self.assertIs(user1.orders[0].ticker, aapl.ticker)
+        self.assertEqual(exchange.user_ids.intern(user1), 0)
+        self.assertEqual(exchange.user_ids.lookup(1), user2)
+        self.assertFalse(hasattr(user1.orders[0], '__dict__'))
+        self.assertFalse(hasattr(exchange.trades["AAPL"][0], '__dict__'))
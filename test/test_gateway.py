@@ -0,0 +1,114 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+@author: Desmond Tan
+"""
+import asyncio
+import unittest
+from unittest.mock import patch
+
+from gateway import *
+from user import *
+
+
+class TestGateway(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self) -> None:
+        self.exchange = make_exchange()
+        self.gateway = Gateway(self.exchange, accounts={"John": "secret", "Jane": "hunter2"}, make_user=Admin)
+        server = await self.gateway.start(port=0)
+        self.port = server.sockets[0].getsockname()[1]
+
+    async def asyncTearDown(self) -> None:
+        await self.gateway.stop()
+
+    async def connect(self, login):
+        reader, writer = await asyncio.open_connection('127.0.0.1', self.port)
+        writer.write(login.encode() + b'\n')
+        welcome = await reader.readline()
+        return reader, writer, welcome.decode().strip()
+
+    async def send(self, writer, *actions):
+        writer.write(''.join(action + '\n' for action in actions).encode())
+        await writer.drain()
+
+    async def read_until_pong(self, reader):
+        lines = []
+        while True:
+            line = (await reader.readline()).decode().rstrip('\n')
+            if line == 'PONG':
+                return lines
+            lines.append(line)
+
+    async def test_login(self):
+        _, writer, welcome = await self.connect("LOGIN John wrong")
+        self.assertEqual(welcome, "Login failed.")
+        writer.close()
+        _, writer, welcome = await self.connect("LOGIN John secret")
+        self.assertEqual(welcome, "Welcome John.")
+        _, other, welcome = await self.connect("LOGIN John secret")
+        self.assertEqual(welcome, "Login failed.")
+        writer.close()
+        other.close()
+
+    async def test_pipelined_orders_and_fills(self):
+        john_reader, john, _ = await self.connect("LOGIN John secret")
+        jane_reader, jane, _ = await self.connect("LOGIN Jane hunter2")
+        await self.send(john, "SELL AAPL LMT $10 5", "SELL AAPL LMT $11 5", "PING")
+        self.assertEqual(await self.read_until_pong(john_reader), [
+            "You have placed a limit sell order for 5 AAPL shares at $10.00 each. Order ID: 1",
+            "You have placed a limit sell order for 5 AAPL shares at $11.00 each. Order ID: 2",
+        ])
+        await self.send(jane, "BUY AAPL MKT 7", "QUOTE AAPL", "PING")
+        self.assertEqual(await self.read_until_pong(jane_reader), [
+            "You have placed a market order for 7 AAPL shares. Order ID: 3",
+            "Jane bought 5 shares from John at $10.00 each.",
+            "Jane bought 2 shares from John at $11.00 each.",
+            "AAPL BID: $0.00 ASK: $11.00 LAST: $11.00",
+        ])
+        await self.send(john, "PING")
+        self.assertEqual(await self.read_until_pong(john_reader), [
+            "Jane bought 5 shares from John at $10.00 each.",
+            "Jane bought 2 shares from John at $11.00 each.",
+        ])
+        self.assertEqual(self.gateway.users["Jane"].portfolio["AAPL"], 7)
+        for writer in (john, jane):
+            await self.send(writer, "QUIT")
+            writer.close()
+
+    async def test_errors_do_not_stop_the_sequencer(self):
+        reader, writer, _ = await self.connect("LOGIN John secret")
+        await self.send(writer, "QUOTE ZZZ", "BUY ZZZ MKT 1", "PING")
+        self.assertEqual(await self.read_until_pong(reader), ["Invalid ticker ZZZ.", "Invalid ticker ZZZ."])
+        with patch.object(self.exchange, 'execute_command', side_effect=KeyError('ZZZ')), \
+                self.assertLogs(level='ERROR'):
+            await self.send(writer, "QUOTE AAPL", "PING")
+            self.assertEqual(await self.read_until_pong(reader), ["Error: 'ZZZ'"])
+        await self.send(writer, "QUOTE AAPL", "PING")
+        self.assertEqual(await self.read_until_pong(reader), ["AAPL BID: $0.00 ASK: $0.00 LAST: $0.00"])
+        await self.send(writer, "QUIT")
+        writer.close()
+
+    async def test_rejected_orders(self):
+        self.gateway.make_user = User
+        reader, writer, _ = await self.connect("LOGIN John secret")
+        await self.send(writer, "BUY AAPL LMT $10 5", "SELL AAPL LMT $10 5", "BUY AAPL MKT 5", "PING")
+        self.assertEqual(await self.read_until_pong(reader), [
+            "Insufficient funds.",
+            "Insufficient stock.",
+            "No reference price for a market order.",
+        ])
+        await self.send(writer, "QUIT")
+        writer.close()
+
+    async def test_load(self):
+        histogram = LatencyHistogram()
+        self.gateway.make_user = Admin
+        self.gateway.accounts = None
+        await asyncio.gather(*(run_client('127.0.0.1', self.port, f"load{i}", 20, 5, histogram, random.Random(i))
+                               for i in range(5)))
+        self.assertEqual(histogram.count, 20)
+        self.assertEqual(next(self.exchange.sequence), 101)
+
+
+if __name__ == '__main__':
+    unittest.main()
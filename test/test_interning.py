@@ -0,0 +1,19 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+@author: Desmond Tan
+"""
+import unittest
+
+from interning import *
+
+
+class TestInterner(unittest.TestCase):
+    def test_intern(self):
+        interner = Interner()
+        self.assertEqual(interner.intern("AAPL"), 0)
+        self.assertEqual(interner.intern("MSFT"), 1)
+        self.assertEqual(interner.intern("AAPL"), 0)
+        self.assertEqual(len(interner), 2)
+        self.assertIn("MSFT", interner)
+        self.assertEqual(interner.lookup(1), "MSFT")
@@ -0,0 +1,203 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+@author: Desmond Tan
+"""
+import os
+import tempfile
+import unittest
+
+from events import NullSink
+from exchange import *
+from journal import *
+from user import *
+
+
+class TestJournal(unittest.TestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.journal_path = os.path.join(self.directory.name, "journal.log")
+        self.snapshot_path = os.path.join(self.directory.name, "snapshot.pickle")
+        self.now = 1700000000 * 10 ** 9
+        self.exchange = self.new_exchange(Journal(self.journal_path, group_size=1))
+        self.john = Admin("John", self.exchange)
+        self.jane = Admin("Jane", self.exchange)
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    def new_exchange(self, journal=None):
+        exchange = Exchange(sink=NullSink(), journal=journal, clock=lambda: self.now)
+        exchange.list_stock(Stock("AAPL"))
+        return exchange
+
+    def quote(self, exchange):
+        bid, ask = exchange.get_bid_ask("AAPL")
+        return bid.price if bid else 0, ask.price if ask else 0
+
+    def state(self, exchange):
+        book = exchange.books["AAPL"]
+        trades = [(trade.buyer.name, trade.seller.name, trade.price, trade.quantity) for trade in book.trades]
+        return self.quote(exchange), trades
+
+    def test_journal_records(self):
+        self.exchange.execute(self.john, "SELL AAPL LMT $10 5")
+        self.exchange.execute(self.jane, "VIEW ORDERS")
+        self.exchange.execute(self.jane, "BUY AAPL MKT 2")
+        self.exchange.journal.close()
+        records = [fields for _, fields in read_records(self.journal_path)]
+        now = str(self.now)
+        self.assertEqual(records, [
+            ["C", now, "John", "SELL AAPL LMT $10 5"],
+            ["C", now, "Jane", "BUY AAPL MKT 2"],
+            ["F", "AAPL", "1000", "2", "1", "0"],
+        ])
+
+    def test_recover_from_journal(self):
+        self.exchange.execute(self.john, "SELL AAPL LMT $10 5")
+        self.exchange.execute(self.jane, "BUY AAPL LMT $9 5")
+        self.exchange.submit_batch([BuyOrder(self.jane, "AAPL", 10, 2), SellOrder(self.john, "AAPL", 9.5, 1)])
+        self.exchange.execute(self.jane, "CANCEL 2")
+        self.exchange.journal.close()
+
+        recovered = recover(self.journal_path, exchange=self.new_exchange(), users=(self.john, self.jane))
+        self.assertEqual(self.state(recovered), self.state(self.exchange))
+        recovered.journal.close()
+
+    def test_recover_expired_orders(self):
+        self.exchange.execute(self.john, "SELL AAPL LMT $10 5 DAY")
+        self.now += DAY_NANOSECONDS
+        self.exchange.execute(self.jane, "BUY AAPL LMT $10 5")
+        self.exchange.execute(self.john, "SELL AAPL LMT $10 2")
+        self.exchange.journal.close()
+        self.assertEqual(len(self.exchange.books["AAPL"].trades), 1)
+
+        # Recovered a day later, the order still expired before the buy
+        self.now += DAY_NANOSECONDS
+        recovered = recover(self.journal_path, exchange=self.new_exchange(), users=(self.john, self.jane))
+        self.assertEqual(self.state(recovered), self.state(self.exchange))
+        self.assertEqual(list(recovered.books["AAPL"].trades)[0].timestamp,
+                         list(self.exchange.books["AAPL"].trades)[0].timestamp)
+        self.assertEqual(recovered.clock(), self.now)
+        recovered.journal.close()
+
+    def test_recover_onto_tapes(self):
+        tape_dir = os.path.join(self.directory.name, "tapes")
+        self.exchange = Exchange(sink=NullSink(), journal=Journal(self.journal_path), tape_dir=tape_dir)
+        self.exchange.list_stock(Stock("AAPL"))
+        self.exchange.execute(self.john, "SELL AAPL LMT $10 5")
+        self.exchange.execute(self.jane, "BUY AAPL LMT $10 2")
+        self.exchange.journal.close()
+        state = self.state(self.exchange)
+        # The trades were flushed to the tape directory before the crash
+        self.exchange.trades["AAPL"].close()
+
+        exchange = Exchange(sink=NullSink(), tape_dir=tape_dir)
+        exchange.list_stock(Stock("AAPL"))
+        self.assertEqual(len(exchange.trades["AAPL"]), 1)
+        recovered = recover(self.journal_path, exchange=exchange, users=(self.john, self.jane))
+        self.assertEqual(self.state(recovered), state)
+        self.assertEqual(len(recovered.trades["AAPL"]), 1)
+        recovered.journal.close()
+        recovered.trades["AAPL"].close()
+
+    def test_recover_auction(self):
+        self.exchange.start_auction("AAPL")
+        self.exchange.execute(self.john, "SELL AAPL LMT $10 5")
+        self.exchange.execute(self.jane, "BUY AAPL LMT $11 3")
+        self.exchange.uncross("AAPL")
+        self.exchange.execute(self.jane, "BUY AAPL LMT $11 1")
+        self.exchange.journal.close()
+
+        recovered = recover(self.journal_path, exchange=self.new_exchange(), users=(self.john, self.jane))
+        self.assertEqual(self.state(recovered), self.state(self.exchange))
+        self.assertEqual(len(recovered.books["AAPL"].trades), 2)
+        recovered.journal.close()
+
+    def test_recover_batch_of_stops(self):
+        self.exchange.submit_batch([SellOrder(self.john, "AAPL", 10, 5), BuyOrder(self.jane, "AAPL", 9, 5),
+                                    StopOrder(self.jane, "AAPL", 11, 2, "BUY"),
+                                    StopOrder(self.john, "AAPL", 9, 3, "SELL", 8.5)])
+        self.exchange.journal.close()
+        records = [fields for _, fields in read_records(self.journal_path)]
+        self.assertEqual(records[3:], [["O", "Jane", "BUY AAPL STP $11 2"],
+                                       ["O", "John", "SELL AAPL STPLMT $9 $8.5 3"]])
+
+        recovered = recover(self.journal_path, exchange=self.new_exchange(), users=(self.john, self.jane))
+        self.assertEqual(self.state(recovered), self.state(self.exchange))
+        self.assertEqual([len(side) for side in recovered.books["AAPL"].stops], [1, 1])
+        recovered.journal.close()
+
+    def test_recover_batch_time_in_force(self):
+        orders = [SellOrder(self.john, "AAPL", 10, 5), BuyOrder(self.jane, "AAPL", 10, 8),
+                  SellOrder(self.john, "AAPL", 11, 5), BuyOrder(self.jane, "AAPL", 9, 5)]
+        orders[1].tif = "IOC"
+        orders[2].tif = "GTD"
+        orders[2].expires = 4102444800 * 10 ** 9 + 250000000
+        orders[3].tif = "DAY"
+        self.exchange.submit_batch(orders)
+        self.exchange.journal.close()
+        records = [fields for _, fields in read_records(self.journal_path)]
+        self.assertEqual([fields[2] for fields in records if fields[0] == "O"],
+                         ["SELL AAPL LMT $10 5", "BUY AAPL LMT $10 8 IOC",
+                          "SELL AAPL LMT $11 5 GTD 2100-01-01T00:00:00.250000", "BUY AAPL LMT $9 5 DAY"])
+
+        recovered = recover(self.journal_path, exchange=self.new_exchange(), users=(self.john, self.jane))
+        self.assertEqual(self.state(recovered), self.state(self.exchange))
+        self.assertEqual(recovered.orders[3].expires, orders[2].expires)
+        recovered.journal.close()
+
+    def test_invalid_batch_orders_are_not_journaled(self):
+        self.exchange.submit_batch([SellOrder(self.john, "AAPL", 10.005, 5), BuyOrder(self.jane, "MSFT", 10, 5),
+                                    SellOrder(self.john, "AAPL", 10, 5)])
+        self.exchange.journal.close()
+        records = [fields for _, fields in read_records(self.journal_path)]
+        self.assertEqual(records, [["B", str(self.now), "1"], ["O", "John", "SELL AAPL LMT $10 5"]])
+        recovered = recover(self.journal_path, exchange=self.new_exchange(), users=(self.john, self.jane))
+        self.assertEqual(self.state(recovered), self.state(self.exchange))
+        recovered.journal.close()
+
+    def test_recover_from_snapshot(self):
+        self.exchange.execute(self.john, "SELL AAPL LMT $10 5")
+        self.exchange.execute(self.jane, "BUY AAPL LMT $8 1")
+        save_snapshot(self.exchange, self.snapshot_path)
+        self.exchange.execute(self.jane, "BUY AAPL LMT $10 3")
+        self.exchange.execute(self.jane, "BUY AAPL LMT $9 1")
+        self.exchange.journal.close()
+
+        recovered = recover(self.journal_path, self.snapshot_path)
+        self.assertEqual(self.state(recovered), self.state(self.exchange))
+        self.assertEqual(len(recovered.books["AAPL"].trades), 1)
+
+        # New orders continue from the recovered sequence and are journaled
+        jane = recovered.user_ids.lookup(1)
+        recovered.execute(jane, "BUY AAPL LMT $10 2")
+        self.assertEqual(self.quote(recovered), (9, 0))
+        self.assertEqual(next(recovered.sequence), 6)
+        recovered.journal.close()
+        self.assertEqual(list(read_records(self.journal_path))[-2][1][2:], ["Jane", "BUY AAPL LMT $10 2"])
+
+    def test_periodic_snapshot(self):
+        self.exchange.journal = Journal(self.journal_path, snapshot_path=self.snapshot_path, snapshot_every=2)
+        self.exchange.execute(self.john, "SELL AAPL LMT $10 5")
+        self.assertFalse(os.path.exists(self.snapshot_path))
+        self.exchange.execute(self.jane, "BUY AAPL LMT $9 5")
+        offset, exchange = load_snapshot(self.snapshot_path)
+        self.assertEqual(offset, os.path.getsize(self.journal_path))
+        self.assertEqual(self.quote(exchange), (9, 10))
+
+    def test_torn_record(self):
+        self.exchange.execute(self.john, "SELL AAPL LMT $10 5")
+        self.exchange.journal.close()
+        size = os.path.getsize(self.journal_path)
+        with open(self.journal_path, "ab") as f:
+            f.write(b"C\t1\tJane\tBUY AAPL LMT $10 5")
+
+        recovered = recover(self.journal_path, exchange=self.new_exchange(), users=(self.john, self.jane))
+        self.assertEqual(self.quote(recovered), (0, 10))
+        self.assertEqual(os.path.getsize(self.journal_path), size)
+        recovered.journal.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
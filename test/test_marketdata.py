@@ -0,0 +1,82 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+@author: Desmond Tan
+"""
+import unittest
+
+from events import NullSink
+from exchange import *
+from marketdata import *
+from user import *
+
+
+class TestMarketDataPublisher(unittest.TestCase):
+    def setUp(self) -> None:
+        self.publisher = MarketDataPublisher(depth=2)
+        self.exchange = Exchange(sink=NullSink(), market_data=self.publisher)
+        self.exchange.list_stock(Stock("AAPL"))
+        self.exchange.list_stock(Stock("MSFT"))
+        self.john = Admin("John", self.exchange)
+        self.jane = Admin("Jane", self.exchange)
+        self.subscription = self.publisher.subscribe()
+
+    def test_deltas(self):
+        self.exchange.execute(self.john, "SELL AAPL LMT $10 5")
+        self.assertEqual(self.subscription.poll(), [
+            DepthUpdate("AAPL", 1, "ASK", 10, 5),
+            TopOfBook("AAPL", 2, 0, 0, 10, 5, 0),
+        ])
+        self.exchange.execute(self.john, "SELL AAPL LMT $11 5")
+        self.assertEqual(self.subscription.poll(), [DepthUpdate("AAPL", 3, "ASK", 11, 5)])
+        self.exchange.execute(self.jane, "BUY AAPL MKT 5")
+        self.assertEqual(self.subscription.poll(), [
+            DepthUpdate("AAPL", 4, "ASK", 10, 0),
+            TopOfBook("AAPL", 5, 0, 0, 11, 5, 10),
+        ])
+
+    def test_no_update_without_change(self):
+        self.exchange.execute(self.john, "SELL AAPL LMT $10 5")
+        self.subscription.poll()
+        self.exchange.execute(self.jane, "QUOTE AAPL")
+        self.exchange.execute(self.jane, "BUY AAPL LMT $5 1")
+        self.exchange.execute(self.jane, "CANCEL 2")
+        self.assertEqual([type(message) for message in self.subscription.poll()],
+                         [DepthUpdate, TopOfBook, DepthUpdate, TopOfBook])
+        # Only the top 2 levels are published
+        self.exchange.execute(self.john, "SELL AAPL LMT $12 5")
+        self.exchange.execute(self.john, "SELL AAPL LMT $13 5")
+        self.subscription.poll()
+        self.exchange.execute(self.john, "SELL AAPL LMT $14 5")
+        self.assertEqual(self.subscription.poll(), [])
+
+    def test_snapshots(self):
+        self.publisher.snapshot_interval = 2
+        self.exchange.execute(self.john, "SELL AAPL LMT $10 5")
+        self.exchange.execute(self.jane, "BUY AAPL LMT $9 3")
+        messages = self.subscription.poll()
+        self.assertEqual(messages[-1], Snapshot("AAPL", 4, TopOfBook("AAPL", 4, 9, 3, 10, 5, 0), ((9, 3),), ((10, 5),)))
+
+        late = self.publisher.subscribe(tickers=["AAPL"])
+        self.assertEqual(late.poll(), [messages[-1]])
+
+    def test_conflation(self):
+        conflated = self.publisher.subscribe(tickers=["AAPL"], conflate=True)
+        self.exchange.execute(self.john, "SELL AAPL LMT $10 5")
+        self.exchange.execute(self.john, "SELL MSFT LMT $10 5")
+        self.exchange.execute(self.jane, "BUY AAPL MKT 2")
+        self.exchange.execute(self.jane, "BUY AAPL MKT 1")
+        self.assertEqual(conflated.poll(), [
+            DepthUpdate("AAPL", 5, "ASK", 10, 2),
+            TopOfBook("AAPL", 6, 0, 0, 10, 2, 10),
+        ])
+
+    def test_batch_publishes_once(self):
+        received = []
+        self.publisher.subscribe(callback=received.append)
+        self.exchange.submit_batch([SellOrder(self.john, "AAPL", 10, 5), BuyOrder(self.jane, "AAPL", 10, 5)])
+        self.assertEqual(received, [TopOfBook("AAPL", 1, 0, 0, 0, 0, 10)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+@author: Desmond Tan
+"""
+import json
+import random
+import unittest
+
+from events import NullSink
+from exchange import Exchange, Stock
+from metrics import *
+from user import Admin
+
+
+class TestLatencyHistogram(unittest.TestCase):
+    def test_small_values_are_exact(self):
+        histogram = LatencyHistogram()
+        for value in range(1, 51):
+            histogram.record(value)
+        self.assertEqual(histogram.percentile(50), 25)
+        self.assertEqual(histogram.percentile(100), 50)
+        self.assertEqual(histogram.min, 1)
+        self.assertEqual(histogram.mean(), 25.5)
+
+    def test_percentile_accuracy(self):
+        histogram = LatencyHistogram()
+        rng = random.Random(0)
+        values = sorted(int(rng.lognormvariate(10, 1)) for _ in range(10000))
+        for value in values:
+            histogram.record(value)
+        for percent in (50, 99, 99.9):
+            exact = values[int(percent / 100 * len(values)) - 1]
+            self.assertAlmostEqual(histogram.percentile(percent) / exact, 1, delta=0.04)
+        self.assertEqual(histogram.percentile(100), values[-1])
+
+    def test_buckets_are_monotonic(self):
+        histogram = LatencyHistogram()
+        indices = [histogram.index(value) for value in range(1, 1 << 16)]
+        self.assertEqual(indices, sorted(indices))
+        for value in (1, 100, 12345, 1 << 40):
+            self.assertGreaterEqual(histogram.value(histogram.index(value)), value)
+
+    def test_merge(self):
+        first, second = LatencyHistogram(), LatencyHistogram()
+        first.record(10)
+        second.record(1000)
+        first.merge(second)
+        self.assertEqual(first.count, 2)
+        self.assertEqual((first.min, first.max), (10, 1000))
+        self.assertRaises(Exception, first.merge, LatencyHistogram(precision=3))
+
+    def test_empty(self):
+        self.assertEqual(LatencyHistogram().percentile(99), 0)
+
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self) -> None:
+        self.metrics = Metrics()
+        self.exchange = Exchange(sink=NullSink(), metrics=self.metrics)
+        self.exchange.list_stock(Stock("AAPL"))
+        self.exchange.list_stock(Stock("MSFT"))
+        self.user = Admin("John", self.exchange)
+
+    def test_exchange_records(self):
+        for action in ("SELL AAPL LMT $10 5", "SELL AAPL LMT $11 5", "BUY AAPL LMT $11 7",
+                       "BUY MSFT MKT 3", "BUY MSFT LMT $9 1", "QUOTE AAPL"):
+            self.exchange.execute(self.user, action)
+        latency = self.metrics.latency
+        self.assertEqual(latency['parse'].count, 6)
+        self.assertEqual((latency['verify'].count, latency['match'].count), (5, 5))
+        self.assertEqual(latency['settle'].count, 2)
+        self.assertEqual(self.metrics.orders, {"AAPL": 3, "MSFT": 2})
+        self.assertEqual(self.metrics.fills, {"AAPL": 2, "MSFT": 0})
+        self.assertEqual(self.metrics.fills_per_order.max, 2)
+        self.assertEqual(self.metrics.gauges("AAPL"), {'bids': 0, 'asks': 1, 'market_bids': 0, 'market_asks': 0})
+        self.assertEqual(self.metrics.gauges("MSFT"), {'bids': 1, 'asks': 0, 'market_bids': 1, 'market_asks': 0})
+        self.assertEqual(self.metrics.hot_tickers(1), [("AAPL", 3)])
+
+    def test_exporters(self):
+        self.exchange.execute(self.user, "SELL AAPL LMT $10 5")
+        self.exchange.execute(self.user, "BUY AAPL LMT $10 5")
+        exported = json.loads(self.metrics.to_json())
+        self.assertEqual(exported['latency']['match']['count'], 2)
+        self.assertEqual(exported['tickers']['AAPL']['fills'], 1)
+        text = self.metrics.to_text()
+        self.assertIn('exchange_latency_ns_count{stage="settle"} 1\n', text)
+        self.assertIn('exchange_orders_total{ticker="AAPL"} 2\n', text)
+        self.assertIn('exchange_book_orders{ticker="MSFT",side="bids"} 0\n', text)
+
+    def test_no_metrics(self):
+        exchange = Exchange(sink=NullSink())
+        exchange.list_stock(Stock("AAPL"))
+        exchange.execute(Admin("Jane", exchange), "BUY AAPL LMT $10 5")
+        self.assertIsNone(exchange.metrics)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,274 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+@author: Desmond Tan
+"""
+from io import StringIO
+import random
+import unittest
+from unittest.mock import patch
+
+from events import NullSink
+from exchange import *
+from orderbook import *
+from orders import *
+from user import *
+
+
+class TestBookSide(unittest.TestCase):
+    def setUp(self) -> None:
+        self.exchange = Exchange()
+        self.user = Admin("John", self.exchange)
+        self.stock = Stock("AAPL")
+
+    def accepted(self, order):
+        order.ticks = self.stock.to_ticks(order.price)
+        return order
+
+    def test_empty_side(self):
+        side = BookSide(BUY)
+        self.assertEqual(len(side), 0)
+        self.assertIsNone(side.peek())
+        self.assertIsNone(side.best_level())
+        with self.assertRaises(IndexError):
+            side[0]
+
+    def test_best_bid_is_highest_price(self):
+        side = BookSide(BUY)
+        side.push(self.accepted(BuyOrder(self.user, "AAPL", 10, 10)))
+        side.push(self.accepted(BuyOrder(self.user, "AAPL", 12, 10)))
+        side.push(self.accepted(BuyOrder(self.user, "AAPL", 11, 10)))
+        self.assertEqual(len(side), 3)
+        self.assertEqual(side[0].price, 12)
+        self.assertEqual(len(side.levels), 3)
+
+    def test_best_ask_is_lowest_price(self):
+        side = BookSide(SELL)
+        side.push(self.accepted(SellOrder(self.user, "AAPL", 12, 10)))
+        side.push(self.accepted(SellOrder(self.user, "AAPL", 10, 10)))
+        self.assertEqual(side[0].price, 10)
+
+    def test_same_price_shares_level(self):
+        side = BookSide(SELL)
+        order1 = self.accepted(SellOrder(self.user, "AAPL", 10, 10))
+        order2 = self.accepted(SellOrder(self.user, "AAPL", 10, 5))
+        side.push(order1)
+        side.push(order2)
+        self.assertEqual(len(side.levels), 1)
+        self.assertEqual(list(side.best_level().orders), [order1, order2])
+
+    def test_iterate_in_priority_order(self):
+        side = BookSide(BUY)
+        order1 = self.accepted(BuyOrder(self.user, "AAPL", 10, 10))
+        order2 = self.accepted(BuyOrder(self.user, "AAPL", 11, 10))
+        order3 = self.accepted(BuyOrder(self.user, "AAPL", 10, 10))
+        for order in (order1, order2, order3):
+            side.push(order)
+        self.assertEqual(list(side), [order2, order1, order3])
+
+
+class TestOrderQueue(unittest.TestCase):
+    def setUp(self) -> None:
+        self.exchange = Exchange()
+        self.user = Admin("John", self.exchange)
+
+    def test_queue_in_arrival_order(self):
+        queue = OrderQueue()
+        orders = [MarketOrder(self.user, "AAPL", 1, "BUY") for _ in range(3)]
+        for order in orders:
+            queue.append(order)
+        self.assertEqual(len(queue), 3)
+        queue.pop()
+        self.assertEqual(queue[0], orders[1])
+        self.assertEqual(list(queue), orders[1:])
+
+    def test_cancel_front_of_queue(self):
+        queue = OrderQueue()
+        orders = [MarketOrder(self.user, "AAPL", 1, "BUY") for _ in range(3)]
+        for order in orders:
+            queue.append(order)
+        queue.cancel(orders[0])
+        queue.cancel(orders[2])
+        self.assertEqual(len(queue), 1)
+        self.assertEqual(queue.peek(), orders[1])
+        self.assertEqual(queue.tombstones, 1)
+
+
+class TestMatchingEngine(unittest.TestCase):
+    def setUp(self) -> None:
+        self.exchange = Exchange()
+        self.exchange.list_stock(Stock("AAPL"))
+
+    def test_sweep_large_book(self):
+        seller = Admin("Jane", self.exchange)
+        for i in range(100000):
+            self.exchange.resolve_order(SellOrder(seller, "AAPL", 10 + i % 50, 1))
+        buyer = Admin("John", self.exchange)
+        order = MarketOrder(buyer, "AAPL", 100000, "BUY")
+        self.exchange.resolve_order(order)
+        self.assertTrue(order.is_filled())
+        self.assertEqual(len(self.exchange.limit_orders["AAPL"][SELL]), 0)
+        self.assertEqual(len(self.exchange.trades["AAPL"]), 100000)
+        self.assertEqual(self.exchange.get_last_price("AAPL"), 59)
+
+    def test_limit_order_stops_at_limit_price(self):
+        seller = Admin("Jane", self.exchange)
+        buyer = Admin("John", self.exchange)
+        for price in (10, 11, 12):
+            self.exchange.resolve_order(SellOrder(seller, "AAPL", price, 5))
+        order = BuyOrder(buyer, "AAPL", 11, 20)
+        self.exchange.resolve_order(order)
+        self.assertEqual(order.filled, 10)
+        bid, ask = self.exchange.get_bid_ask("AAPL")
+        self.assertEqual(bid, order)
+        self.assertEqual(ask.price, 12)
+        self.assertEqual([trade.price for trade in self.exchange.trades["AAPL"]], [10, 11])
+
+    def test_cancel_skips_tombstones(self):
+        exchange = self.exchange
+        seller = Admin("Jane", exchange)
+        orders = [SellOrder(seller, "AAPL", 10, 1) for _ in range(3)]
+        for order in orders:
+            exchange.place_limit_order(order)
+        exchange.cancel_order(seller, orders[1].id)
+        buy = MarketOrder(Admin("John", exchange), "AAPL", 2, "BUY")
+        exchange.resolve_order(buy)
+        self.assertTrue(orders[0].is_filled())
+        self.assertEqual(orders[1].filled, 0)
+        self.assertTrue(orders[2].is_filled())
+        self.assertEqual(exchange.limit_orders["AAPL"][SELL].tombstones, 0)
+
+    def test_cancel_compacts_book(self):
+        seller = Admin("Jane", self.exchange)
+        side = self.exchange.limit_orders["AAPL"][SELL]
+        orders = [SellOrder(seller, "AAPL", 10 + i, 1) for i in range(200)]
+        for order in orders:
+            self.exchange.place_limit_order(order)
+        for order in orders[1:101]:
+            self.exchange.cancel_order(seller, order.id)
+        self.assertEqual(len(side), 100)
+        self.assertEqual(side.tombstones, 100)
+        self.exchange.cancel_order(seller, orders[101].id)
+        self.assertEqual(side.tombstones, 0)
+        self.assertEqual(len(side.levels), 99)
+        self.assertEqual(side[0], orders[0])
+
+    def test_drain_market_backlog(self):
+        buyer = Admin("John", self.exchange)
+        orders = [MarketOrder(buyer, "AAPL", 1, "BUY") for _ in range(50000)]
+        for order in orders:
+            self.exchange.resolve_order(order)
+        self.exchange.cancel_order(buyer, orders[10].id)
+        sell = SellOrder(Admin("Jane", self.exchange), "AAPL", 10, 49990)
+        self.exchange.resolve_order(sell)
+        self.assertTrue(sell.is_filled())
+        self.assertEqual(orders[10].filled, 0)
+        self.assertEqual(len(self.exchange.market_orders["AAPL"][BUY]), 9)
+        self.assertEqual(self.exchange.market_orders["AAPL"][BUY][0], orders[49991])
+
+    def test_trigger_only_crossed_stops(self):
+        user = Admin("John", self.exchange)
+        book = self.exchange.books["AAPL"]
+        stops = [StopOrder(user, "AAPL", (1000 + i) / 100, 1, "BUY") for i in range(100000)]
+        stops += [StopOrder(user, "AAPL", 9, 1, "SELL"), StopOrder(user, "AAPL", 8, 1, "SELL")]
+        for stop in stops:
+            self.exchange.accept_order(stop)
+            book.stops[BUY if stop.direction == "BUY" else SELL].push(stop)
+        book.cancel(stops[1])
+        self.assertEqual(book.triggered_stops(1003), [stops[0], stops[2], stops[3]])
+        self.assertEqual((book.stops[BUY].size, book.stops[BUY].tombstones), (99996, 0))
+        self.assertEqual(len(book.stops[BUY].levels), 99996)
+        self.assertEqual(book.triggered_stops(900), [stops[-2]])
+        self.assertEqual(book.stops[SELL].size, 1)
+
+
+class TestLadderSide(unittest.TestCase):
+    def setUp(self) -> None:
+        self.exchange = Exchange()
+        self.exchange.list_stock(Stock("AAPL", min_price=1, max_price=100), ladder=True)
+        self.user = Admin("John", self.exchange)
+
+    def test_ladder_selected(self):
+        self.assertIsInstance(self.exchange.limit_orders["AAPL"][BUY], LadderSide)
+        with self.assertRaises(Exception):
+            self.exchange.list_stock(Stock("MSFT"), ladder=True)
+
+    def test_best_level_cursor(self):
+        side = self.exchange.limit_orders["AAPL"][BUY]
+        orders = [BuyOrder(self.user, "AAPL", price, 10) for price in (10, 12, 11)]
+        for order in orders:
+            self.exchange.place_limit_order(order)
+        self.assertEqual(side[0], orders[1])
+        self.exchange.cancel_order(self.user, orders[1].id)
+        self.assertEqual(side[0], orders[2])
+        self.exchange.cancel_order(self.user, orders[2].id)
+        self.exchange.cancel_order(self.user, orders[0].id)
+        self.assertIsNone(side.peek())
+        self.assertEqual(len(side), 0)
+
+    def test_price_outside_band(self):
+        with patch('sys.stdout', new=StringIO()) as fake_out:
+            self.exchange.execute(self.user, "BUY AAPL LMT $101 10")
+            self.assertEqual(fake_out.getvalue(), "Invalid price for AAPL.\n")
+        with self.assertRaises(Exception):
+            self.exchange.place_limit_order(BuyOrder(self.user, "AAPL", 0.5, 10))
+
+    def test_depth(self):
+        for price, quantity in ((10, 5), (10, 5), (9.5, 3), (9, 1), (8, 2)):
+            self.exchange.place_limit_order(BuyOrder(self.user, "AAPL", price, quantity))
+        self.exchange.place_limit_order(SellOrder(self.user, "AAPL", 11, 7))
+        (bid_ticks, bid_quantities), (ask_ticks, ask_quantities) = self.exchange.books["AAPL"].depth(3)
+        self.assertEqual(list(bid_ticks), [1000, 950, 900])
+        self.assertEqual(list(bid_quantities), [10, 3, 1])
+        self.assertEqual(list(ask_ticks), [1100])
+        self.assertEqual(list(ask_quantities), [7])
+
+    def test_same_trades_as_book_side(self):
+        random.seed(1)
+        actions = []
+        for _ in range(2000):
+            direction = random.choice(["BUY", "SELL"])
+            if random.random() < 0.1:
+                actions.append(f"{direction} AAPL MKT {random.randint(1, 50)}")
+            elif random.random() < 0.2:
+                actions.append(f"CANCEL {random.randint(1, len(actions) + 1)}")
+            else:
+                actions.append(f"{direction} AAPL LMT ${random.randint(40, 60) / 2} {random.randint(1, 50)}")
+
+        results = []
+        for ladder in (False, True):
+            exchange = Exchange(sink=NullSink())
+            exchange.list_stock(Stock("AAPL", min_price=1, max_price=100), ladder=ladder)
+            user = Admin("John", exchange)
+            for action in actions:
+                exchange.execute(user, action)
+            bid, ask = exchange.get_bid_ask("AAPL")
+            results.append(([(trade.ticks, trade.quantity) for trade in exchange.trades["AAPL"]],
+                            bid.id, ask.id, exchange.books["AAPL"].depth(10)))
+        self.assertEqual(results[0], results[1])
+
+    def test_level_quantities(self):
+        random.seed(2)
+        actions = []
+        for _ in range(2000):
+            direction = random.choice(["BUY", "SELL"])
+            if random.random() < 0.1:
+                actions.append(f"{direction} AAPL MKT {random.randint(1, 50)}")
+            elif random.random() < 0.2:
+                actions.append(f"CANCEL {random.randint(1, len(actions) + 1)}")
+            elif random.random() < 0.2:
+                actions.append(f"AMEND {random.randint(1, len(actions) + 1)} {random.randint(1, 50)}")
+            else:
+                actions.append(f"{direction} AAPL LMT ${random.randint(40, 60) / 2} {random.randint(1, 50)}")
+
+        for ladder in (False, True):
+            exchange = Exchange(sink=NullSink())
+            exchange.list_stock(Stock("AAPL", min_price=1, max_price=100), ladder=ladder)
+            user = Admin("John", exchange)
+            for action in actions:
+                exchange.execute(user, action)
+            for side in exchange.books["AAPL"].limit_orders:
+                levels = side.levels if ladder else side.levels.values()
+                for level in levels:
+                    self.assertEqual(level.open_quantity(), sum(order.quantity - order.filled
+                                                                for order in level.orders if not order.cancelled))
@@ -14,16 +14,6 @@ class TestOrders(unittest.TestCase):
     def setUp(self) -> None:
         self.exchange = Exchange()
 
-    def test_compare_buy_orders(self):
-        order1 = BuyOrder(Admin("John", self.exchange), "AAPL", 10, 10)
-        order2 = BuyOrder(Admin("John", self.exchange), "AAPL", 11, 10)
-        self.assertLess(order2, order1)
-    
-    def test_compare_sell_orders(self):
-        order1 = SellOrder(Admin("John", self.exchange), "AAPL", 12, 10)
-        order2 = SellOrder(Admin("John", self.exchange), "AAPL", 13, 10)
-        self.assertLess(order1, order2)
-
     def test_market_order(self):
         user = Admin("John", self.exchange)
         order = MarketOrder(user, "AAPL", 10, "BUY")
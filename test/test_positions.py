@@ -0,0 +1,127 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+@author: Desmond Tan
+"""
+import unittest
+
+from events import NullSink
+from exchange import *
+from positions import *
+from user import *
+from ticks import to_units
+
+
+class TestPosition(unittest.TestCase):
+    def test_long(self):
+        position = Position(100)
+        position.fill(10, 100)
+        position.fill(10, 200)
+        self.assertEqual((position.quantity, position.cost), (20, 3000))
+        position.fill(-5, 300)
+        self.assertEqual((position.quantity, position.cost, position.realized), (15, 2250, 750))
+        position.mark = 300
+        self.assertEqual(position.unrealized(), 15 * 300 - 2250)
+
+    def test_short_and_flip(self):
+        position = Position(100)
+        position.fill(-10, 100)
+        self.assertEqual((position.quantity, position.cost), (-10, -1000))
+        position.fill(4, 90)
+        self.assertEqual((position.quantity, position.cost, position.realized), (-6, -600, 40))
+        position.fill(10, 80)
+        self.assertEqual((position.quantity, position.cost, position.realized), (4, 320, 160))
+
+
+class TestPositionTracking(unittest.TestCase):
+    def setUp(self) -> None:
+        # Wide enough for the market orders below to move the last price
+        self.exchange = Exchange(sink=NullSink(), market_collar=1)
+        self.exchange.list_stock(Stock("AAPL"))
+        self.exchange.list_stock(Stock("MSFT"))
+        self.john = User("John", self.exchange)
+        self.jane = User("Jane", self.exchange)
+        self.admin = Admin("Admin", self.exchange)
+        self.john.deposit(1000)
+        self.jane.deposit(1000)
+
+    def test_pnl_and_net_worth(self):
+        self.exchange.execute(self.admin, "SELL AAPL LMT $10 10")
+        self.exchange.execute(self.john, "BUY AAPL LMT $10 10")
+        self.assertEqual(self.john.get_net_worth(), 1000)
+        self.assertEqual(self.john.positions["AAPL"].average_cost(), 10)
+
+        # A trade between other users moves the last price
+        self.exchange.execute(self.admin, "SELL AAPL LMT $12 1")
+        self.exchange.execute(self.jane, "BUY AAPL MKT 1")
+        self.assertEqual(self.john.get_net_worth(), 1020)
+        self.assertEqual(self.john.get_pnl(), (0, 20))
+
+        self.exchange.execute(self.john, "SELL AAPL LMT $11 5")
+        self.exchange.execute(self.jane, "BUY AAPL LMT $11 5")
+        self.assertEqual(self.john.get_pnl(), (5, 5))
+        self.assertEqual(self.john.get_net_worth(), 900 + 55 + 55)
+        self.assertEqual(self.jane.get_net_worth(), 1000 - 12 - 55 + 6 * 11)
+
+    def test_marked_when_read(self):
+        self.exchange.execute(self.admin, "SELL AAPL LMT $10 10")
+        self.exchange.execute(self.john, "BUY AAPL LMT $10 10")
+        self.exchange.execute(self.admin, "SELL AAPL LMT $12 1")
+        self.exchange.execute(self.jane, "BUY AAPL MKT 1")
+        # The trade between other users does not revalue the position of John until it is read
+        self.assertEqual(self.john.positions["AAPL"].mark, to_units(10))
+        self.assertEqual(self.exchange.get_leaderboard(1), [(self.john, 1020)])
+        self.assertEqual(self.john.positions["AAPL"].mark, to_units(12))
+
+    def test_reopened_position(self):
+        self.exchange.execute(self.admin, "SELL AAPL LMT $10 10")
+        self.exchange.execute(self.john, "BUY AAPL LMT $10 10")
+        self.exchange.execute(self.admin, "BUY AAPL LMT $12 10")
+        self.exchange.execute(self.john, "SELL AAPL LMT $12 10")
+        self.exchange.execute(self.admin, "SELL AAPL LMT $12 5")
+        # The closed position is reopened at the unchanged last price
+        self.exchange.execute(self.john, "BUY AAPL LMT $12 5")
+        self.assertEqual(self.john.get_net_worth(), 1020)
+        self.assertEqual(self.john.get_pnl(), (20, 0))
+
+    def test_added_stock(self):
+        self.exchange.execute(self.admin, "SELL AAPL LMT $10 1")
+        self.exchange.execute(self.admin, "BUY AAPL LMT $10 1")
+        self.jane.add_stock("AAPL", 90)
+        self.assertEqual(self.jane.get_net_worth(), 1000 + 900)
+        self.exchange.execute(self.admin, "BUY AAPL LMT $10 10")
+        self.exchange.execute(self.jane, "SELL AAPL LMT $10 10")
+        self.assertEqual(self.jane.positions["AAPL"].quantity, 80)
+        self.assertEqual(self.jane.get_pnl(), (0, 0))
+        # Shares added before the first trade are valued at the best bid, then at the last price
+        self.john.add_stock("MSFT", 10)
+        self.assertEqual(self.john.get_net_worth(), 1000)
+        self.exchange.execute(self.admin, "BUY MSFT LMT $20 5")
+        self.john.add_stock("MSFT", 10)
+        self.assertEqual(self.john.get_net_worth(), 1000 + 20 * 20)
+        self.exchange.execute(self.admin, "BUY MSFT LMT $15 1")
+        self.exchange.execute(self.admin, "SELL MSFT LMT $15 6")
+        self.assertEqual(self.john.get_net_worth(), 1000 + 20 * 15)
+
+    def test_net_worth_matches_portfolio(self):
+        for ticker, price in (("AAPL", 10), ("MSFT", 20)):
+            self.exchange.execute(self.admin, f"SELL {ticker} LMT ${price} 100")
+            self.exchange.execute(self.john, f"BUY {ticker} LMT ${price} 5")
+        self.exchange.execute(self.jane, "BUY MSFT LMT $25 10")
+        self.exchange.execute(self.admin, "SELL MSFT LMT $25 1")
+        expected = self.john.cash + sum(quantity * self.exchange.get_last_price(ticker)
+                                        for ticker, quantity in self.john.portfolio.items())
+        self.assertEqual(self.john.get_net_worth(), expected)
+
+    def test_leaderboard(self):
+        self.exchange.execute(self.admin, "SELL AAPL LMT $10 10")
+        self.exchange.execute(self.john, "BUY AAPL LMT $10 10")
+        self.exchange.execute(self.admin, "SELL AAPL LMT $20 1")
+        self.exchange.execute(self.jane, "BUY AAPL MKT 1")
+        self.assertEqual([(user.name, worth) for user, worth in self.exchange.get_leaderboard()],
+                         [("John", 1100), ("Jane", 1000), ("Admin", -100)])
+        self.assertEqual(self.exchange.get_leaderboard(1)[0][0], self.john)
+
+
+if __name__ == '__main__':
+    unittest.main()
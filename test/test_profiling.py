@@ -0,0 +1,69 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+@author: Desmond Tan
+"""
+import os
+import tempfile
+import time
+import unittest
+from io import StringIO
+from unittest.mock import patch
+
+from events import NullSink
+from exchange import Exchange, Stock
+from profiling import *
+from user import Admin, User
+
+
+class TestProfiling(unittest.TestCase):
+    def test_scoped_functions(self):
+        keys = scoped_functions(User, 'verify_order')
+        self.assertEqual([key[0].rsplit('/', 1)[-1] for key in keys], ['user.py', 'user.py'])
+        self.assertEqual(len(scoped_functions(Exchange, 'resolve_order')), 1)
+
+    def test_qualified_name(self):
+        def run():
+            pass
+
+        # The lookup used before Python 3.11, where code objects have no co_qualname
+        self.assertEqual(lookup_qualified_name(Exchange.resolve_order.__code__), 'Exchange.resolve_order')
+        self.assertEqual(lookup_qualified_name(run.__code__),
+                         'TestProfiling.test_qualified_name.<locals>.run')
+        self.assertEqual(frame_name(User.verify_order.__code__), 'user.User.verify_order')
+
+    def test_profile(self):
+        def run():
+            exchange = Exchange(sink=NullSink())
+            exchange.list_stock(Stock("AAPL"))
+            user = Admin("John", exchange)
+            for _ in range(200):
+                exchange.execute(user, "SELL AAPL LMT $10 1")
+                exchange.execute(user, "BUY AAPL LMT $10 1")
+            time.sleep(0.05)
+            return exchange
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            prefix = os.path.join(temp_dir, 'run')
+            with patch('sys.stderr', new=StringIO()):
+                exchange = profile(run, prefix)
+            self.assertEqual(len(exchange.trades["AAPL"]), 200)
+            with open(f"{prefix}.txt") as f:
+                report = f.read()
+            for scope in ('Exchange.resolve_order', 'Order.fill', 'User.verify_order', 'Exchange.execute'):
+                self.assertIn(f"=== {scope} ===", report)
+            self.assertIn("(resolve_order): 400 calls", report)
+            self.assertIn("(verify_order): 400 calls", report)
+            with open(f"{prefix}.folded") as f:
+                lines = f.read().splitlines()
+            self.assertTrue(lines)
+            stacks = [line.rsplit(' ', 1) for line in lines]
+            self.assertTrue(all(count.isdigit() for _, count in stacks))
+            # Mostly sleeping in run(), which is the innermost Python frame
+            self.assertTrue(any(stack.endswith('test_profiling.TestProfiling.test_profile.<locals>.run')
+                                for stack, _ in stacks))
+            self.assertTrue(os.path.exists(f"{prefix}.prof"))
+
+
+if __name__ == '__main__':
+    unittest.main()
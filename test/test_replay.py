@@ -0,0 +1,71 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+@author: Desmond Tan
+"""
+import os
+import tempfile
+import unittest
+
+from events import NullSink
+from exchange import *
+from metrics import LatencyHistogram
+from replay import *
+from reports import write_prices, write_trades
+
+
+LOG = [
+    "John Smith: SELL AAPL LMT $10 5",
+    "Jane: SELL AAPL LMT $10 5",
+    "Jack: BUY MSFT LMT $20 1",
+    "Jill: BUY AAPL MKT 7",
+    "Jane: AMEND 2 3",
+    "Jill: BUY AAPL LMT $10.5 2",
+    "",
+]
+
+
+class TestReplay(unittest.TestCase):
+    def run_log(self, batch_size=0):
+        exchange = Exchange(sink=NullSink())
+        exchange.list_stock(Stock("AAPL"))
+        histogram = LatencyHistogram()
+        replayed = replay(LOG, exchange, batch_size, histogram)
+        return exchange, replayed, histogram
+
+    def test_replay(self):
+        exchange, replayed, histogram = self.run_log()
+        self.assertEqual(replayed, 6)
+        self.assertEqual(histogram.count, 6)
+        self.assertEqual(list(exchange.stocks), ["AAPL", "MSFT"])
+        trades = [str(trade) for trade in exchange.trades["AAPL"]]
+        self.assertEqual(trades, [
+            "Jill bought 5 shares from John Smith at $10.00 each.",
+            "Jill bought 2 shares from Jane at $10.00 each.",
+            "Jill bought 1 shares from Jane at $10.00 each.",
+        ])
+        self.assertEqual(exchange.get_bid_ask("AAPL")[0].price, 10.5)
+        # Replayed orders are not kept by their users
+        self.assertTrue(all(not user.orders for user in exchange.user_ids.objects))
+
+    def test_batch_replay_matches(self):
+        exchange, _, _ = self.run_log()
+        batched, replayed, histogram = self.run_log(batch_size=2)
+        self.assertEqual(replayed, 6)
+        self.assertEqual(histogram.count, 6)
+        self.assertEqual([str(trade) for trade in batched.trades["AAPL"]],
+                         [str(trade) for trade in exchange.trades["AAPL"]])
+
+    def test_compare_reports(self):
+        exchange, _, _ = self.run_log()
+        with tempfile.TemporaryDirectory() as output_dir, tempfile.TemporaryDirectory() as golden_dir:
+            for directory in (output_dir, golden_dir):
+                write_trades(exchange, os.path.join(directory, "trades.txt"), ["AAPL", "MSFT"])
+                write_prices(exchange, os.path.join(directory, "prices.txt"), ["AAPL", "MSFT"])
+            self.assertEqual(compare_reports(output_dir, golden_dir), [])
+            write_prices(exchange, os.path.join(golden_dir, "prices.txt"), ["AAPL"])
+            self.assertEqual(compare_reports(output_dir, golden_dir), ["prices.txt"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+@author: Desmond Tan
+"""
+import random
+import unittest
+
+from events import EventSink, NullSink
+from exchange import *
+from sharding import *
+from user import *
+
+
+class TradeSink(EventSink):
+    def __init__(self):
+        self.trades = []
+        self.messages = []
+
+    def trade(self, trade):
+        self.trades.append(str(trade))
+
+    def status(self, message):
+        self.messages.append(message)
+
+
+class TestShardedExchange(unittest.TestCase):
+    def setUp(self) -> None:
+        self.sink = TradeSink()
+        self.exchange = ShardedExchange([Stock(ticker) for ticker in ("AAPL", "MSFT", "GOOG")], shards=2,
+                                        sink=self.sink, batch_size=4)
+        self.addCleanup(self.exchange.close)
+        self.john = User("John", self.exchange)
+        self.john.deposit(10000)
+        self.jane = Admin("Jane", self.exchange)
+
+    def test_settlement(self):
+        self.exchange.execute(self.jane, "SELL AAPL LMT $10 50")
+        self.exchange.execute(self.john, "BUY AAPL LMT $10 20")
+        self.exchange.execute(self.john, "BUY MSFT MKT 5")
+        self.exchange.sync()
+        self.assertEqual(self.sink.trades, ["John bought 20 shares from Jane at $10.00 each."])
+        self.assertEqual(self.john.balance, to_units(9800))
+        self.assertEqual(self.john.portfolio, {"AAPL": 20})
+        self.assertEqual(self.exchange.get_last_price("AAPL"), 10)
+        self.assertEqual(self.exchange.orders[1].filled, 20)
+        self.assertNotIn(2, self.exchange.orders)
+
+    def test_cancel_and_amend(self):
+        self.exchange.execute(self.jane, "SELL AAPL LMT $10 50")
+        self.exchange.execute(self.john, "BUY AAPL LMT $9 5")
+        self.exchange.execute(self.john, "CANCEL 1")
+        self.exchange.execute(self.jane, "AMEND 1 40")
+        self.exchange.execute(self.john, "AMEND 2 $10 10")
+        self.exchange.sync()
+        self.assertIn("Order 1 is not an open order.", self.sink.messages)
+        self.assertIn("Order 2 has been replaced by order 3.", self.sink.messages)
+        self.assertEqual(self.exchange.orders[1].quantity, 40)
+        self.assertEqual(self.exchange.orders[1].filled, 10)
+        self.assertEqual(self.john.orders[0].get_status(), "CANCELLED")
+        self.assertEqual(self.john.orders[1].get_status(), "FILLED")
+
+        self.exchange.execute(self.jane, "CANCEL 1")
+        self.exchange.sync()
+        self.assertEqual(self.exchange.orders, {})
+
+    def test_time_in_force(self):
+        self.exchange.execute(self.jane, "SELL AAPL LMT $10 5")
+        self.exchange.execute(self.john, "BUY AAPL LMT $10 8 IOC")
+        self.exchange.execute(self.john, "BUY AAPL LMT $10 8 FOK")
+        self.exchange.sync()
+        self.assertEqual([order.get_status() for order in self.john.orders], ["CANCELLED", "CANCELLED"])
+        self.assertEqual(self.john.orders[0].filled, 5)
+        self.assertEqual(self.john.balance, to_units(9950))
+        self.assertEqual(self.john.reserved, 0)
+        self.assertEqual(self.exchange.orders, {})
+
+    def test_same_trades_as_exchange(self):
+        tickers = ["AAPL", "MSFT", "GOOG"]
+        exchange = Exchange(sink=NullSink())
+        for ticker in tickers:
+            exchange.list_stock(Stock(ticker))
+        single = TradeSink()
+        exchange.sink = single
+        users = [Admin(f"user{i}", exchange) for i in range(5)]
+        sharded_users = [Admin(f"user{i}", self.exchange) for i in range(5)]
+
+        rng = random.Random(0)
+        for _ in range(2000):
+            index = rng.randrange(5)
+            kind = rng.choice(('LMT', 'LMT', 'LMT', 'STP', 'STPLMT'))
+            price = f"${rng.randint(90, 110) / 10}"
+            if kind == 'STPLMT':
+                price = f"{price} ${rng.randint(90, 110) / 10}"
+            action = f"{rng.choice(('BUY', 'SELL'))} {rng.choice(tickers)} {kind} {price} {rng.randint(1, 20)}"
+            exchange.execute(users[index], action)
+            self.exchange.execute(sharded_users[index], action)
+        self.exchange.sync()
+        self.assertEqual(sorted(self.sink.trades), sorted(single.trades))
+        for user, sharded_user in zip(users, sharded_users):
+            self.assertEqual(user.portfolio, sharded_user.portfolio)
+
+
+if __name__ == '__main__':
+    unittest.main()
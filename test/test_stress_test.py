@@ -0,0 +1,40 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+@author: Desmond Tan
+"""
+import unittest
+
+from stress_test import *
+
+
+class TestScenarios(unittest.TestCase):
+    def test_seeded_runs_are_repeatable(self):
+        scenario = SCENARIOS['cancel_heavy']._replace(actions=500, warmup=50, book_size=100)
+        first = run_scenario(scenario, seed=1)
+        second = run_scenario(scenario, seed=1)
+        self.assertEqual((first['trades'], first['resting_orders']), (second['trades'], second['resting_orders']))
+        self.assertEqual(first['scenario']['cancel_ratio'], 0.3)
+        self.assertEqual(set(first['latency_us']), {'p50', 'p99', 'p99.9', 'max', 'mean'})
+
+    def test_generate_actions(self):
+        scenario = Scenario('test', market_ratio=0, cancel_ratio=0.5, prices='normal')
+        exchange = Exchange(sink=NullSink())
+        users = [Admin('a', exchange), Admin('b', exchange)]
+        owners = []
+        actions = generate_actions(scenario, random.Random(0), users, TICKERS, 200, owners)
+        self.assertEqual(len(actions), 200)
+        orders = [action for _, action in actions if not action.startswith('CANCEL')]
+        self.assertEqual(len(orders), len(owners))
+        self.assertTrue(all(' LMT $' in action for action in orders))
+        for user, action in actions:
+            if action.startswith('CANCEL'):
+                self.assertIs(owners[int(action.split()[1]) - 1], user)
+
+    def test_scenario_tickers(self):
+        self.assertEqual(scenario_tickers(Scenario('test', tickers=2)), TICKERS[:2])
+        self.assertEqual(len(scenario_tickers(Scenario('test', tickers=50))), 50)
+
+
+if __name__ == '__main__':
+    unittest.main()
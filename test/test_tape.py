@@ -0,0 +1,73 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+@author: Desmond Tan
+"""
+import tempfile
+import unittest
+
+from events import NullSink
+from exchange import *
+from tape import *
+from user import *
+
+
+class TestTradeTape(unittest.TestCase):
+    def setUp(self) -> None:
+        self.exchange = Exchange(sink=NullSink(), clock=iter(range(1000)).__next__)
+        self.stock = Stock("AAPL")
+        self.users = self.exchange.user_ids
+        self.john = Admin("John", self.exchange)
+        self.jane = Admin("Jane", self.exchange)
+        self.users.intern(self.john)
+        self.users.intern(self.jane)
+
+    def test_append(self):
+        tape = TradeTape(self.stock, self.users)
+        self.assertIsNone(tape.last_ticks())
+        tape.append(1, 1000, 5, 0, 1)
+        tape.append(2, 1050, 3, 1, 0)
+        self.assertEqual(len(tape), 2)
+        self.assertEqual(tape.last_ticks(), 1050)
+        self.assertEqual(tape.row(0), (1, 1000, 5, 0, 1))
+        trade = tape[-1]
+        self.assertEqual((trade.buyer, trade.seller, trade.price, trade.quantity), (self.jane, self.john, 10.5, 3))
+        self.assertEqual(str(trade), "Jane bought 3 shares from John at $10.50 each.")
+        self.assertEqual(list(tape.column("ticks")), [1000, 1050])
+
+    def test_extend(self):
+        with tempfile.TemporaryDirectory() as directory:
+            tape = TradeTape(self.stock, self.users, directory, flush_size=2)
+            tape.append(1, 1000, 5, 0, 1)
+            tape.extend(2, 1050, [3, 4, 1], [1, 0, 0], [0, 1, 1])
+            self.assertEqual(tape.flushed, 4)
+            self.assertEqual([tape.row(i) for i in range(len(tape))],
+                             [(1, 1000, 5, 0, 1), (2, 1050, 3, 1, 0), (2, 1050, 4, 0, 1), (2, 1050, 1, 0, 1)])
+            tape.close()
+
+    def test_flush_and_reopen(self):
+        with tempfile.TemporaryDirectory() as directory:
+            tape = TradeTape(self.stock, self.users, directory, flush_size=2)
+            for i in range(5):
+                tape.append(i, 1000 + i, 1, 0, 1)
+            self.assertEqual(tape.flushed, 4)
+            self.assertEqual(tape.row(3), (3, 1003, 1, 0, 1))
+            self.assertEqual(tape.row(4), (4, 1004, 1, 0, 1))
+            tape.close()
+
+            reopened = TradeTape(self.stock, self.users, directory)
+            self.assertEqual(len(reopened), 5)
+            self.assertEqual(reopened.last_ticks(), 1004)
+            self.assertEqual(list(reopened.column("timestamp")), [0, 1, 2, 3, 4])
+            self.assertEqual(reopened[0].seller, self.jane)
+            reopened.close()
+
+    def test_exchange_records_trades(self):
+        exchange = self.exchange
+        exchange.list_stock(self.stock)
+        exchange.execute(self.john, "BUY AAPL LMT $10 10")
+        exchange.execute(self.jane, "SELL AAPL LMT $9 4")
+        tape = exchange.trades["AAPL"]
+        self.assertIsInstance(tape, TradeTape)
+        self.assertEqual(tape.row(0), (0, 1000, 4, 0, 1))
+        self.assertEqual(exchange.get_last_price("AAPL"), 10)
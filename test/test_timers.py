@@ -0,0 +1,58 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+@author: Desmond Tan
+"""
+import random
+import unittest
+
+from timers import *
+
+
+class TestTimerWheel(unittest.TestCase):
+    def test_fires_at_deadline(self):
+        wheel = TimerWheel(now=0, resolution=1, bits=2, levels=2)
+        for deadline in (3, 1, 5, 100, 17):
+            wheel.schedule(deadline, deadline)
+        self.assertEqual(wheel.advance(0), [])
+        self.assertEqual(wheel.advance(3), [1, 3])
+        self.assertEqual(wheel.advance(16), [5])
+        self.assertEqual(wheel.advance(17), [17])
+        self.assertEqual(wheel.count, 1)
+        self.assertEqual(wheel.advance(1000), [100])
+        self.assertEqual(wheel.count, 0)
+
+    def test_past_deadline_fires_on_next_advance(self):
+        wheel = TimerWheel(now=10 ** 9)
+        wheel.schedule(0, 'late')
+        self.assertEqual(wheel.advance(10 ** 9), ['late'])
+
+    def test_matches_sorted_deadlines(self):
+        rng = random.Random(0)
+        wheel = TimerWheel(now=0, resolution=10, bits=3, levels=3)
+        now = 0
+        pending = []
+        for _ in range(200):
+            for _ in range(rng.randrange(20)):
+                deadline = now + rng.choice((rng.randrange(100), rng.randrange(10000), rng.randrange(10 ** 6)))
+                wheel.schedule(deadline, (deadline, len(pending)))
+                pending.append((deadline, len(pending)))
+            now += rng.choice((1, 50, 5000, 200000))
+            # Deadlines are rounded up to a whole tick, so timers never fire early
+            expected = sorted(timer for timer in pending if -(-timer[0] // 10) <= now // 10)
+            pending = [timer for timer in pending if -(-timer[0] // 10) > now // 10]
+            self.assertEqual(sorted(wheel.advance(now)), expected)
+        self.assertEqual(wheel.count, len(pending))
+
+    def test_idle_wheel_skips_ahead(self):
+        wheel = TimerWheel(now=0)
+        wheel.schedule(3600 * 10 ** 9, 'hour')
+        self.assertEqual(wheel.advance(60 * 10 ** 9), [])
+        self.assertEqual(wheel.advance(7200 * 10 ** 9), ['hour'])
+        # An empty wheel moves to now when a timer is scheduled
+        wheel.schedule(7201 * 10 ** 9, 'second', now=7200 * 10 ** 9 + 5)
+        self.assertEqual(wheel.advance(7201 * 10 ** 9), ['second'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -6,6 +6,7 @@
 from exchange import *
 from user import *
 from orders import *
+from ticks import to_units
 import unittest
 
 
@@ -42,6 +43,22 @@ class TestUser(unittest.TestCase):
         with self.assertRaises(Exception):
             user.withdraw(200)
     
+    def test_reserved_cannot_be_withdrawn(self):
+        self.exchange.list_stock(Stock("AAPL"))
+        user = User("John", self.exchange)
+        user.deposit(100)
+        user.add_stock("AAPL", 10)
+        self.exchange.place_limit_order(BuyOrder(user, "AAPL", 10, 6))
+        self.exchange.place_limit_order(SellOrder(user, "AAPL", 11, 8))
+        with self.assertRaises(Exception):
+            user.withdraw(50)
+        with self.assertRaises(Exception):
+            user.remove_stock("AAPL", 3)
+        user.withdraw(40)
+        user.remove_stock("AAPL", 2)
+        self.assertEqual(user.get_balance(), 60)
+        self.assertEqual(user.portfolio["AAPL"], 8)
+
     def test_add_stock(self):
         user = User("John", self.exchange)
         user.add_stock("AAPL", 1)
@@ -78,6 +95,62 @@ class TestUser(unittest.TestCase):
         order = BuyOrder(user, "AAPL", 10, 200)
         self.assertFalse(user.verify_order(order))
 
+    def test_verify_batch(self):
+        user = User("John", self.exchange)
+        user.deposit(250)
+        user.add_stock("AAPL", 10)
+        orders = [
+            BuyOrder(user, "AAPL", 10, 20),
+            BuyOrder(user, "AAPL", 10, 10),
+            SellOrder(user, "AAPL", 10, 6),
+            SellOrder(user, "AAPL", 10, 6),
+            BuyOrder(user, "AAPL", 10, 5),
+        ]
+        self.assertEqual(user.verify_batch(orders), [True, False, True, False, True])
+
+    def test_reserve_and_release(self):
+        self.exchange.list_stock(Stock("AAPL"))
+        user = User("John", self.exchange)
+        user.deposit(150)
+        user.add_stock("AAPL", 10)
+        self.exchange.execute(user, "BUY AAPL LMT $10 10")
+        self.exchange.execute(user, "SELL AAPL LMT $20 6")
+        self.assertEqual((user.reserved, user.reserved_stock), (to_units(100), {"AAPL": 6}))
+        # Only what is not reserved may be committed to another order
+        self.assertFalse(user.verify_order(BuyOrder(user, "AAPL", 10, 6)))
+        self.assertTrue(user.verify_order(BuyOrder(user, "AAPL", 10, 5)))
+        self.assertFalse(user.verify_order(SellOrder(user, "AAPL", 20, 5)))
+        self.assertEqual(user.verify_batch([BuyOrder(user, "AAPL", 10, 5), SellOrder(user, "AAPL", 20, 4)]),
+                         [True, True])
+
+        self.exchange.execute(user, "AMEND 1 4")
+        self.assertEqual(user.reserved, to_units(40))
+        self.exchange.execute(user, "CANCEL 2")
+        self.assertEqual(user.reserved_stock, {"AAPL": 0})
+
+    def test_release_on_fill(self):
+        self.exchange.list_stock(Stock("AAPL"))
+        user = User("John", self.exchange)
+        user.deposit(100)
+        self.exchange.execute(user, "BUY AAPL LMT $10 10")
+        self.exchange.execute(Admin("Jane", self.exchange), "SELL AAPL LMT $8 4")
+        self.assertEqual(user.reserved, to_units(60))
+        self.assertEqual(user.get_balance(), 60)
+
+    def test_market_order_reserves_collar(self):
+        self.exchange.list_stock(Stock("AAPL"))
+        user = User("John", self.exchange)
+        user.deposit(1000)
+        self.assertFalse(user.verify_order(MarketOrder(user, "AAPL", 10, "BUY")))
+        self.exchange.execute(Admin("Jane", self.exchange), "SELL AAPL LMT $50 100")
+        self.exchange.execute(user, "BUY AAPL MKT 10")
+        # 10% above the best ask, as there has not been a trade yet
+        self.assertEqual(user.orders[0].collar, 5500)
+        self.assertEqual(user.reserved, 0)
+        self.assertEqual(user.get_balance(), 500)
+        self.assertFalse(user.verify_order(MarketOrder(user, "AAPL", 10, "BUY")))
+        self.assertTrue(user.verify_order(MarketOrder(user, "AAPL", 9, "BUY")))
+
 
 class TestAdmin(unittest.TestCase):
     def setUp(self) -> None:
@@ -0,0 +1,21 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+@author: Desmond Tan
+
+Fixed-point money. Cash balances and trade values are held as integer units
+of 1/CASH_SCALE dollars, and prices as an integer number of ticks of the
+stock's tick size, so that no rounding error can build up in balances.
+"""
+
+CASH_SCALE = 10000
+
+
+def to_units(amount):
+    """Convert a dollar amount to cash units."""
+    return round(amount * CASH_SCALE)
+
+
+def from_units(units):
+    """Convert cash units to a dollar amount."""
+    return units / CASH_SCALE
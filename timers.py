@@ -0,0 +1,103 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+@author: Desmond Tan
+
+Hierarchical timer wheel, used to expire orders.
+
+Time is counted in ticks of resolution nanoseconds. Level 0 has a slot per
+tick for the current block of 2**bits ticks, level 1 a slot per block of
+level 0 for the current block of 2**(2 * bits) ticks, and so on. A timer is
+put in the lowest level whose current block holds its deadline, so
+scheduling is O(1). When the wheel enters a new block of a level, the slot of
+that block in the level above is emptied into the lower levels. Every timer
+moves down at most once per level, so firing it is O(1) amortized. Deadlines
+beyond the top level wait in an overflow list.
+"""
+
+
+class TimerWheel:
+    def __init__(self, now=0, resolution=10 ** 6, bits=8, levels=4):
+        self.resolution = resolution
+        self.bits = bits
+        self.mask = (1 << bits) - 1
+        self.wheels = [[[] for _ in range(1 << bits)] for _ in range(levels)]
+        # Number of timers in each level
+        self.counts = [0] * levels
+        self.overflow = []
+        self.due = []
+        self.current = now // resolution
+        self.count = 0
+
+    def schedule(self, deadline, item, now=None):
+        """Fire item once the wheel has advanced to deadline, in nanoseconds.
+
+        If the wheel is empty it first moves to now, if given, so that a wheel
+        that has not been advanced for a while does not have to catch up."""
+        if not self.count and now is not None:
+            self.current = max(self.current, now // self.resolution)
+        self.count += 1
+        self.add(-(-deadline // self.resolution), item)
+
+    def add(self, tick, item):
+        if tick <= self.current:
+            self.due.append(item)
+            return
+        bits = self.bits
+        for level in range(len(self.wheels)):
+            # The deadline is in the current block of this level
+            if tick >> (bits * (level + 1)) == self.current >> (bits * (level + 1)):
+                self.wheels[level][(tick >> (bits * level)) & self.mask].append((tick, item))
+                self.counts[level] += 1
+                return
+        self.overflow.append((tick, item))
+
+    def cascade(self):
+        """Move the timers of the blocks the wheel has just entered down a level."""
+        bits = self.bits
+        for level in range(1, len(self.wheels)):
+            if (self.current >> (bits * (level - 1))) & self.mask:
+                return
+            slot = self.wheels[level][(self.current >> (bits * level)) & self.mask]
+            if slot:
+                self.counts[level] -= len(slot)
+                timers = slot[:]
+                slot.clear()
+                for tick, item in timers:
+                    self.add(tick, item)
+        if not (self.current >> (bits * (len(self.wheels) - 1))) & self.mask and self.overflow:
+            timers = self.overflow
+            self.overflow = []
+            for tick, item in timers:
+                self.add(tick, item)
+
+    def advance(self, now):
+        """Advance the wheel to now, in nanoseconds, and get the items that are due."""
+        target = now // self.resolution
+        wheel = self.wheels[0]
+        counts = self.counts
+        while self.current < target and self.count > len(self.due):
+            # Skip ahead over the ticks that cannot fire anything: with the lower
+            # levels empty, nothing happens before the next block of the lowest
+            # level that has timers
+            level = 0
+            while level < len(counts) and not counts[level]:
+                level += 1
+            if level:
+                block = 1 << (self.bits * level)
+                self.current = min(target, self.current - self.current % block + block) - 1
+            self.current += 1
+            if not self.current & self.mask:
+                self.cascade()
+            slot = wheel[self.current & self.mask]
+            if slot:
+                counts[0] -= len(slot)
+                for tick, item in slot:
+                    self.due.append(item)
+                slot.clear()
+        if self.current < target:
+            self.current = target
+        due = self.due
+        self.count -= len(due)
+        self.due = []
+        return due
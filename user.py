@@ -4,47 +4,114 @@
 @author: Desmond Tan
 """
 from orders import *
+from ticks import to_units, from_units
+from positions import Position
 import logging
 
 
 class User:
-    def __init__(self, name, exchange):
+    def __init__(self, name, exchange, history=True):
         self.name = name
         self.exchange = exchange
         self.orders = []
+        # Whether the orders of the user are kept in orders once placed, for VIEW ORDERS
+        self.history = history
 
         # extension
-        self.cash = 0
+        # Cash is held in integer units, see ticks.py
+        self.balance = 0
         self.portfolio = {}
+        # Positions opened by fills, and their value at the prices they were last marked at
+        # in cash units, see mark_positions and positions.py
+        self.positions = {}
+        self.market_value = 0
+        # Cash units and shares held for the open orders, see reserve
+        self.reserved = 0
+        self.reserved_stock = {}
+
+    @property
+    def cash(self):
+        return from_units(self.balance)
 
     def deposit(self, amount):
-        self.cash += amount
+        self.deposit_units(to_units(amount))
         return self.cash
 
     def withdraw(self, amount):
-        if amount > self.cash:
+        self.withdraw_units(to_units(amount))
+        return self.cash
+
+    def deposit_units(self, units):
+        self.balance += units
+
+    def withdraw_units(self, units):
+        # Cash reserved for open orders cannot be withdrawn, their fills would fail
+        if units > self.balance - self.reserved:
             raise Exception("Insufficient funds")
         
-        self.cash -= min(amount, self.cash)
-        return self.cash
+        self.balance -= units
     
     def get_balance(self):
         return self.cash
     
     def get_net_worth(self):
-        portforlio_value = 0
-        for ticker, quantity in self.portfolio.items():
-            price = self.exchange.get_last_price(ticker)
-            if price == 0:
-                price, _ = self.exchange.get_bid_ask(ticker)
-            portforlio_value += price * quantity
-        return self.cash + portforlio_value
+        """Get the cash plus the value of the positions at the last prices."""
+        self.mark_positions()
+        return from_units(self.balance + self.market_value)
+
+    def get_pnl(self):
+        """Get the realized and the unrealized P&L of all the positions."""
+        self.mark_positions()
+        realized = sum(position.realized for position in self.positions.values())
+        unrealized = sum(position.unrealized() for position in self.positions.values())
+        return from_units(realized), from_units(unrealized)
+
+    def mark_positions(self):
+        """Mark the positions at the current prices of their stocks, see
+        Exchange.get_mark. Positions are only marked when they are read, so
+        that a trade does not have to revalue every holder of the stock."""
+        get_mark = self.exchange.get_mark
+        for ticker, position in self.positions.items():
+            units = get_mark(ticker)
+            if units != position.mark:
+                self.market_value += position.quantity * (units - position.mark)
+                position.mark = units
+
+    def record_fill(self, ticker, quantity, units):
+        """Update the position in a stock with a fill of a signed quantity at units per share."""
+        position = self.positions.get(ticker)
+        if position is None:
+            position = self.positions[ticker] = Position(units)
+        # Mark the position at the fill first
+        self.market_value += position.quantity * (units - position.mark) + quantity * units
+        position.mark = units
+        position.fill(quantity, units)
 
     def add_stock(self, ticker, quantity):
+        """Add shares that were not bought on the exchange, e.g. the initial
+        holdings of the user. They join the position in the stock at its
+        current mark, see Exchange.get_mark."""
+        self.receive_stock(ticker, quantity)
+        self.transfer_position(ticker, quantity)
+
+    def remove_stock(self, ticker, quantity):
+        """Remove shares that were not sold on the exchange, at the current mark.
+        Shares reserved for open sell orders cannot be removed."""
+        if quantity > self.available_stock(ticker):
+            raise Exception("Insufficient stock")
+        self.deliver_stock(ticker, quantity)
+        self.transfer_position(ticker, -quantity)
+
+    def transfer_position(self, ticker, quantity):
+        self.record_fill(ticker, quantity, self.exchange.get_mark(ticker))
+
+    def receive_stock(self, ticker, quantity):
+        """Add bought shares to the portfolio."""
         self.portfolio.setdefault(ticker, 0)
         self.portfolio[ticker] += quantity
 
-    def remove_stock(self, ticker, quantity):
+    def deliver_stock(self, ticker, quantity):
+        """Take sold shares out of the portfolio."""
         if ticker not in self.portfolio:
             raise Exception("No such stock in portfolio")
         elif self.portfolio[ticker] < quantity:
@@ -52,61 +119,173 @@ class User:
             
         self.portfolio[ticker] -= quantity
 
+    def get_collar(self, order):
+        """Get the collar of an order that fills at the market, see needs_collar.
+        A stop order is collared around its stop price. None if there is no
+        reference price."""
+        if order.collar is not None:
+            return order.collar
+        stop_price = order.price if isinstance(order, StopOrder) else None
+        return self.exchange.get_collar(order.ticker, order.direction, stop_price)
+
+    def fix_collar(self, order):
+        """Fix the collar of an order that fills at the market as it is verified,
+        so that it is reserved and filled within the collar it was verified at,
+        even if the last price moves before it is accepted, e.g. later in a
+        batch. Returns False if there is no reference price for it."""
+        if needs_collar(order):
+            order.collar = self.get_collar(order)
+            return order.collar is not None
+        return True
+
+    def reserve_units(self, order):
+        """Get the cash units needed per share of a buy order: its limit price, or
+        its collar if it fills at the market. None if it has no collar."""
+        if needs_collar(order):
+            collar = self.get_collar(order)
+            if collar is None:
+                return None
+            return collar * self.exchange.stocks[order.ticker].tick_units
+        if isinstance(order, StopOrder):
+            return to_units(order.limit_price)
+        return to_units(order.price)
+
+    def available_stock(self, ticker):
+        """Get the shares of a stock that are not reserved by open sell orders."""
+        return self.portfolio.get(ticker, 0) - self.reserved_stock.get(ticker, 0)
+
     def verify_order(self, order):
+        """Check in O(1) that the user can afford the order, with the cash and
+        stock reserved by its other open orders set aside."""
         # extension: check if the user has enough cash or stock
         if order.user != self:
             logging.critical("Order does not belong to this user")
             return False
 
-        if isinstance(order, MarketOrder):
-            cost = self.exchange.get_last_price(order.ticker) * order.quantity
-        else:
-            cost = order.price * order.quantity
-        if order.direction == "BUY" and cost > self.cash:
-            logging.critical("Insufficient funds")
+        if order.quantity <= 0:
+            self.reject("Invalid quantity.")
+            return False
+
+        if not self.fix_collar(order):
+            self.reject("No reference price for a market order.")
             return False
 
-        if order.direction == "SELL" and (not self.portfolio[order.ticker] or self.portfolio[order.ticker] < order.quantity):
-            logging.critical("Insufficient stock")
+        if order.direction == "BUY" and \
+                self.reserve_units(order) * order.quantity > self.balance - self.reserved:
+            self.reject("Insufficient funds.")
+            return False
+
+        if order.direction == "SELL" and self.available_stock(order.ticker) < order.quantity:
+            self.reject("Insufficient stock.")
             return False
 
         return True
 
+    def reject(self, message):
+        """Tell the user why an order was rejected, through the sink of the exchange."""
+        self.exchange.sink.status(message)
+
+    def verify_batch(self, orders):
+        """Verify a batch of orders as a whole.
+
+        The cash and stock needed by the earlier orders of the batch are reserved
+        for them, so that the batch can never commit more than the user has.
+        Returns whether each order is accepted."""
+        cash = self.balance - self.reserved
+        stock = {}
+        accepted = []
+        for order in orders:
+            if order.user != self:
+                logging.critical("Order does not belong to this user")
+                accepted.append(False)
+                continue
+
+            if not self.fix_collar(order):
+                logging.critical("No reference price for a market order")
+                ok = False
+            elif order.direction == "BUY":
+                cost = self.reserve_units(order) * order.quantity
+                ok = cost <= cash
+                if ok:
+                    cash -= cost
+                else:
+                    logging.critical("Insufficient funds")
+            else:
+                held = stock.get(order.ticker, self.available_stock(order.ticker))
+                ok = held >= order.quantity
+                if ok:
+                    stock[order.ticker] = held - order.quantity
+                else:
+                    logging.critical("Insufficient stock")
+            accepted.append(ok)
+        return accepted
+
+    def reserve(self, order):
+        """Reserve the cash or stock for the open quantity of an accepted order,
+        until it is filled or cancelled. Fixes the collar of an order that fills
+        at the market if it was not verified, see fix_collar."""
+        if order.reserve is not None:
+            # Handed over by the stop order it was, see StopOrder.trigger
+            return
+        if needs_collar(order):
+            order.collar = self.get_collar(order)
+        if order.direction == "BUY":
+            order.reserve = self.reserve_units(order)
+        else:
+            order.reserve = 0
+        self.hold(order, order.quantity - order.filled)
+
+    def hold(self, order, quantity):
+        """Reserve the cash or stock for some more shares of a reserved order."""
+        if order.reserve is None:
+            return
+        if order.direction == "BUY":
+            self.reserved += quantity * order.reserve
+        else:
+            self.reserved_stock[order.ticker] = self.reserved_stock.get(order.ticker, 0) + quantity
+
+    def release(self, order, quantity):
+        """Release what was reserved for some shares of an order, as they are filled or cancelled."""
+        if order.reserve is None:
+            return
+        if order.direction == "BUY":
+            self.reserved -= quantity * order.reserve
+        else:
+            self.reserved_stock[order.ticker] -= quantity
+
     def place_order(self, order):
-        self.orders.append(order)
+        if self.history:
+            self.orders.append(order)
 
     def view_orders(self):
+        sink = self.exchange.sink
         for ind, order in enumerate(self.orders):
-            print(f"{ind+1}. {order}")
+            sink.status(f"{ind+1}. {order}")
     
     def view_portfolio(self):
-        print(f"{self.name}'s portfolio:")
-        print(f"* Cash: ${self.cash:.2f}")
+        sink = self.exchange.sink
+        sink.status(f"{self.name}'s portfolio:")
+        sink.status(f"* Cash: ${self.cash:.2f}")
         for ticker, quantity in self.portfolio.items():
-            print(f"* {ticker}: {quantity}")
+            sink.status(f"* {ticker}: {quantity}")
 
     def __str__(self) -> str:
         return self.name
 
 
 class Admin(User):
-    def __init__(self, name, exchange):
-        super().__init__(name, exchange)
-
-    def deposit(self, amount):
-        self.cash += amount
-        return self.cash
+    def __init__(self, name, exchange, history=True):
+        super().__init__(name, exchange, history)
 
-    def withdraw(self, amount):
+    def withdraw_units(self, units):
         # cash would not go below 0
-        self.cash -= min(amount, self.cash)
-        return self.cash
-
-    def add_stock(self, ticker, quantity):
-        self.portfolio.setdefault(ticker, 0)
-        self.portfolio[ticker] += quantity
+        self.balance -= min(units, self.balance)
 
     def remove_stock(self, ticker, quantity):
+        # Stock quantity would not go below 0
+        super().remove_stock(ticker, min(quantity, self.portfolio.get(ticker, 0)))
+
+    def deliver_stock(self, ticker, quantity):
         # Stock quantity would not go below 0
         self.portfolio.setdefault(ticker, 0)
         self.portfolio[ticker] -= min(quantity, self.portfolio[ticker])
@@ -116,4 +295,18 @@ class Admin(User):
             logging.critical("Order does not belong to this user")
             return False
 
-        return True
\ No newline at end of file
+        if order.quantity <= 0:
+            self.reject("Invalid quantity.")
+            return False
+
+        return True
+
+    def reserve(self, order):
+        # Admins are not limited by their cash or stock, nor by a collar
+        pass
+
+    def verify_batch(self, orders):
+        accepted = [order.user == self for order in orders]
+        if not all(accepted):
+            logging.critical("Order does not belong to this user")
+        return accepted
\ No newline at end of file